@@ -0,0 +1,420 @@
+# encoding: UTF-8
+"""
+Benchmark suite for larv.
+
+Builds synthetic worlds of the given sizes (entities having a random mix of
+component types) and times every public operation of the EntityManager,
+the GroupManager, the PriorityList and full Engine.update ticks.
+Results are printed as a table and can be written as JSON, and compared with
+a previous JSON run to catch performance regressions between versions.
+
+Operations that can be repeated on the same state (lookups, queries, engine
+ticks) are calibrated like timeit.Timer.autorange: the number of calls per
+sample grows until a sample lasts --min-time seconds. Operations consuming
+their state (creating or removing entities...) are timed on a fresh world
+every call, as many calls as needed for --min-time too. Every benchmark
+keeps the median of --repeat samples and their noise (median absolute
+deviation, relative to the median), and a comparison only reports a
+regression when the medians differ by more than the threshold and by more
+than the noise of both runs. A small reference workload is timed before
+every sample and the comparison uses the times relative to it, so the
+machine getting slower or faster between two runs (frequency scaling,
+other processes) doesn't show up as a change.
+
+Usage (from the root of the repository):
+    python benchmarks/benchmark.py
+    python benchmarks/benchmark.py --sizes 1000 10000 100000 1000000 --output new.json
+    python benchmarks/benchmark.py --compare old.json --threshold 20
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import larv
+
+
+def makeComponentClasses(count):
+    """Returns count component classes, each one with a single 'value' field."""
+    def __init__(self, value = 0):
+        self.value = value
+    return list(type('BenchComponent{0}'.format(i), (larv.Component,),
+                     {'__init__': __init__, 'columns': (('value', 'f8'),)})
+                for i in range(count))
+
+
+class QuerySystem(larv.System):
+    """System touching every entity having its two components."""
+    def __init__(self, component_a, component_b):
+        self.component_a = component_a
+        self.component_b = component_b
+
+    def update(self):
+        count = 0
+        for entity, a, b in self.entity_manager.query(self.component_a, self.component_b):
+            a.value += b.value
+            count += 1
+        return count
+
+
+class BenchEntityFactory(larv.EntityFactory):
+    pass
+
+
+class World:
+    """
+    Synthetic world: an engine with size entities, every entity having each of
+    the component classes with probability mix, and belonging to some groups.
+    """
+    def __init__(self, size, classes, mix, groups, seed):
+        self.random = random.Random(seed)
+        self.classes = classes
+        self.engine = larv.Engine(BenchEntityFactory())
+        self.entity_manager = self.engine.entity_manager
+        self.group_manager = self.engine.group_manager
+        self.entities = self.entity_manager.createEntities(size)
+        for component_class in classes:
+            owners = list(entity for entity in self.entities if self.random.random() < mix)
+            self.entity_manager.addComponents(owners, component_class,
+                list(component_class(1.0) for _ in owners))
+        self.groups = list('group{0}'.format(i) for i in range(groups))
+        for entity in self.entities:
+            self.group_manager.add(entity, self.random.choice(self.groups))
+            self.group_manager.add(entity, self.random.choice(self.groups))
+
+    def sample(self, count):
+        """Returns count random entities of the world."""
+        return self.random.sample(self.entities, min(count, len(self.entities)))
+
+
+REFERENCE_LOOPS = 10
+
+
+def timeLoops(function, loops):
+    """
+    Returns the wall time (seconds) of calling function() loops times, with
+    the garbage collector disabled (as timeit does).
+    """
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        for _ in range(loops):
+            function()
+        return time.perf_counter() - start
+    finally:
+        gc.enable()
+
+
+def autorange(function, min_time):
+    """
+    Returns the number of calls (1, 2, 5, 10, 20, 50...) of function() needed
+    for them to last at least min_time seconds, as timeit.Timer.autorange.
+    """
+    loops = 1
+    while True:
+        for multiplier in (1, 2, 5):
+            if timeLoops(function, loops * multiplier) >= min_time:
+                return loops * multiplier
+        loops *= 10
+
+
+def reference():
+    """
+    Fixed pure Python workload timed next to every sample, so results can be
+    made relative to the speed the machine had at that moment.
+    """
+    values = {}
+    for i in range(2000):
+        values[i] = [i, str(i)]
+    return sum(len(value[1]) for value in values.values())
+
+
+def measure(setup, reusable, repeat, min_time):
+    """
+    Returns (list of seconds per call, list of seconds of the reference
+    workload timed right before every sample, calls per sample) of the
+    callable returned by setup().
+    @reusable: the callable can be called again on the same state, so it is
+               calibrated; otherwise every call of a sample is made on a
+               fresh state (setup is not timed), until the calls of the
+               sample last min_time seconds.
+    """
+    samples = []
+    references = []
+    if not reusable:
+        calls = 0
+        for _ in range(repeat):
+            references.append(timeLoops(reference, REFERENCE_LOOPS) / REFERENCE_LOOPS)
+            elapsed = 0.0
+            loops = 0
+            while elapsed < min_time or loops == 0:
+                elapsed += timeLoops(setup(), 1)
+                loops += 1
+            samples.append(elapsed / loops)
+            calls += loops
+        return samples, references, calls // repeat
+    function = setup()
+    function() # warm up
+    loops = autorange(function, min_time)
+    for _ in range(repeat):
+        references.append(timeLoops(reference, REFERENCE_LOOPS) / REFERENCE_LOOPS)
+        samples.append(timeLoops(function, loops) / loops)
+    return samples, references, loops
+
+
+def noiseOf(samples):
+    """Median absolute deviation of the samples, relative to their median."""
+    median = statistics.median(samples)
+    if not median:
+        return 0.0
+    return statistics.median(abs(sample - median) for sample in samples) / median
+
+
+def benchmarks(size, args):
+    """
+    Yields (name, operations, setup, reusable) for the given world size.
+    setup is a callable returning the callable to time, which does operations
+    operations per call (1 for the bulk queries, timed per call). reusable
+    tells if it can be called repeatedly on the same state.
+    """
+    classes = makeComponentClasses(args.components)
+    comp_a, comp_b = classes[0], classes[1]
+    seed = args.seed
+    ops = min(size, args.operations)
+
+    def fresh():
+        return World(size, classes, args.mix, args.groups, seed)
+
+    # Entity lifecycle
+    def createEntity():
+        entity_manager = larv.EntityManager()
+        return lambda: [entity_manager.createEntity() for _ in range(size)]
+    yield 'createEntity', size, createEntity, False
+
+    def createEntities():
+        entity_manager = larv.EntityManager()
+        return lambda: entity_manager.createEntities(size)
+    yield 'createEntities', size, createEntities, False
+
+    def removeEntity():
+        world = fresh()
+        victims = world.sample(ops)
+        return lambda: [world.entity_manager.removeEntity(entity) for entity in victims]
+    yield 'removeEntity', ops, removeEntity, False
+
+    # Components
+    def addComponent():
+        entity_manager = larv.EntityManager()
+        entities = entity_manager.createEntities(size)
+        components = list(comp_a(1.0) for _ in entities)
+        return lambda: [entity_manager.addComponent(entity, component)
+                        for entity, component in zip(entities, components)]
+    yield 'addComponent', size, addComponent, False
+
+    def addComponents():
+        entity_manager = larv.EntityManager()
+        entities = entity_manager.createEntities(size)
+        components = list(comp_a(1.0) for _ in entities)
+        return lambda: entity_manager.addComponents(entities, comp_a, components)
+    yield 'addComponents', size, addComponents, False
+
+    def removeComponent():
+        world = fresh()
+        victims = world.sample(ops)
+        return lambda: [world.entity_manager.removeComponent(entity, comp_a) for entity in victims]
+    yield 'removeComponent', ops, removeComponent, False
+
+    def getComponent():
+        world = fresh()
+        targets = world.sample(ops)
+        return lambda: [world.entity_manager.getComponent(entity, comp_a) for entity in targets]
+    yield 'getComponent', ops, getComponent, True
+
+    def hasComponent():
+        world = fresh()
+        targets = world.sample(ops)
+        return lambda: [world.entity_manager.hasComponent(entity, comp_a) for entity in targets]
+    yield 'hasComponent', ops, hasComponent, True
+
+    # Queries
+    def getEntitiesHavingComponent():
+        world = fresh()
+        return lambda: world.entity_manager.getEntitiesHavingComponent(comp_a)
+    yield 'getEntitiesHavingComponent', 1, getEntitiesHavingComponent, True
+
+    def getEntitiesHavingComponents():
+        world = fresh()
+        return lambda: world.entity_manager.getEntitiesHavingComponents(comp_a, comp_b)
+    yield 'getEntitiesHavingComponents', 1, getEntitiesHavingComponents, True
+
+    def registeredQuery():
+        world = fresh()
+        world.entity_manager.registerQuery(comp_a, comp_b)
+        return lambda: world.entity_manager.getEntitiesHavingComponents(comp_a, comp_b)
+    yield 'getEntitiesHavingComponents(registered)', 1, registeredQuery, True
+
+    def query():
+        world = fresh()
+        return lambda: list(world.entity_manager.query(comp_a, comp_b))
+    yield 'query', 1, query, True
+
+    def getComponentsOfEntity():
+        world = fresh()
+        targets = world.sample(ops)
+        return lambda: [world.entity_manager.getComponentsOfEntity(entity) for entity in targets]
+    yield 'getComponentsOfEntity', ops, getComponentsOfEntity, True
+
+    # Groups
+    def groupAdd():
+        world = fresh()
+        targets = world.sample(ops)
+        return lambda: [world.group_manager.add(entity, 'bench') for entity in targets]
+    yield 'GroupManager.add', ops, groupAdd, False
+
+    def groupGet():
+        world = fresh()
+        return lambda: world.group_manager.get(world.groups[0])
+    yield 'GroupManager.get', 1, groupGet, True
+
+    def groupGetMany():
+        world = fresh()
+        return lambda: world.group_manager.get(*world.groups[:2])
+    yield 'GroupManager.get(2 groups)', 1, groupGetMany, True
+
+    def groupRemoveCompletely():
+        world = fresh()
+        targets = world.sample(ops)
+        return lambda: [world.group_manager.removeCompletely(entity) for entity in targets]
+    yield 'GroupManager.removeCompletely', ops, groupRemoveCompletely, False
+
+    # Systems
+    def priorityListAdd():
+        priorities = list(random.Random(seed).random() for _ in range(min(size, 10000)))
+        def run():
+            priority_list = larv.PriorityList()
+            for priority in priorities:
+                priority_list.add(priority, priority)
+        return run
+    yield 'PriorityList.add', min(size, 10000), priorityListAdd, True
+
+    def engineUpdate():
+        world = fresh()
+        for priority, (first, second) in enumerate(zip(classes, classes[1:])):
+            world.engine.addSystem(QuerySystem(first, second), priority)
+        return world.engine.update
+    yield 'Engine.update', 1, engineUpdate, True
+
+
+def run(args):
+    results = []
+    print('{0:>8} {1:<42} {2:>14} {3:>7} {4:>14}'.format(
+        'size', 'benchmark', 'per call', 'noise', 'ops/s'))
+    for size in args.sizes:
+        for name, operations, setup, reusable in benchmarks(size, args):
+            if args.filter and args.filter not in name:
+                continue
+            samples, references, loops = measure(setup, reusable, args.repeat, args.min_time)
+            seconds = statistics.median(samples)
+            relative = list(sample / reference_seconds
+                            for sample, reference_seconds in zip(samples, references))
+            result = {'name': name,
+                      'size': size,
+                      'operations': operations,
+                      'loops': loops,
+                      'samples': samples,
+                      'seconds': seconds,
+                      'noise': noiseOf(samples),
+                      'reference': statistics.median(references),
+                      'relative': statistics.median(relative),
+                      'relative_noise': noiseOf(relative),
+                      'ops_per_second': operations / seconds if seconds and operations > 1 else None}
+            results.append(result)
+            print('{0:>8} {1:<42} {2:>12.3f}us {3:>6.1f}% {4:>14}'.format(
+                size, name, seconds * 1e6, result['noise'] * 100,
+                '{0:,.0f}'.format(result['ops_per_second']) if result['ops_per_second'] else '-'))
+            sys.stdout.flush()
+    return results
+
+
+def compare(results, baseline_path, threshold, noise_factor = 3.0):
+    """
+    Prints the operations whose median is slower than the baseline one by
+    more than threshold % and by more than noise_factor times the noise
+    (median absolute deviation) of both runs. Returns how many there are.
+    Times relative to the reference workload are compared when both runs
+    have them, so a machine running slower as a whole isn't a regression.
+    """
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)
+    old = dict(((result['name'], result['size']), result) for result in baseline['results'])
+    regressions = 0
+    for result in results:
+        old_result = old.get((result['name'], result['size']), None)
+        if old_result is None:
+            continue
+        if 'relative' in old_result:
+            key, noise_key = 'relative', 'relative_noise'
+        else:
+            key, noise_key = 'seconds', 'noise'
+        old_value, value = old_result[key], result[key]
+        if not old_value:
+            continue
+        difference = value - old_value
+        noise = noise_factor * (result[noise_key] * value + old_result.get(noise_key, 0.0) * old_value)
+        change = difference / old_value * 100
+        if change > threshold and difference > noise:
+            regressions += 1
+            print('REGRESSION {0} ({1}): {2:+.1f}% (noise {3:.1f}%)'.format(
+                result['name'], result['size'], change, noise / old_value * 100))
+    return regressions
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'larv benchmark suite')
+    parser.add_argument('--sizes', type = int, nargs = '+', default = [1000, 10000, 100000],
+                        help = 'number of entities of every synthetic world')
+    parser.add_argument('--components', type = int, default = 4,
+                        help = 'number of component types in the mix (at least 2)')
+    parser.add_argument('--mix', type = float, default = 0.5,
+                        help = 'probability of an entity having each component type')
+    parser.add_argument('--groups', type = int, default = 8, help = 'number of groups')
+    parser.add_argument('--operations', type = int, default = 10000,
+                        help = 'most operations timed by the per-entity benchmarks')
+    parser.add_argument('--repeat', type = int, default = 5,
+                        help = 'samples per benchmark, the median is kept')
+    parser.add_argument('--min-time', type = float, default = 0.05,
+                        help = 'least seconds per sample of the calibrated benchmarks')
+    parser.add_argument('--seed', type = int, default = 1)
+    parser.add_argument('--filter', default = None, help = 'only run benchmarks containing this')
+    parser.add_argument('--output', default = None, help = 'path of the JSON results')
+    parser.add_argument('--compare', default = None, help = 'JSON results of a previous run')
+    parser.add_argument('--threshold', type = float, default = 20.0,
+                        help = 'percent slower than --compare reported as regression')
+    parser.add_argument('--noise-factor', type = float, default = 3.0,
+                        help = 'times the noise of both runs a regression must exceed')
+    args = parser.parse_args(argv)
+    assert args.components >= 2
+
+    results = run(args)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({'meta': {'python': platform.python_version(),
+                                'implementation': platform.python_implementation(),
+                                'platform': platform.platform(),
+                                'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                                'arguments': vars(args)},
+                       'results': results}, output_file, indent = 1)
+    if args.compare:
+        return 1 if compare(results, args.compare, args.threshold, args.noise_factor) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,228 @@
+# encoding: UTF-8
+import sys
+import weakref
+
+class ChangeTracker:
+    """
+    Change log of the component types tracked by an entity manager (see
+    larv.EntityManager.EntityManager.trackChanges): for every tracked type,
+    which entities got the component added, changed or removed, and when.
+
+    Every recorded change gets a new version number (self.version increases
+    by one each time). Reading the changes since a version only walks the
+    changes newer than it, so incremental systems cost O(changes), not
+    O(entities):
+        cursor = tracker.version
+        ...
+        moved = tracker.since('changed', position_type_id, cursor)
+
+    Each log keeps an entity once (with the version of its latest change), so
+    memory grows with the number of entities, not with the number of changes.
+    An entity whose component is removed leaves the added and changed logs.
+    Removed entities only stay in the removed log until every consumer has
+    read them: consumers (systems, spatial indexes, replication servers...)
+    report the version they have read up to with setCursor, and the removals
+    at or below the oldest cursor are dropped (see trim, called by itself as
+    the log grows). With no consumer reporting cursors nothing is dropped
+    automatically, call trim with the version every reader is past.
+    """
+    # Least number of removals recorded between two automatic trims
+    TRIM_MIN = 1024
+
+    ADDED = 'added'
+    CHANGED = 'changed'
+    REMOVED = 'removed'
+
+    def __init__(self):
+        """
+        Constructor.
+        @self.version: version of the latest recorded change.
+        @self.trimmed: removals at or below this version have been dropped
+                       from the removed logs (see trim).
+        @self.__logs: dict, key = component type id, value = dict, key = kind
+                      ('added', 'changed' or 'removed'), value = dict, key =
+                      entity id, value = version of its latest change, kept in
+                      version order (moved to the end when updated).
+        """
+        self.version = 0
+        self.trimmed = 0
+        self.__logs = {}
+        self.__cursors = weakref.WeakKeyDictionary() # consumer -> dict, key -> version
+        self.__removals = 0 # removals recorded since the last trim
+        self.__trim_at = self.TRIM_MIN
+
+    def track(self, type_id):
+        """Starts tracking the changes of the given component type id."""
+        if type_id not in self.__logs:
+            self.__logs[type_id] = {self.ADDED: {}, self.CHANGED: {}, self.REMOVED: {}}
+
+    def untrack(self, type_id):
+        """Stops tracking (and forgets the changes of) the given component type id."""
+        self.__logs.pop(type_id, None)
+
+    def isTracked(self, type_id):
+        """Returns True if the given component type id is being tracked."""
+        return type_id in self.__logs
+
+    def recordAdded(self, ids, type_id):
+        """
+        Records that the given entity id's got a component of the given type.
+        An added component counts as changed too.
+        @ids: iterable of entity id's.
+        """
+        logs = self.__logs.get(type_id, None)
+        if logs is None:
+            return None
+        added, changed, removed = logs[self.ADDED], logs[self.CHANGED], logs[self.REMOVED]
+        version = self.version
+        for id_ in ids:
+            version += 1
+            added.pop(id_, None)
+            added[id_] = version
+            changed.pop(id_, None)
+            changed[id_] = version
+            removed.pop(id_, None)
+        self.version = version
+
+    def recordChanged(self, ids, type_id):
+        """
+        Records that the component of the given type of the given entity id's
+        changed.
+        @ids: iterable of entity id's.
+        """
+        logs = self.__logs.get(type_id, None)
+        if logs is None:
+            return None
+        changed = logs[self.CHANGED]
+        version = self.version
+        for id_ in ids:
+            version += 1
+            changed.pop(id_, None)
+            changed[id_] = version
+        self.version = version
+
+    def recordRemoved(self, ids, type_id):
+        """
+        Records that the given entity id's lost their component of the given type.
+        @ids: iterable of entity id's.
+        """
+        logs = self.__logs.get(type_id, None)
+        if logs is None:
+            return None
+        added, changed, removed = logs[self.ADDED], logs[self.CHANGED], logs[self.REMOVED]
+        version = self.version
+        for id_ in ids:
+            version += 1
+            added.pop(id_, None)
+            changed.pop(id_, None)
+            removed.pop(id_, None)
+            removed[id_] = version
+        self.__removals += version - self.version
+        self.version = version
+        if self.__removals > self.__trim_at:
+            self.trim()
+
+    def since(self, kind, type_id, version):
+        """
+        Returns the list of the entity id's with a change of the given kind
+        newer than the given version, oldest first.
+        @kind: 'added', 'changed' (includes the added) or 'removed'.
+        @type_id: tracked component type id.
+        @version: version previously read from self.version (0 for everything).
+        """
+        logs = self.__logs.get(type_id, None)
+        if logs is None:
+            raise KeyError('Error: component type {0} is not tracked'.format(type_id))
+        ids = []
+        for id_, id_version in reversed(logs[kind].items()):
+            if id_version <= version:
+                break
+            ids.append(id_)
+        ids.reverse()
+        return ids
+
+    def memoryUsage(self):
+        """
+        Returns the number of logged changes and the estimated bytes of the
+        logs holding them.
+        """
+        count = 0
+        size = sys.getsizeof(self.__logs)
+        for logs in self.__logs.values():
+            size += sys.getsizeof(logs)
+            for log in logs.values():
+                count += len(log)
+                size += sys.getsizeof(log) + sum(map(sys.getsizeof, log.values()))
+        return count, size
+
+    def setCursor(self, consumer, version, key = None):
+        """
+        Records that the given consumer has read every change up to the given
+        version (for the given key, if it reads several things separately).
+        Consumers are weakly referenced, so they don't have to be removed
+        when they are garbage collected (see removeCursors otherwise).
+        @consumer: object reading the changes (a system, an index...).
+        @version: version it read up to.
+        @key: hashable telling apart the cursors of the same consumer.
+        """
+        self.__cursors.setdefault(consumer, {})[key] = version
+
+    def removeCursors(self, consumer):
+        """Forgets the cursors of the given consumer, which stops reading."""
+        self.__cursors.pop(consumer, None)
+
+    def oldestCursor(self):
+        """Returns the version of the oldest consumer cursor, None if there isn't any."""
+        versions = list(version for cursors in list(self.__cursors.values())
+                        for version in cursors.values())
+        if not versions:
+            return None
+        return min(versions)
+
+    def trim(self, version = None):
+        """
+        Drops the removals recorded at or below the given version from the
+        removed logs (the added and changed logs are bounded by the live
+        entities), so the removed logs don't grow forever with generational
+        id's. Readers asking for changes since an older version won't get
+        those removals any more. Returns the number of entries dropped.
+        @version: None for the oldest consumer cursor (see setCursor), in
+                  which case nothing is dropped if there aren't cursors.
+        """
+        if version is None:
+            version = self.oldestCursor()
+            if version is None:
+                self.__trim_at = max(self.TRIM_MIN, 2 * self.__trim_at)
+                return 0
+        dropped = 0
+        remaining = 0
+        for logs in self.__logs.values():
+            removed = logs[self.REMOVED]
+            old = []
+            for id_, id_version in removed.items():
+                if id_version > version:
+                    break
+                old.append(id_)
+            for id_ in old:
+                del removed[id_]
+            dropped += len(old)
+            remaining += len(removed)
+        self.trimmed = max(self.trimmed, version)
+        self.__removals = 0
+        self.__trim_at = max(self.TRIM_MIN, 2 * remaining)
+        return dropped
+
+    def clear(self):
+        """Forgets every recorded change (the version keeps increasing)."""
+        for type_id in self.__logs:
+            self.__logs[type_id] = {self.ADDED: {}, self.CHANGED: {}, self.REMOVED: {}}
+        self.__removals = 0
+
+    ##### PYTHONIC METHODS FOR EASIER PROGRAMMING
+    def __contains__(self, type_id):
+        """Defines the usage of: type_id in tracker."""
+        return type_id in self.__logs
+
+    def __str__(self):
+        """Returns a string representation."""
+        return 'ChangeTracker: version {0}, {1} tracked types'.format(self.version, len(self.__logs))
@@ -0,0 +1,288 @@
+# -*- coding: UTF-8 -*-
+import sys
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class ColumnStore:
+    """
+    Struct-of-arrays storage for a component type with numeric fields.
+    Every field declared by the component class lives in its own contiguous
+    numpy array, so a System can update every entity having the component
+    with a single vectorized expression instead of looping in Python.
+
+    The component class declares its fields with a 'columns' class attribute,
+    a tuple of (field name, numpy dtype) pairs:
+        class PositionComponent(larv.Component):
+            columns = (('x', 'f8'), ('y', 'f8'))
+            def __init__(self, x, y):
+                self.x = x
+                self.y = y
+
+    Then the storage is enabled (opt-in) on the entity manager:
+        entity_manager.registerColumnarComponent(PositionComponent)
+
+    Components are still added with EntityManager.addComponent (their field
+    values get copied into the columns) and the store behaves like the
+    dictionary {entity id: component} it replaces in components_by_class,
+    but getting a component returns a ColumnRow that reads and writes
+    through to the arrays.
+
+    Vectorized usage (in a System.update):
+        positions = self.entity_manager.getColumns(PositionComponent)
+        positions.x += positions.speed_x * dt
+        # positions.ids holds the entity id of every row
+
+    NOTE: the arrays returned by the store are views of the live rows, which
+          are reallocated when the store grows and reordered when a component
+          is removed (the last row fills the hole). Fetch them on every update
+          instead of keeping them around.
+    """
+    def __init__(self, component_class, capacity = 64):
+        """
+        Constructor.
+        @component_class: larv.Component subclass with a 'columns' attribute.
+        @capacity: initial number of rows allocated, doubles when needed.
+        @self.__arrays: dict, key = field name, value = numpy array.
+        @self.__row_of: dict, key = entity id, value = row in the arrays.
+        """
+        if numpy is None:
+            raise ImportError('numpy is needed for columnar component storage')
+        assert len(component_class.columns) > 0
+        object.__setattr__(self, 'component_class', component_class)
+        object.__setattr__(self, 'fields', tuple(name for name, dtype in component_class.columns))
+        object.__setattr__(self, 'count', 0)
+        object.__setattr__(self, '_ColumnStore__arrays',
+                           dict((name, numpy.zeros(capacity, dtype))
+                                for name, dtype in component_class.columns))
+        object.__setattr__(self, '_ColumnStore__ids', numpy.zeros(capacity, numpy.int64))
+        object.__setattr__(self, '_ColumnStore__row_of', {})
+        object.__setattr__(self, 'change_tracker', None)
+
+    @property
+    def ids(self):
+        """Returns the array with the entity id of every live row."""
+        return self.__ids[:self.count]
+
+    @property
+    def columns(self):
+        """Returns a dict, key = field name, value = array of the live rows."""
+        return dict((name, array[:self.count]) for name, array in self.__arrays.items())
+
+    def column(self, name):
+        """Returns the array of the live rows of the given field."""
+        return self.__arrays[name][:self.count]
+
+    def setChangeTracker(self, change_tracker):
+        """
+        Makes the ColumnRows of the store record their field assignments as
+        changes in the given larv.ChangeTracker.ChangeTracker (None to stop).
+        """
+        object.__setattr__(self, 'change_tracker', change_tracker)
+
+    def memoryUsage(self, sample = 256):
+        """
+        Returns the estimated (overhead, payload) bytes of the store: the
+        payload is the used rows of the columns, the overhead the id's, the
+        row index and the unused capacity.
+        @sample: unused, the columns are measured exactly.
+        """
+        payload = sum(array.itemsize * self.count for array in self.__arrays.values())
+        allocated = sum(array.nbytes for array in self.__arrays.values())
+        overhead = self.__ids.nbytes + sys.getsizeof(self.__row_of) + allocated - payload
+        return overhead, payload
+
+    def rowOf(self, id_):
+        """Returns the row where the given entity id is stored."""
+        return self.__row_of[id_]
+
+    def materialize(self, id_):
+        """
+        Returns a standalone instance of the component class holding a copy of
+        the values of the given entity (bypassing its __init__).
+        """
+        row = self.__row_of[id_]
+        component = self.component_class.__new__(self.component_class)
+        for name in self.fields:
+            setattr(component, name, self.__arrays[name][row].item())
+        return component
+
+    def __grow(self):
+        """Doubles the capacity of every array."""
+        capacity = max(1, 2 * len(self.__ids))
+        for name, array in self.__arrays.items():
+            new_array = numpy.zeros(capacity, array.dtype)
+            new_array[:self.count] = array[:self.count]
+            self.__arrays[name] = new_array
+        new_ids = numpy.zeros(capacity, numpy.int64)
+        new_ids[:self.count] = self.__ids[:self.count]
+        object.__setattr__(self, '_ColumnStore__ids', new_ids)
+
+    ##### DICTIONARY INTERFACE (used by larv.EntityManager.EntityManager)
+    def __setitem__(self, id_, component):
+        """Copies the fields of the given component into the row of the entity."""
+        row = self.__row_of.get(id_, None)
+        if row is None:
+            if self.count == len(self.__ids):
+                self.__grow()
+            row = self.count
+            self.__ids[row] = id_
+            self.__row_of[id_] = row
+            object.__setattr__(self, 'count', self.count + 1)
+        for name in self.fields:
+            self.__arrays[name][row] = getattr(component, name)
+
+    def extend(self, ids, components):
+        """
+        Bulk version of __setitem__, filling the rows of every given entity id.
+        An id given more than once gets the values of its last occurrence, as
+        if __setitem__ had been called for every id in turn.
+        @ids: list of entity id's.
+        @components: list of components (one per id) or dict, key = field name,
+                     value = sequence or array with one value per id.
+        """
+        if not isinstance(components, dict):
+            assert len(components) == len(ids)
+            components = dict((name, list(getattr(component, name) for component in components))
+                              for name in self.fields)
+        values = dict((name, numpy.asarray(components[name])) for name in self.fields)
+
+        # Repeated id's: keep the last occurrence only, so every id gets one row
+        last = dict(zip(ids, range(len(ids))))
+        if len(last) != len(ids):
+            kept = sorted(last.values())
+            ids = list(ids[i] for i in kept)
+            values = dict((name, value[kept]) for name, value in values.items())
+
+        # Entities already stored just get their rows overwritten
+        row_of = self.__row_of
+        if row_of:
+            rows = numpy.fromiter((row_of.get(id_, -1) for id_ in ids), numpy.int64, len(ids))
+            existing = rows >= 0
+        if row_of and existing.any():
+            for name, array in self.__arrays.items():
+                array[rows[existing]] = values[name][existing]
+            ids = numpy.asarray(ids)[~existing].tolist()
+            values = dict((name, value[~existing]) for name, value in values.items())
+
+        # New entities are appended as a block
+        start = self.count
+        end = start + len(ids)
+        while end > len(self.__ids):
+            self.__grow()
+        self.__ids[start:end] = ids
+        for name, array in self.__arrays.items():
+            array[start:end] = values[name]
+        row_of.update(zip(ids, range(start, end)))
+        object.__setattr__(self, 'count', end)
+
+    def __getitem__(self, id_):
+        """Returns a ColumnRow for the given entity id."""
+        if id_ not in self.__row_of:
+            raise KeyError(id_)
+        return ColumnRow(self, id_)
+
+    def get(self, id_, default = None):
+        if id_ not in self.__row_of:
+            return default
+        return ColumnRow(self, id_)
+
+    def pop(self, id_):
+        """
+        Removes the row of the given entity (see __delitem__) and returns a
+        materialized copy of the removed component.
+        """
+        component = self.materialize(id_)
+        del self[id_]
+        return component
+
+    def __delitem__(self, id_):
+        """Removes the row of the given entity, moving the last row into its place."""
+        row = self.__row_of.pop(id_)
+        last = self.count - 1
+        if row != last:
+            for array in self.__arrays.values():
+                array[row] = array[last]
+            moved_id = int(self.__ids[last])
+            self.__ids[row] = moved_id
+            self.__row_of[moved_id] = row
+        object.__setattr__(self, 'count', last)
+
+    def __contains__(self, id_):
+        return id_ in self.__row_of
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return iter(self.__row_of)
+
+    def keys(self):
+        return list(self.__row_of)
+
+    def values(self):
+        return list(ColumnRow(self, id_) for id_ in self.__row_of)
+
+    def items(self):
+        return list((id_, ColumnRow(self, id_)) for id_ in self.__row_of)
+
+    ##### PYTHONIC METHODS FOR EASIER PROGRAMMING
+    def __getattr__(self, name):
+        """
+        Defines the usage of:
+            x = store.field_name
+        which gets the array of the live rows of that field.
+        """
+        arrays = self.__dict__.get('_ColumnStore__arrays', {})
+        if name in arrays:
+            return arrays[name][:self.count]
+        raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        """
+        Defines the usage of:
+            store.field_name = value (or store.field_name += value)
+        which assigns the value (scalar or array) to every live row of the field.
+        """
+        if name not in self.fields:
+            raise AttributeError('\'{0}\' is not a column'.format(name))
+        self.__arrays[name][:self.count] = value
+
+    def __str__(self):
+        """Returns a string representation."""
+        return 'ColumnStore({0}): {1} rows'.format(self.component_class.__name__, self.count)
+
+
+class ColumnRow:
+    """
+    Component returned by a ColumnStore: reading or writing one of its fields
+    reads or writes the arrays of the store, so it can be used as the original
+    component by code that isn't vectorized.
+    """
+    __slots__ = ('_store', '_id')
+
+    def __init__(self, store, id_):
+        object.__setattr__(self, '_store', store)
+        object.__setattr__(self, '_id', id_)
+
+    def __getattr__(self, name):
+        store = self._store
+        if name not in store.fields:
+            raise AttributeError(name)
+        return store.column(name)[store.rowOf(self._id)].item()
+
+    def __setattr__(self, name, value):
+        store = self._store
+        if name not in store.fields:
+            raise AttributeError('\'{0}\' is not a column'.format(name))
+        store.column(name)[store.rowOf(self._id)] = value
+        if store.change_tracker is not None:
+            store.change_tracker.recordChanged((self._id,), store.component_class.component_type_id)
+
+    def __str__(self):
+        """Returns a string representation."""
+        return '{0}({1})'.format(self._store.component_class.__name__,
+            ', '.join('{0}={1}'.format(name, getattr(self, name))
+                      for name in self._store.fields))
@@ -0,0 +1,245 @@
+# encoding: UTF-8
+import contextvars
+import sys
+
+from larv.Entity import Entity
+from larv.Component import Component, ComponentMeta
+
+# (buffer, child buffer) the changes recorded in buffer go to, in the current
+# thread or asyncio task, see CommandBuffer.redirect
+_REDIRECT = contextvars.ContextVar('larv_command_redirect', default = None)
+
+class CommandBuffer:
+    """
+    Records structural changes (creating and removing entities, adding and
+    removing components) so they can be applied later, all at once, instead of
+    changing the entity manager while a system iterates over it.
+
+    Every Engine owns one (engine.commands), shared with its systems and its
+    entity factory (system.commands / entity_factory.commands), and applies it
+    at the end of every tick, after every system has been updated:
+        for entity, health in self.entity_manager.query(HealthComponent):
+            if health.current_hp <= 0:
+                self.commands.removeEntity(entity)
+
+    When applied, the recorded changes are sorted and batched:
+        1. entities created with createEntity get their ids as a block, and
+           their components are inserted one component type at a time.
+        2. added components, grouped by component type (if the same component
+           type is added twice to an entity, the last one is kept).
+        3. removed components, grouped by component type.
+    Adding and removing the same component type of an entity cancel each
+    other: the one recorded last wins, so removing a component and adding a
+    new one of the same type swaps it.
+        4. removed entities.
+    Changes targeting entities that are not alive any more are ignored, so
+    removing an entity twice (or adding a component to an entity removed
+    earlier in the tick) is safe.
+
+    The buffer isn't thread safe: when the engine runs systems at the same
+    time (workers, or coroutine systems), every one of them records into its
+    own child buffer (see fork and redirect, which also catch the changes
+    recorded through the entity factory) and the children are merged in
+    plan order once the stage is over, so the result is the same as
+    updating the systems one by one.
+    """
+    def __init__(self, entity_manager, group_manager = None):
+        """
+        Constructor.
+        @entity_manager: larv.EntityManager.EntityManager instance.
+        @group_manager: larv.GroupManager.GroupManager instance, needed only
+                        when creating entities inside groups.
+        """
+        self.entity_manager = entity_manager
+        self.group_manager = group_manager
+        self.__created = []  # (components, group)
+        self.__added = {}    # type id -> dict, key = entity, value = component
+        self.__removed = {}  # type id -> set of entities
+        self.__destroyed = set()
+
+    def createEntity(self, *components, group = None):
+        """
+        Records the creation of a new entity with the given components.
+        @components: component instances of the new entity.
+        @group: name of a group the new entity will be added to, or None.
+        """
+        for component in components:
+            assert isinstance(component, Component)
+        target = self.__target()
+        if target is not self:
+            return target.createEntity(*components, group = group)
+        self.__created.append((components, group))
+
+    def removeEntity(self, entity):
+        """
+        Records the removal of the given entity.
+        @entity: entity instance, not id.
+        """
+        assert isinstance(entity, Entity)
+        target = self.__target()
+        if target is not self:
+            return target.removeEntity(entity)
+        self.__destroyed.add(entity)
+
+    def addComponent(self, entity, component):
+        """
+        Records adding the given component to the given entity.
+        @entity: entity instance, not id.
+        @component: component instance.
+        """
+        assert isinstance(entity, Entity)
+        assert isinstance(component, Component)
+        target = self.__target()
+        if target is not self:
+            return target.addComponent(entity, component)
+        type_id = component.component_type_id
+        removed = self.__removed.get(type_id, None)
+        if removed:
+            removed.discard(entity)
+        added = self.__added.get(type_id, None)
+        if added is None:
+            added = self.__added[type_id] = {}
+        added[entity] = component
+
+    def removeComponent(self, entity, component):
+        """
+        Records removing the given component of the given entity.
+        @entity: entity instance.
+        @component: class, class name or instance of the component.
+        """
+        assert isinstance(entity, Entity)
+        target = self.__target()
+        if target is not self:
+            return target.removeComponent(entity, component)
+        type_id = self.entity_manager.getComponentType(component)
+        if type_id is None:
+            return None
+        added = self.__added.get(type_id, None)
+        if added:
+            added.pop(entity, None)
+        removed = self.__removed.get(type_id, None)
+        if removed is None:
+            removed = self.__removed[type_id] = set()
+        removed.add(entity)
+
+    def apply(self):
+        """
+        Applies every recorded change to the entity manager (see the class
+        docstring for the order) and empties the buffer.
+        Returns the list of the entities created.
+        """
+        entity_manager = self.entity_manager
+        created, added, removed, destroyed = (self.__created, self.__added,
+                                              self.__removed, self.__destroyed)
+        self.clear()
+
+        new_entities = entity_manager.createEntities(len(created)) if created else []
+        if created:
+            by_type = {}
+            for entity, (components, group) in zip(new_entities, created):
+                for component in components:
+                    entities, instances = by_type.setdefault(component.component_type_id, ([], []))
+                    entities.append(entity)
+                    instances.append(component)
+                if group is not None:
+                    self.group_manager.add(entity, group)
+            for type_id in sorted(by_type):
+                entities, instances = by_type[type_id]
+                entity_manager.addComponents(entities, ComponentMeta.types[type_id], instances)
+
+        for type_id in sorted(added):
+            entities = sorted(entity for entity in added[type_id]
+                              if entity_manager.isAlive(entity))
+            entity_manager.addComponents(entities, ComponentMeta.types[type_id],
+                                         list(added[type_id][entity] for entity in entities))
+
+        for type_id in sorted(removed):
+            component_class = ComponentMeta.types[type_id]
+            for entity in sorted(removed[type_id]):
+                if entity_manager.isAlive(entity):
+                    entity_manager.removeComponent(entity, component_class)
+
+        for entity in sorted(destroyed):
+            if entity_manager.isAlive(entity):
+                entity_manager.removeEntity(entity)
+        return new_entities
+
+    def fork(self):
+        """
+        Returns a new, empty, CommandBuffer of the same managers, to record
+        the changes of one of the systems running at the same time.
+        """
+        return CommandBuffer(self.entity_manager, self.group_manager)
+
+    def redirect(self, child):
+        """
+        Makes the changes recorded in this buffer from the current thread (or
+        asyncio task) go to the given child buffer instead, until endRedirect
+        is called with the returned token.
+        @child: CommandBuffer returned by fork.
+        """
+        return _REDIRECT.set((self, child))
+
+    def endRedirect(self, token):
+        """Stops the redirection started by the redirect call returning token."""
+        _REDIRECT.reset(token)
+
+    def merge(self, child):
+        """
+        Moves the changes recorded in the given child buffer to the end of
+        this one (as if they had been recorded here after the current ones)
+        and empties the child.
+        @child: CommandBuffer returned by fork.
+        """
+        self.__created.extend(child.__created)
+        # Same rule as addComponent and removeComponent: the child's changes
+        # were recorded last, so they cancel the opposite ones recorded here
+        for type_id, added in child.__added.items():
+            removed = self.__removed.get(type_id, None)
+            if removed:
+                removed.difference_update(added)
+            self.__added.setdefault(type_id, {}).update(added)
+        for type_id, removed in child.__removed.items():
+            added = self.__added.get(type_id, None)
+            if added:
+                for entity in removed:
+                    added.pop(entity, None)
+            self.__removed.setdefault(type_id, set()).update(removed)
+        self.__destroyed.update(child.__destroyed)
+        child.clear()
+
+    def __target(self):
+        """Returns the buffer the changes are recorded in (see redirect)."""
+        redirect = _REDIRECT.get()
+        if redirect is not None and redirect[0] is self:
+            return redirect[1]
+        return self
+
+    def clear(self):
+        """Forgets every recorded change without applying it."""
+        self.__created = []
+        self.__added = {}
+        self.__removed = {}
+        self.__destroyed = set()
+
+    ##### PYTHONIC METHODS FOR EASIER PROGRAMMING
+    def memoryUsage(self):
+        """Returns the estimated bytes of the containers of the recorded changes."""
+        return (sys.getsizeof(self.__created) + sys.getsizeof(self.__destroyed) +
+                sys.getsizeof(self.__added) + sys.getsizeof(self.__removed) +
+                sum(map(sys.getsizeof, self.__added.values())) +
+                sum(map(sys.getsizeof, self.__removed.values())))
+
+    def __len__(self):
+        """Returns the number of changes recorded."""
+        return (len(self.__created) + len(self.__destroyed) +
+                sum(len(added) for added in self.__added.values()) +
+                sum(len(removed) for removed in self.__removed.values()))
+
+    def __bool__(self):
+        """Defines the usage of: if commands: (True if there's something to apply)."""
+        return bool(self.__created or self.__added or self.__removed or self.__destroyed)
+
+    def __str__(self):
+        """Returns a string representation."""
+        return 'CommandBuffer: {0} changes'.format(len(self))
@@ -1,7 +1,43 @@
 # encoding: UTF-8
 import abc
 
-class Component(metaclass = abc.ABCMeta):
+class ComponentMeta(abc.ABCMeta):
+    """
+    Metaclass of every component: registers each component class when it's
+    created, giving it a small integer id (its component_type_id attribute)
+    that the entity manager uses to index its storage and to build bitmask
+    signatures of the component types of every entity.
+    @types: list, index = component type id, value = component class.
+    @types_by_name: dict, key = class name, value = list of the classes with
+                    that name (more than one if they're in different modules).
+    """
+    types = []
+    types_by_name = {}
+
+    def __init__(cls, name, bases, namespace):
+        super().__init__(name, bases, namespace)
+        cls.component_type_id = len(ComponentMeta.types)
+        ComponentMeta.types.append(cls)
+        ComponentMeta.types_by_name.setdefault(name, []).append(cls)
+
+    @staticmethod
+    def typeIdOf(name):
+        """
+        Returns the component type id of the component class with the given
+        name, None if there isn't any.
+        Raises KeyError if the name is ambiguous (two component classes with
+        the same name in different modules), use the classes in that case.
+        @name: class name (str).
+        """
+        classes = ComponentMeta.types_by_name.get(name, None)
+        if classes is None:
+            return None
+        if len(classes) > 1:
+            raise KeyError('Error: \'{0}\' is ambiguous, use the component class'.format(name))
+        return classes[0].component_type_id
+
+
+class Component(metaclass = ComponentMeta):
     """
     Abstract meta class for every component.
     It's utility is to keep the code more organized.
@@ -0,0 +1,134 @@
+# encoding: UTF-8
+import sys
+
+from larv.MemoryReport import MemoryReport
+
+class ComponentPool:
+    """
+    Free list of the instances of a component type, so short lived entities
+    (bullets, particles...) reuse the components of the removed ones instead
+    of allocating new ones on every spawn.
+
+    Pools are opt-in, per component type, on the entity manager (see
+    larv.EntityManager.EntityManager.enablePool): removeEntity and
+    removeComponent give the removed components of pooled types back to
+    their pool (so do addComponent and addComponents with the components
+    they replace), and factories take them with acquire:
+        entity_manager.enablePool(BulletComponent, capacity = 4096)
+        ...
+        # in the EntityFactory
+        bullet = self.acquire(BulletComponent, x, y, speed)
+
+    Released components are reset when they enter the pool (with the reset
+    function given to the pool or, if there isn't one, the reset method of
+    the component, if it has one), so they don't keep references to other
+    objects while waiting. acquire calls the __init__ of the instance again
+    with the given arguments, just as if it was created.
+
+    A pooled component must not be used after its entity (or the component
+    itself) is removed: it can be handed to another entity. For the same
+    reason, a component of a pooled type can't be shared by several entities.
+    """
+    def __init__(self, component_class, capacity = 1024, reset = None):
+        """
+        Constructor.
+        @component_class: larv.Component subclass pooled.
+        @capacity: most free instances kept, the ones released beyond it are
+                   dropped (left to the garbage collector).
+        @reset: callable called as reset(component) on every released
+                component, None to use the reset method of the component class.
+        @self.hits, @self.misses: acquire calls served by the pool and by
+                                  creating a new instance.
+        @self.released, @self.dropped: components returned to the pool and
+                                       components dropped because it was full.
+        """
+        self.component_class = component_class
+        self.capacity = capacity
+        if reset is None:
+            reset = getattr(component_class, 'reset', None)
+        self.reset = reset
+        self.hits = 0
+        self.misses = 0
+        self.released = 0
+        self.dropped = 0
+        self.__free = []
+
+    def acquire(self, *args, **kwargs):
+        """
+        Returns a component of the pooled class initialized with the given
+        arguments: a free one if there is any, else a new one.
+        """
+        free = self.__free
+        if free:
+            self.hits += 1
+            component = free.pop()
+            component.__init__(*args, **kwargs)
+            return component
+        self.misses += 1
+        return self.component_class(*args, **kwargs)
+
+    def release(self, component):
+        """
+        Gives the given component back to the pool (resetting it), unless the
+        pool is full.
+        @component: instance of the pooled class no entity has any more.
+        """
+        if len(self.__free) >= self.capacity:
+            self.dropped += 1
+            return None
+        if self.reset is not None:
+            self.reset(component)
+        self.__free.append(component)
+        self.released += 1
+
+    def prefill(self, n, *args, **kwargs):
+        """
+        Creates new components (with the given arguments) until the pool has
+        n free ones (or is full), so the first spawns don't miss either.
+        """
+        free = self.__free
+        missing = min(n, self.capacity) - len(free)
+        if missing > 0:
+            component_class = self.component_class
+            free.extend(component_class(*args, **kwargs) for _ in range(missing))
+
+    def clear(self):
+        """Drops every free component and resets the statistics."""
+        self.__free = []
+        self.hits = self.misses = self.released = self.dropped = 0
+
+    @property
+    def hit_rate(self):
+        """Fraction of the acquire calls served by the pool (0 if none yet)."""
+        calls = self.hits + self.misses
+        if calls == 0:
+            return 0.0
+        return self.hits / calls
+
+    def summary(self):
+        """Returns a dict with the statistics and the number of free components."""
+        return {'free': len(self.__free),
+                'capacity': self.capacity,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hit_rate,
+                'released': self.released,
+                'dropped': self.dropped}
+
+    def memoryUsage(self, sample = 256):
+        """
+        Returns the estimated (overhead, payload) bytes of the pool: the free
+        list and the free components (see larv.MemoryReport.MemoryReport).
+        """
+        return sys.getsizeof(self.__free), MemoryReport.sampledBytes(self.__free, sample)
+
+    ##### PYTHONIC METHODS FOR EASIER PROGRAMMING
+    def __len__(self):
+        """Returns the number of free components."""
+        return len(self.__free)
+
+    def __str__(self):
+        """Returns a string representation."""
+        return ('ComponentPool({0}): {1}/{2} free, {3} hits, {4} misses, '
+                '{5} dropped').format(self.component_class.__name__, len(self.__free),
+                self.capacity, self.hits, self.misses, self.dropped)
@@ -1,10 +1,22 @@
 # encoding: UTF-8
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import heapq
+import inspect
+import sys
+import time
+
+import larv
 
 from larv.EntityManager import EntityManager
 from larv.EntityFactory import EntityFactory
 from larv.PriorityList import PriorityList
 from larv.System import System
 from larv.GroupManager import GroupManager
+from larv.EngineStats import EngineStats
+from larv.CommandBuffer import CommandBuffer
+from larv.Snapshot import Snapshot
+from larv.MemoryReport import MemoryReport
 
 class Engine:
     """
@@ -19,31 +31,171 @@ class Engine:
     call, as the Engine will be responsable for updating every
     single system in the right order (given that we insert
     the systems in the right priority).
+
+    Besides their priority, systems can be ordered with constraints: a system
+    added with before = (OtherSystem,) updates before every OtherSystem (class
+    or instance), and after = (...) the other way around. The order is
+    compiled into an update plan (self.plan, a tuple) when systems are added,
+    removed or reordered: systems are updated in priority order except where
+    a constraint says otherwise, and every tick just loops over the plan.
+
+    Created with workers, the Engine runs concurrently (on a thread pool)
+    the systems that don't conflict according to their declared reads and
+    writes (see larv.System.System). Systems are grouped in stages: a system
+    goes to the stage after the last one holding a system it conflicts with,
+    so the result is the same as updating them one by one in priority order.
+    Threads overlap systems that wait on I/O or release the GIL (numpy); on
+    free-threaded Python builds they run pure Python systems in parallel too.
+
+    Timing: Engine.update(dt) can be given the elapsed time. With a fixed
+    timestep (see setFixedTimestep) the elapsed time is accumulated and the
+    systems are updated once per whole step, with a limit of steps per call so
+    a slow frame doesn't snowball. Expensive systems can be set to run only
+    every N ticks or N times per second (see setSystemRate), with phase offsets
+    to spread them across frames. Every system gets the time elapsed since its
+    own previous update in system.delta_time.
+
+    Structural changes recorded by systems in the command buffer
+    (self.commands, see larv.CommandBuffer.CommandBuffer) are applied, sorted
+    and batched, at the end of every tick, once every system has updated.
+
+    asyncio: systems whose update is a coroutine (async def update(self)) are
+    run with updateAsync, awaited from an event loop. Every stage of systems
+    that don't conflict (see above) is awaited concurrently, so systems
+    waiting on I/O (declaring reads = writes = () if they don't touch any
+    component) overlap instead of adding up. Regular systems run as usual
+    (on the workers, if any) and can be mixed with coroutine ones.
+
+    Instrumentation: enableStats makes the Engine measure every system update
+    and every tick (see larv.EngineStats.EngineStats, available in self.stats).
+    When disabled (the default) it costs a single check per tick.
+    memoryReport estimates the memory used by the entities, every component
+    type and every group (see larv.MemoryReport.MemoryReport).
     """
-    def __init__(self, entity_factory):
+    def __init__(self, entity_factory, workers = 0):
+        """
+        Constructor.
+        @entity_factory: larv.EntityFactory.EntityFactory instance.
+        @workers: number of threads used to run non conflicting systems at the
+                  same time, 0 or 1 updates every system sequentially.
+        """
         self.systems = PriorityList()
+        self.plan = ()
+        self.__constraints = {}
         self.entity_manager = EntityManager()
         self.group_manager = GroupManager(self)
+        self.entity_manager.addRemovalCallback(self.group_manager.removeCompletely)
+        self.commands = CommandBuffer(self.entity_manager, self.group_manager)
+        self.__stages = None
+        self.__executor = None
+        self.__rates = {}
+        self.__fixed_step = None
+        self.__max_steps = 5
+        self.__accumulator = 0.0
+        self.__coroutine_systems = 0
+        self.ticks = 0
+        self.time = 0.0
+        self.alpha = 0.0
+        self.stats = None
+        self.__memory_report = None
+        if workers > 1:
+            self.__executor = ThreadPoolExecutor(max_workers = workers)
 
         # bind Managers to factory
         assert isinstance(entity_factory, EntityFactory)
         entity_factory.bindToEntityManager(self.entity_manager)
         entity_factory.bindToGroupManager(self.group_manager)
+        entity_factory.bindToCommandBuffer(self.commands)
         self.entity_factory = entity_factory
 
-    def addSystem(self, system, priority):
+    def addSystem(self, system, priority, every = 1, phase = 0, hz = None,
+                  before = (), after = ()):
         """
         Adds the given system to the priority list using the given priority and
         also binds the managers and the factory to it.
         Priority works as the lower priority value will update first.
         @system: instance of larv.System.System
         @priority: value used for deciding systems updating order.
+        @every, @phase, @hz: update rate of the system, see setSystemRate.
+        @before, @after: ordering constraints, see setSystemConstraints.
         """
         assert isinstance(system, System)
         system.bindToEntityManager(self.entity_manager)
         system.bindToGroupManager(self.group_manager)
         system.bindToEntityFactory(self.entity_factory)
+        system.bindToCommandBuffer(self.commands)
         self.systems.add(system, priority)
+        if inspect.iscoroutinefunction(system.update):
+            self.__coroutine_systems += 1
+        try:
+            self.setSystemConstraints(system, before, after)
+        except larv.LarvException:
+            if inspect.iscoroutinefunction(system.update):
+                self.__coroutine_systems -= 1
+            self.systems.remove(system)
+            self.__constraints.pop(system, None)
+            self.__rebuildPlan()
+            raise
+        self.setSystemRate(system, every, phase, hz)
+
+    def setSystemConstraints(self, system, before = (), after = ()):
+        """
+        Sets the ordering constraints of the given system (replacing the
+        previous ones) and rebuilds the update plan.
+        Raises larv.LarvException if the constraints can't all be satisfied.
+        @system: larv.System.System instance already added.
+        @before: systems (instances, or classes meaning every instance of them)
+                 that have to update after the given system.
+        @after: systems that have to update before the given system.
+        """
+        assert system in self.systems
+        previous = self.__constraints.pop(system, None)
+        if before or after:
+            self.__constraints[system] = (tuple(before), tuple(after))
+        try:
+            self.__rebuildPlan()
+        except larv.LarvException:
+            self.__constraints.pop(system, None)
+            if previous is not None:
+                self.__constraints[system] = previous
+            raise
+
+    def setSystemRate(self, system, every = 1, phase = 0, hz = None):
+        """
+        Sets how often the given system is updated.
+        @system: larv.System.System instance already added.
+        @every: the system updates on the ticks where
+                (tick - phase) % every == 0, so giving different phases to
+                systems with the same every spreads them across ticks.
+        @phase: offset, in ticks (or in fractions of the period if hz is used).
+        @hz: if given, the system updates hz times per second of game time
+             instead (at most once per tick), @every is ignored.
+        """
+        if hz is None and every == 1:
+            self.__rates.pop(system, None)
+        elif hz is None:
+            assert every >= 1
+            self.__rates[system] = [every, phase, None, 0.0]
+        else:
+            assert hz > 0
+            period = 1.0 / hz
+            self.__rates[system] = [None, 0, period, phase * period]
+
+    def setFixedTimestep(self, step, max_steps = 5):
+        """
+        Makes update(dt) advance the game in fixed steps: dt is accumulated and
+        every whole step runs a tick. The remainder is kept for the next call
+        (self.alpha = remainder / step, useful for interpolating when rendering).
+        @step: seconds per tick, None to go back to one tick per update call.
+        @max_steps: most ticks run by a single update call, the time that
+                    doesn't fit is dropped (the game slows down instead of
+                    spiraling when ticks take longer than the step).
+        """
+        assert step is None or step > 0
+        assert max_steps >= 1
+        self.__fixed_step = step
+        self.__max_steps = max_steps
+        self.__accumulator = 0.0
 
     def changeSystemPriority(self, system, priority):
         """
@@ -51,22 +203,384 @@ class Engine:
         @system: larv.System.System instance.
         @priority: value used for deciding systems updating order.
         """
-        assert system in self.systems.list        
         assert isinstance(system, System)
+        assert system in self.systems
         self.systems.change(system, priority)
+        self.__rebuildPlan()
+
+    def enableStats(self, window = 600, reporter = None, report_every = 60):
+        """
+        Starts measuring the wall time of every system update and of every tick,
+        gathered in self.stats (a larv.EngineStats.EngineStats) and returned.
+        @window: number of recent calls kept for the percentiles.
+        @reporter: callable called as reporter(stats) every report_every ticks.
+        @report_every: number of ticks between reporter calls.
+        """
+        self.stats = EngineStats(window, reporter, report_every)
+        return self.stats
+
+    def disableStats(self):
+        """Stops measuring, returns the stats gathered until now."""
+        stats = self.stats
+        self.stats = None
+        return stats
+
+    def memoryReport(self, deep = False, sample = 256):
+        """
+        Returns a larv.MemoryReport.MemoryReport with the estimated memory used
+        by the entity manager (entities and component types), the group
+        manager (groups) and the engine itself (systems, pending commands),
+        compared with the previous call (see its growth).
+        @deep: also take a tracemalloc snapshot, see larv.MemoryReport.MemoryReport.
+        @sample: most components of a type measured, see
+                 larv.EntityManager.EntityManager.memoryReport.
+        """
+        report = MemoryReport(deep)
+        report.extend(self.entity_manager.memoryReport(sample = sample))
+        report.extend(self.group_manager.memoryReport())
+        report.add('engine', 'systems', len(self.systems), sys.getsizeof(self.plan),
+                   sum(map(MemoryReport.objectBytes, self.plan)))
+        report.add('engine', 'commands', len(self.commands), self.commands.memoryUsage())
+        report.compareTo(self.__memory_report)
+        self.__memory_report = report
+        return report
 
     def removeSystem(self, system):
         """Removes the given system of the priority list."""        
         assert isinstance(system, System)
-        return self.systems.remove(system)
+        self.__rates.pop(system, None)
+        self.__constraints.pop(system, None)
+        self.systems.remove(system)
+        if inspect.iscoroutinefunction(system.update):
+            self.__coroutine_systems -= 1
+        if self.entity_manager.change_tracker is not None:
+            self.entity_manager.change_tracker.removeCursors(system)
+        self.__rebuildPlan()
+
+    def update(self, dt = None):
+        """
+        Advances the game: iterates over every System and calls their update
+        method (once, or once per fixed step, see setFixedTimestep).
+        @dt: seconds elapsed since the previous call, None if unknown (then
+             every call is a single tick of a fixed step, or of 0 seconds).
+        Returns the number of ticks run.
+        """
+        steps, step = self.__advance(dt)
+        for _ in range(steps):
+            self.step(step)
+        return steps
+
+    async def updateAsync(self, dt = None):
+        """
+        Coroutine version of update, needed when some system's update is a
+        coroutine: awaits every tick (see stepAsync).
+        @dt: seconds elapsed since the previous call, see update.
+        Returns the number of ticks run.
+        """
+        steps, step = self.__advance(dt)
+        for _ in range(steps):
+            await self.stepAsync(step)
+        return steps
+
+    def __advance(self, dt):
+        """
+        Accounts the given elapsed time (see setFixedTimestep), returns the
+        number of ticks to run and the seconds every tick advances.
+        """
+        step = self.__fixed_step
+        if step is None:
+            return 1, 0.0 if dt is None else dt
+        if dt is None:
+            return 1, step
+
+        self.__accumulator += dt
+        steps = int(self.__accumulator // step)
+        if steps > self.__max_steps:
+            steps = self.__max_steps
+            self.__accumulator = self.__accumulator % step
+        else:
+            self.__accumulator -= steps * step
+        self.alpha = self.__accumulator / step
+        return steps, step
 
-    def update(self):
-        """Iterates over every System and calls their update method."""
-        for system in self.systems:
-            system.update()
+    def step(self, dt):
+        """
+        Runs a single tick: updates every system due on it, then applies the
+        changes recorded in the command buffer.
+        @dt: seconds of game time the tick advances.
+        """
+        if self.__coroutine_systems:
+            raise larv.LarvException('Error: coroutine systems need Engine.updateAsync')
+        self.ticks += 1
+        self.time += dt
+        stats = self.stats
+        if stats is None:
+            self.__updateSystems(dt, None)
+            if self.commands:
+                self.commands.apply()
+        else:
+            start = time.perf_counter()
+            self.__updateSystems(dt, stats)
+            if self.commands:
+                stats.call('commands', self.commands.apply)
+            stats.endTick(time.perf_counter() - start)
+
+    def __updateSystems(self, dt, stats):
+        """Updates every system due on the current tick, measuring if stats."""
+        if self.__executor is None:
+            if not self.__rates and stats is None:
+                for system in self.plan:
+                    system.delta_time = dt
+                    system.update()
+            else:
+                for system in self.plan:
+                    if not self.__isDue(system, dt):
+                        continue
+                    if stats is None:
+                        system.update()
+                    else:
+                        stats.call(system, system.update)
+            return None
+
+        if self.__stages is None:
+            self.__stages = self.__buildStages()
+        for stage in self.__stages:
+            stage = list(system for system in stage if self.__isDue(system, dt))
+            if len(stage) == 1 and stats is None:
+                stage[0].update()
+            elif len(stage) == 1:
+                stats.call(stage[0], stage[0].update)
+            elif stage:
+                # Every system records its commands apart, merged in plan order
+                children = list(self.commands.fork() for system in stage)
+                if stats is None:
+                    futures = list(self.__executor.submit(self.__recordInto, child, system.update)
+                                   for system, child in zip(stage, children))
+                else:
+                    # Workers only measure, the stats are recorded from this thread
+                    futures = list(self.__executor.submit(self.__recordInto, child,
+                                                          stats.measure, system.update)
+                                   for system, child in zip(stage, children))
+                results = list(future.result() for future in futures) # re-raises
+                for child in children:
+                    self.commands.merge(child)
+                if stats is not None:
+                    for system, (seconds, result) in zip(stage, results):
+                        stats.add(system, seconds, result)
+
+    def __recordInto(self, child, function, *args):
+        """
+        Calls function(*args) with the commands recorded from the current
+        thread going to the given child buffer (see CommandBuffer.redirect).
+        """
+        token = self.commands.redirect(child)
+        try:
+            return function(*args)
+        finally:
+            self.commands.endRedirect(token)
+
+    async def stepAsync(self, dt):
+        """
+        Coroutine version of step: the systems of every stage are run
+        concurrently, awaiting the coroutine ones.
+        @dt: seconds of game time the tick advances.
+        """
+        self.ticks += 1
+        self.time += dt
+        stats = self.stats
+        start = time.perf_counter()
+        if self.__stages is None:
+            self.__stages = self.__buildStages()
+        for stage in self.__stages:
+            stage = list(system for system in stage if self.__isDue(system, dt))
+            if len(stage) == 1:
+                await self.__updateSystemAsync(stage[0], stats)
+            elif stage:
+                children = list(self.commands.fork() for system in stage)
+                await asyncio.gather(*(self.__updateSystemAsync(system, stats, child)
+                                       for system, child in zip(stage, children)))
+                for child in children:
+                    self.commands.merge(child)
+        if self.commands:
+            if stats is None:
+                self.commands.apply()
+            else:
+                stats.call('commands', self.commands.apply)
+        if stats is not None:
+            stats.endTick(time.perf_counter() - start)
+
+    async def __updateSystemAsync(self, system, stats, child = None):
+        """
+        Updates the given system: awaiting it if it's a coroutine, on a worker
+        thread if it's a regular one and the engine has workers.
+        @child: CommandBuffer the commands of the system are recorded in
+                (see CommandBuffer.redirect), None for self.commands.
+        """
+        if inspect.iscoroutinefunction(system.update) or self.__executor is None:
+            update = system.update
+        elif child is None:
+            loop = asyncio.get_running_loop()
+            update = lambda: loop.run_in_executor(self.__executor, system.update)
+        else:
+            # The worker thread doesn't see the context of this task
+            loop = asyncio.get_running_loop()
+            update = lambda: loop.run_in_executor(self.__executor, self.__recordInto,
+                                                  child, system.update)
+        # gather runs every system in its own task, so this only affects this one
+        token = None if child is None else self.commands.redirect(child)
+        try:
+            if stats is None:
+                result = update()
+                if inspect.isawaitable(result):
+                    await result
+            else:
+                await stats.callAsync(system, update)
+        finally:
+            if token is not None:
+                self.commands.endRedirect(token)
+
+    def __isDue(self, system, dt):
+        """
+        Returns True if the given system has to update on the current tick,
+        setting its delta_time to the time elapsed since its last update.
+        """
+        rate = self.__rates.get(system, None)
+        if rate is None:
+            system.delta_time = dt
+            return True
+        every, phase, period, elapsed = rate
+        elapsed += dt
+        if period is None:
+            due = (self.ticks - phase) % every == 0
+        else:
+            due = elapsed >= period
+        if due:
+            system.delta_time = elapsed if period is None else period
+            # Keep the phase, but don't try to catch up with missed updates
+            elapsed = 0.0 if period is None else min(elapsed - period, period)
+        rate[3] = elapsed
+        return due
+
+    def __buildStages(self):
+        """
+        Returns the systems grouped in stages (list of lists): every system is
+        placed in the stage after the last one containing a system it conflicts
+        with, so conflicting systems keep their priority order.
+        """
+        stages = []
+        placed = [] # (stage number, system, reads mask, writes mask)
+        for system in self.plan:
+            reads = self.__componentsMask(system.reads)
+            writes = self.__componentsMask(system.writes)
+            stage_number = 0
+            for other_stage, other, other_reads, other_writes in placed:
+                if (reads is None or writes is None or
+                    other_reads is None or other_writes is None or
+                    writes & (other_reads | other_writes) or
+                    reads & other_writes):
+                    stage_number = max(stage_number, other_stage + 1)
+            if stage_number == len(stages):
+                stages.append([])
+            stages[stage_number].append(system)
+            placed.append((stage_number, system, reads, writes))
+        return stages
+
+    def __rebuildPlan(self):
+        """
+        Compiles the update plan: the systems in priority order, except where
+        their constraints say otherwise. The plan is filled from the end:
+        every slot gets the system with the highest priority value among the
+        ones whose successors (the systems that must update after them) are
+        all placed already. So a system that has to update before a lower
+        priority one is pulled up just in front of it, and the systems without
+        constraints keep their priority order and don't move for it:
+            a (0), b (1), c (2, before a) -> c, a, b
+        Raises larv.LarvException if the constraints have a cycle.
+        """
+        ordered = list(self.systems)
+        position = dict((system, i) for i, system in enumerate(ordered))
+        def matching(target):
+            if isinstance(target, type):
+                return list(system for system in ordered if isinstance(system, target))
+            return [target] if target in position else []
+
+        predecessors = dict((system, []) for system in ordered)
+        pending = dict((system, 0) for system in ordered) # successors not placed yet
+        for system, (before, after) in self.__constraints.items():
+            edges = list((system, other) for target in before for other in matching(target))
+            edges.extend((other, system) for target in after for other in matching(target))
+            for first, second in edges:
+                if first is not second:
+                    predecessors[second].append(first)
+                    pending[first] += 1
+
+        # max heap of the positions of the systems that can take the last free slot
+        ready = list(-position[system] for system in ordered if pending[system] == 0)
+        heapq.heapify(ready)
+        plan = []
+        while ready:
+            system = ordered[-heapq.heappop(ready)]
+            plan.append(system)
+            for other in predecessors[system]:
+                pending[other] -= 1
+                if pending[other] == 0:
+                    heapq.heappush(ready, -position[other])
+        if len(plan) != len(ordered):
+            raise larv.LarvException('Error: cyclic system constraints between {0}'.format(
+                ', '.join('{0!r} (priority {1})'.format(system, self.systems.orderValue(system))
+                          for system in self.__cycle(predecessors, pending))))
+        plan.reverse()
+        self.plan = tuple(plan)
+        self.__stages = None
+
+    def __cycle(self, predecessors, pending):
+        """
+        Returns the systems, in priority order, left out of the plan by
+        __rebuildPlan that are in (or between) constraint cycles, leaving out
+        the ones only waiting for a system of a cycle.
+        """
+        left = list(system for system in pending if pending[system] > 0)
+        in_left = set(left)
+        changed = True
+        while changed:
+            changed = False
+            for system in left:
+                if not any(other in in_left for other in predecessors[system]):
+                    left.remove(system)
+                    in_left.discard(system)
+                    changed = True
+                    break
+        return left
+
+    def __componentsMask(self, components):
+        """Returns the signature of the given component classes, None if undeclared."""
+        if components is None:
+            return None
+        return self.entity_manager.getSignature(*components)
+
+    def saveSnapshot(self, path):
+        """
+        Saves the entities, components and groups of the engine in the given
+        file (see larv.Snapshot.Snapshot).
+        @path: path of the file.
+        """
+        Snapshot.save(self, path)
+
+    def loadSnapshot(self, path):
+        """
+        Replaces the entities, components and groups of the engine with the
+        ones saved in the given file by saveSnapshot.
+        @path: path of the file.
+        """
+        Snapshot.load(self, path)
 
     def delete(self):
         """Empties the Engine, setting every container to None."""
+        if self.__executor is not None:
+            self.__executor.shutdown()
+            self.__executor = None
         self.systems = None
+        self.plan = ()
+        self.commands = None
         self.entity_manager = None
         self.entity_factory = None
@@ -0,0 +1,180 @@
+# encoding: UTF-8
+from collections import deque
+import inspect
+import time
+
+class TimingStats:
+    """
+    Timing statistics of one thing measured by EngineStats (a system, the whole
+    tick, ...): number of calls, total and last wall time, entities processed
+    and a window with the most recent times, used for the percentiles.
+    """
+    def __init__(self, name, window):
+        """
+        Constructor.
+        @name: name shown in the reports.
+        @window: number of recent times kept for the percentiles.
+        """
+        self.name = name
+        self.calls = 0
+        self.total_time = 0.0
+        self.last_time = 0.0
+        self.entities = 0
+        self.samples = deque(maxlen = window)
+
+    def record(self, seconds, entities = None):
+        """Adds a measured call that took the given seconds."""
+        self.calls += 1
+        self.total_time += seconds
+        self.last_time = seconds
+        self.samples.append(seconds)
+        if entities is not None:
+            self.entities += entities
+
+    @property
+    def mean_time(self):
+        """Mean seconds per call since the stats were enabled."""
+        if self.calls == 0:
+            return 0.0
+        return self.total_time / self.calls
+
+    def percentile(self, percent):
+        """
+        Returns the given percentile (0-100) of the seconds of the recent calls
+        (nearest rank), 0 if there weren't any.
+        """
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        rank = int(round(percent / 100.0 * (len(ordered) - 1)))
+        return ordered[rank]
+
+    def summary(self):
+        """Returns a dict with all the statistics (times in seconds)."""
+        return {'calls': self.calls,
+                'total': self.total_time,
+                'mean': self.mean_time,
+                'last': self.last_time,
+                'p50': self.percentile(50),
+                'p95': self.percentile(95),
+                'p99': self.percentile(99),
+                'entities': self.entities}
+
+    def __str__(self):
+        """Returns a string representation."""
+        summary = self.summary()
+        return ('{0}: {1} calls, mean {2:.3f} ms, p50 {3:.3f} ms, p95 {4:.3f} ms, '
+                'p99 {5:.3f} ms, {6} entities').format(self.name, summary['calls'],
+                summary['mean'] * 1000, summary['p50'] * 1000, summary['p95'] * 1000,
+                summary['p99'] * 1000, summary['entities'])
+
+
+class EngineStats:
+    """
+    Statistics gathered by an Engine (or a World) while enabled, see
+    larv.Engine.Engine.enableStats:
+        - stats.tick: TimingStats of the whole tick.
+        - stats.get(system): TimingStats of a system.
+        - stats.report(): dict, key = name, value = TimingStats.summary().
+    Systems can return the number of entities they processed from their update
+    method to get it counted.
+
+    A reporter (any callable) can be given, it will be called with the stats
+    every report_every ticks, for example to print them:
+        engine.enableStats(reporter = print, report_every = 600)
+    """
+    def __init__(self, window = 600, reporter = None, report_every = 60):
+        """
+        Constructor.
+        @window: number of recent calls kept for the percentiles.
+        @reporter: callable called as reporter(stats) periodically, or None.
+        @report_every: number of ticks between reporter calls.
+        """
+        self.window = window
+        self.reporter = reporter
+        self.report_every = report_every
+        self.tick = TimingStats('tick', window)
+        self.__by_key = {}
+
+    def get(self, key):
+        """
+        Returns the TimingStats of the given key (usually a system),
+        creating them if needed.
+        """
+        stats = self.__by_key.get(key, None)
+        if stats is None:
+            name = key if isinstance(key, str) else key.__class__.__name__
+            names = set(stats.name for stats in self.__by_key.values())
+            if name in names:
+                name = '{0}#{1}'.format(name, len(self.__by_key))
+            stats = self.__by_key[key] = TimingStats(name, self.window)
+        return stats
+
+    def call(self, key, function, *args):
+        """
+        Calls function(*args) and records its wall time (and the number of
+        entities it returns, if any) in the stats of the given key.
+        Returns what the function returned.
+        """
+        seconds, result = self.measure(function, *args)
+        self.add(key, seconds, result)
+        return result
+
+    @staticmethod
+    def measure(function, *args):
+        """
+        Calls function(*args) and returns (wall time in seconds, what it
+        returned) without recording anything, so it can run on worker
+        threads: the stats aren't thread safe, the thread owning them
+        records the result later with add.
+        """
+        start = time.perf_counter()
+        result = function(*args)
+        return time.perf_counter() - start, result
+
+    def add(self, key, seconds, result = None):
+        """
+        Records a call measured by measure in the stats of the given key.
+        @result: what the call returned, counted as entities if it's an int.
+        """
+        entities = None
+        if isinstance(result, int) and not isinstance(result, bool):
+            entities = result
+        self.get(key).record(seconds, entities)
+
+    async def callAsync(self, key, function, *args):
+        """
+        Coroutine version of call: function(*args) can return an awaitable,
+        which is awaited (the time waiting is measured too).
+        """
+        start = time.perf_counter()
+        result = function(*args)
+        if inspect.isawaitable(result):
+            result = await result
+        self.add(key, time.perf_counter() - start, result)
+        return result
+
+    def endTick(self, seconds):
+        """Records the time of a whole tick and calls the reporter if it's time."""
+        self.tick.record(seconds)
+        if self.reporter is not None and self.tick.calls % self.report_every == 0:
+            self.reporter(self)
+
+    def report(self):
+        """Returns a dict, key = name, value = TimingStats.summary()."""
+        report = {self.tick.name: self.tick.summary()}
+        for stats in self.__by_key.values():
+            report[stats.name] = stats.summary()
+        return report
+
+    def reset(self):
+        """Forgets every statistic gathered."""
+        self.tick = TimingStats('tick', self.window)
+        self.__by_key = {}
+
+    def __str__(self):
+        """Returns a string representation, one line per measured thing."""
+        lines = [str(self.tick)]
+        for stats in sorted(self.__by_key.values(), key = lambda stats: -stats.total_time):
+            lines.append(str(stats))
+        return '\n'.join(lines)
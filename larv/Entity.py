@@ -1,19 +1,45 @@
 # encoding: UTF-8
 
-class Entity:
+# An entity id packs an index (reused once the entity is removed) and a
+# generation (incremented every time the index is freed), so handles to a
+# removed entity never match the id of the entity reusing its index.
+INDEX_BITS = 32
+INDEX_MASK = (1 << INDEX_BITS) - 1
+GENERATION_MASK = (1 << 31) - 1
+
+class Entity(int):
     """
     An entity is just an ID, which will be assigned some components.
     Components hold the data and systems are the responsables of the logic
     behind it.
+
+    It's implemented as an int subclass without instance dictionary, so a
+    handle is as compact as its id, compares and hashes as its id and can be
+    used directly as a key of the id-keyed containers of the framework.
+    The entity manager interns one handle per live entity (see
+    larv.EntityManager.EntityManager.getHandle) so queries don't need to
+    allocate new ones.
+    Usage:
+        entity = Entity(5) # We should pass a unique id everytime we create
+                           # a new entity.
     """
-    def __init__(self, id):
-        """
-        Constructor.
-        We should pass a unique id everytime we create a new entity.
-        """
-        self.__id = id
+    __slots__ = ()
 
     @property
     def id(self):
-        """Read only property for the id private variable."""
-        return self.__id
+        """Read only property for the id (the entity itself, as it is an int)."""
+        return self
+
+    @property
+    def index(self):
+        """Index part of the id, reused by the entity manager."""
+        return self & INDEX_MASK
+
+    @property
+    def generation(self):
+        """Generation part of the id, changes every time the index is reused."""
+        return self >> INDEX_BITS
+
+    def __repr__(self):
+        """Returns a string representation."""
+        return 'Entity({0})'.format(int(self))
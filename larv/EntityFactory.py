@@ -23,6 +23,7 @@ class EntityFactory:
         """
         self.__entity_manager = None
         self.__group_manager = None
+        self.__commands = None
 
     @property
     def entity_manager(self):
@@ -32,6 +33,10 @@ class EntityFactory:
     def group_manager(self):
         return self.__group_manager
 
+    @property
+    def commands(self):
+        return self.__commands
+
     def bindToEntityManager(self, entity_manager):
         """
         Binds the EntityManager to the EntityFactory.
@@ -48,6 +53,25 @@ class EntityFactory:
         """
         self.__group_manager = group_manager
 
+    def bindToCommandBuffer(self, commands):
+        """
+        Binds the CommandBuffer of the engine to the EntityFactory, for creating
+        entities deferred to the end of the tick (from inside systems).
+        This method is called from the Engine on creation and can't be modified.
+        @commands: instance of larv.CommandBuffer.CommandBuffer.
+        """
+        self.__commands = commands
+
+    def acquire(self, component_class, *args, **kwargs):
+        """
+        Returns a new component of the given class initialized with the given
+        arguments, reusing a removed one if the type is pooled (see
+        larv.EntityManager.EntityManager.enablePool). Meant for the components
+        of short lived entities, created and removed all the time.
+        @component_class: larv.Component subclass.
+        """
+        return self.__entity_manager.acquire(component_class, *args, **kwargs)
+
     #### EXAMPLE METHOD
     """
     # previously importing the components, obviously
@@ -73,4 +97,29 @@ class EntityFactory:
 
         # Finally, return the entity
         return new_entity 
+
+    # Batch spawning: ids are allocated as a block and every component type
+    # is inserted in one pass, instead of paying addComponent per component.
+    def createBullets(self, positions):
+        new_entities = self.entity_manager.createEntities(len(positions))
+        self.entity_manager.addComponents(new_entities, PositionComponent,
+            list(PositionComponent(x, y) for x, y in positions))
+        self.entity_manager.addComponents(new_entities, DamageComponent,
+            list(DamageComponent(10) for _ in positions))
+        return new_entities
+
+    # Pooled components: with entity_manager.enablePool(ParticleComponent)
+    # the components of removed particles are reused by the new ones.
+    def createParticle(self, x, y):
+        new_entity = self.entity_manager.createEntity()
+        self.entity_manager.addComponent(new_entity,
+            self.acquire(ParticleComponent, x, y, lifetime = 0.5))
+        return new_entity
+
+    # Deferred creation, safe to call from a system while it iterates over
+    # the entity manager: the entity is created at the end of the tick.
+    def createExplosion(self, x, y):
+        self.commands.createEntity(PositionComponent(x, y),
+                                   AnimationComponent('explosion'),
+                                   group = 'effects')
     """
\ No newline at end of file
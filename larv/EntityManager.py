@@ -1,6 +1,14 @@
 # -*- coding: UTF-8 -*-
-from larv.Entity import Entity
-from larv.Component import Component
+from collections import deque
+import sys
+from larv.Entity import Entity, INDEX_BITS, INDEX_MASK, GENERATION_MASK
+from larv.SparseSet import SparseSet
+from larv.Component import Component, ComponentMeta
+from larv.QueryView import QueryView
+from larv.ColumnStore import ColumnStore
+from larv.ChangeTracker import ChangeTracker
+from larv.MemoryReport import MemoryReport
+from larv.ComponentPool import ComponentPool
 
 """
 Notes: -Decide whether getEntitiesHavingComponent should return an
@@ -15,18 +23,53 @@ List of all methods:
 
     - generateNewId(self)
     - createEntity(self)    
+    - createEntities(self, n)
+    - isAlive(self, entity)
     - removeEntity(self, entity)  
+    - addRemovalCallback(self, function)
+    - removeRemovalCallback(self, function)
 
     - addComponent(self, entity, component)   |
     - removeComponent(self, entity, component)|
     - hasComponent(self, entity, component)   |> this methods could be passed to
     - getComponent(self, entity, component)   |  a meta_entity if implemented
     - getComponentName(self, component)       |
+    - getComponentType(self, component)
+    - addComponents(self, entities, component_type, components)
 
     - getEntitiesHavingComponent(self, component)
     - getEntitiesHavingComponents(self, *args)
+    - getEntityIdsHavingComponent(self, component)
+    - getEntityIdsHavingComponents(self, *args)
+    - getComponentById(self, id_, component)
+    - getHandle(self, id_)
     - getComponentsOfEntity(self, entity)
     - getComponentsOfType(self, component)
+    - query(self, *args, without)
+
+    - registerQuery(self, *args)
+    - unregisterQuery(self, query_view)
+
+    - registerColumnarComponent(self, component_class, capacity)
+    - getColumns(self, component)
+
+    - enablePool(self, component_class, capacity, reset)
+    - disablePool(self, component)
+    - getPool(self, component)
+    - acquire(self, component_class, *args, **kwargs)
+
+    - trackChanges(self, *args)
+    - markChanged(self, entity, component)
+    - markChangedIds(self, ids, component)
+    - getAdded(self, component, since)
+    - getChanged(self, component, since)
+    - getRemoved(self, component, since)
+    - change_version property
+
+    - exportState(self)
+    - importState(self, ids, generations, free_indices, lowest_assigned_id, components_by_class)
+
+    - memoryReport(self, deep, sample)
 
 """
 
@@ -36,10 +79,13 @@ class EntityManager:
     It's used for looking up entities, getting their list of components, creating
     them (managing that they all have unique ID's), etc.
 
-    When using components as arguments, you can use either a component of that
-    type as the argument or (recommended) calling for the class_name of the component
-    like so: EntityManager.getEntitiesHavingComponent(HealthComponent.__name__),
+    When using components as arguments, you can use the component class (recommended),
+    a component of that type or the class name of the component like so:
+        EntityManager.getEntitiesHavingComponent(HealthComponent)
+        EntityManager.getEntitiesHavingComponent(HealthComponent.__name__)
     except if the class explicitly says the opposite (read comments).
+    Class names only work as long as there aren't two component classes with
+    the same name (see larv.Component.ComponentMeta).
 
     NOTE: restricted to one component type per entity, so the same entity cannot
           have, as an example, two instances of HealthComponent. In order to change
@@ -49,17 +95,54 @@ class EntityManager:
         """
         Constructor.
         @self.__entities: used for keeping all the active entities id's.
+            -structure: dictionary, key = entity id, value = signature of the
+             entity: int bitmask with the bit (1 << component type id) set for
+             every component type the entity has (reverse index, so removing an
+             entity only touches the types it actually has).
+        @self.__handles: dict, key = entity id, value = the larv.Entity.Entity
+                         handle interned for it, returned by every query.
         @self.components_by_class: dict that will hold a list of each type of components.
             -structure: dictionary of dictionaries:
-                - key first dictionary = class name of component
-                - value first dictionary = dictionary
+                - key first dictionary = component type id of the class
+                  (see larv.Component.ComponentMeta and getComponentType)
+                - value first dictionary = larv.SparseSet.SparseSet (behaves
+                  like a dictionary, but packs the components contiguously)
                 - key 2nd dictionary = entity id
                 - value 2nd dictionary = the component itself
-        @self.__lowest_assigned_id: used for assigning a id whenever a new entity is created.
+             (for columnar component types the 2nd dictionary is a
+             larv.ColumnStore.ColumnStore, see registerColumnarComponent)
+        @self.__generations: list, index = entity index, value = generation
+                             the next entity using that index will have.
+        @self.__free_indices: deque of the indices of removed entities, reused
+                              (oldest first) before allocating new ones.
+        @self.__lowest_assigned_id: lowest index never assigned to an entity.
+        @self.__query_views: dict, key = signature (bitmask) of the queried
+                             components, value = larv.QueryView.QueryView.
+        @self.__views_by_component: dict, key = component type id, value = list
+                                    of the query views using that component.
+        @self.__removal_callbacks: list of the functions called with every
+                                   entity removed, see addRemovalCallback.
+        @self.change_tracker: larv.ChangeTracker.ChangeTracker of the component
+                              types whose changes are tracked, None until
+                              trackChanges is called.
+        @self.__pools: dict, key = component type id, value =
+                       larv.ComponentPool.ComponentPool the removed components
+                       of that type go back to (see enablePool).
+        @self.__memory_report: larv.MemoryReport.MemoryReport returned by the
+                               previous memoryReport call, None before.
         """        
-        self.__entities = []
+        self.__entities = {}
+        self.__handles = {}
         self.components_by_class = {}
+        self.__generations = [0] # index 0 is never used, so no id is 0
+        self.__free_indices = deque()
         self.__lowest_assigned_id = 1
+        self.__query_views = {}
+        self.__views_by_component = {}
+        self.change_tracker = None
+        self.__removal_callbacks = []
+        self.__pools = {}
+        self.__memory_report = None
 
     @property
     def componentsByClass(self):
@@ -68,39 +151,117 @@ class EntityManager:
 
     @property
     def entities(self):
-        """Read only property for the entities id list."""
-        return self.__entities
+        """Read only property for the entities id's (a set-like view)."""
+        return self.__entities.keys()
 
     def generateNewId(self):
-        """Returns a new unique ID and increments counter of ID's."""
-        new_id = self.__lowest_assigned_id
-        self.__lowest_assigned_id += 1
-        return new_id
+        """
+        Returns a new unique ID, made of an index (the one of a removed entity
+        if there is any, else a new one) and the generation of that index.
+        """
+        if self.__free_indices:
+            index = self.__free_indices.popleft()
+        else:
+            index = self.__lowest_assigned_id
+            self.__lowest_assigned_id += 1
+            self.__generations.append(0)
+        return (self.__generations[index] << INDEX_BITS) | index
 
     def createEntity(self):
         """
         Creates and returns a new entity object.
-        Adds the entity to entity list.
+        Adds the entity to entity registry.
         """
-        # Generate new id and add the id to the list of entities
+        # Generate new id and add the id to the registry of entities
         new_id = self.generateNewId()
-        self.__entities.append(new_id)
         # Create a new entity with the new id and return it
         new_entity = Entity(new_id)
+        self.__entities[new_entity] = 0
+        self.__handles[new_id] = new_entity
         return new_entity
 
+    def createEntities(self, n):
+        """
+        Creates and returns a list of n new entity objects, allocating their
+        id's as a single block. Useful for spawning waves or whole levels from
+        the EntityFactory.
+        @n: number of entities to create.
+        """
+        # Reuse the free indices first, then allocate the rest as a block
+        generations = self.__generations
+        reused = min(n, len(self.__free_indices))
+        new_ids = list((generations[index] << INDEX_BITS) | index
+                       for index in (self.__free_indices.popleft() for _ in range(reused)))
+        first_index = self.__lowest_assigned_id
+        self.__lowest_assigned_id += n - reused
+        generations.extend([0] * (n - reused))
+        new_ids.extend(range(first_index, self.__lowest_assigned_id))
+
+        new_entities = list(Entity(id_) for id_ in new_ids)
+        self.__entities.update((entity, 0) for entity in new_entities)
+        self.__handles.update(zip(new_ids, new_entities))
+        return new_entities
+
+    def getHandle(self, id_):
+        """
+        Returns the larv.Entity.Entity interned for the given id (the same
+        object every time), None if no entity has that id.
+        @id_: entity id (int).
+        """
+        return self.__handles.get(id_, None)
+
+    def isAlive(self, entity):
+        """
+        Returns True if the given entity hasn't been removed. Handles kept after
+        the removal are stale: the generation of their index won't match.
+        @entity: entity instance.
+        """
+        assert isinstance(entity, Entity)
+        index = entity.id & INDEX_MASK
+        return (0 < index < len(self.__generations) and
+                self.__generations[index] == entity.id >> INDEX_BITS and
+                entity.id in self.__entities)
+
     def removeEntity(self, entity):
         """
         Removes the given entity from the entity manager.
         @entity: entity instance, not id.
         """
         assert isinstance(entity, Entity)
-        assert entity.id in self.__entities
+        assert entity.id in self.__entities, 'stale or unknown entity'
+        for callback in self.__removal_callbacks:
+            callback(entity)
+
+        # Only visit the component types the entity actually has
+        tracker = self.change_tracker
+        pools = self.__pools
+        for type_id in self.__typeIds(self.__entities.pop(entity.id)):
+            store = self.components_by_class[type_id]
+            if pools and type_id in pools and not isinstance(store, ColumnStore):
+                pools[type_id].release(store.pop(entity.id))
+            else:
+                del store[entity.id]
+            self.__discardFromViews(entity.id, type_id)
+            if tracker is not None:
+                tracker.recordRemoved((entity.id,), type_id)
+        del self.__handles[entity.id]
+
+        # Free the index, bumping its generation so old handles become stale
+        index = entity.id & INDEX_MASK
+        self.__generations[index] = (self.__generations[index] + 1) & GENERATION_MASK
+        self.__free_indices.append(index)
+
+    def addRemovalCallback(self, function):
+        """
+        Makes removeEntity call function(entity) before removing every entity
+        (the engine uses it to take removed entities out of their groups).
+        @function: callable taking an entity instance.
+        """
+        self.__removal_callbacks.append(function)
 
-        for key, value in self.components_by_class.items():
-            if entity.id in value.keys():
-                value.pop(entity.id)
-        self.__entities.remove(entity.id)
+    def removeRemovalCallback(self, function):
+        """Stops calling the given function on entity removals."""
+        self.__removal_callbacks.remove(function)
 
     def addComponent(self, entity, component):
         """
@@ -110,10 +271,26 @@ class EntityManager:
         """
         assert isinstance(entity, Entity)
         assert isinstance(component, Component)
-        component_name = self.getComponentName(component)
-        # Use setdefault so if it didn't exist we create a new dict
-        second_dict = self.components_by_class.setdefault(component_name, {})
+        assert entity.id in self.__entities, 'stale or unknown entity'
+        type_id = component.component_type_id
+        second_dict = self.components_by_class.get(type_id, None)
+        if second_dict is None:
+            second_dict = self.components_by_class[type_id] = SparseSet()
+        elif type_id in self.__pools and not isinstance(second_dict, ColumnStore):
+            # The component replaced goes back to the pool, as if removed
+            replaced = second_dict.get(entity.id, None)
+            if replaced is not None and replaced is not component:
+                self.__pools[type_id].release(replaced)
         second_dict[entity.id] = component
+        signature = self.__entities[entity.id] | (1 << type_id)
+        self.__entities[entity.id] = signature
+
+        # Keep the registered query views using this component up to date
+        for view in self.__views_by_component.get(type_id, ()):
+            if signature & view.mask == view.mask:
+                view.ids.add(entity.id)
+        if self.change_tracker is not None:
+            self.change_tracker.recordAdded((entity.id,), type_id)
 
         ## DEBUG
         # print(entity.id, )
@@ -121,39 +298,84 @@ class EntityManager:
         # return self.components_by_class
         ## /DEBUG
 
+    def addComponents(self, entities, component_type, components):
+        """
+        Bulk version of addComponent: adds components[i] to entities[i] for
+        every i, all of them of the same type, inserting them in one pass.
+        @entities: list of entity instances (for example from createEntities).
+        @component_type: class, class name or instance of the component.
+        @components: list of component instances, as long as entities.
+                     For columnar component types (see registerColumnarComponent)
+                     it can also be a dict, key = field name, value = sequence
+                     (or numpy array) with the value of every entity.
+        """
+        type_id = self.getComponentType(component_type)
+        ids = list(entity.id for entity in entities)
+        if not ids:
+            return None
+
+        second_dict = self.components_by_class.get(type_id, None)
+        if second_dict is None:
+            second_dict = self.components_by_class[type_id] = SparseSet()
+        if not isinstance(second_dict, ColumnStore):
+            assert components[0].component_type_id == type_id
+            pool = self.__pools.get(type_id, None)
+            if pool is not None:
+                # The components replaced (also by a later one of the same
+                # entity in this batch) go back to the pool, as if removed
+                current = {}
+                for id_, component in zip(ids, components):
+                    replaced = current[id_] if id_ in current else second_dict.get(id_, None)
+                    if replaced is not None and replaced is not component:
+                        pool.release(replaced)
+                    current[id_] = component
+        second_dict.extend(ids, components)
+
+        signatures = self.__entities
+        bit = 1 << type_id
+        for id_ in ids:
+            signatures[id_] |= bit
+
+        # Keep the registered query views using this component up to date
+        for view in self.__views_by_component.get(type_id, ()):
+            mask = view.mask
+            view.ids.update(id_ for id_ in ids if signatures[id_] & mask == mask)
+        if self.change_tracker is not None:
+            self.change_tracker.recordAdded(ids, type_id)
+
     def removeComponent(self, entity, component):
         """
         Removes the given component of the given entity. If entity or component
         aren't found, this method does nothing.
         @entity: entity instance.
-        @component: class name name or instance of the component.
+        @component: class, class name or instance of the component.
         """
         assert isinstance(entity, Entity)
-        if not isinstance(component, str):
-            component = self.getComponentName(component)
-
-        if component not in self.components_by_class:
-            return None
-        if entity.id not in self.components_by_class[component]:
+        type_id = self.getComponentType(component)
+        second_dict = self.components_by_class.get(type_id, None)
+        if second_dict is None or entity.id not in second_dict:
             return None
         
-        self.components_by_class[component].pop(entity.id)
+        if type_id in self.__pools and not isinstance(second_dict, ColumnStore):
+            self.__pools[type_id].release(second_dict.pop(entity.id))
+        else:
+            del second_dict[entity.id]
+        self.__entities[entity.id] &= ~(1 << type_id)
+        self.__discardFromViews(entity.id, type_id)
+        if self.change_tracker is not None:
+            self.change_tracker.recordRemoved((entity.id,), type_id)
 
     def hasComponent(self, entity, component):
         """
         Returns True if given entity has given component, False instead.
         @entity: entity instance.
-        @component: name or instance of the component.
+        @component: class, class name or instance of the component.
         """
         assert isinstance(entity, Entity)
-        if not isinstance(component, str):
-            component = self.getComponentName(component)
-
-        if component not in self.components_by_class:
+        type_id = self.getComponentType(component)
+        if type_id is None:
             return False
-        if entity.id not in self.components_by_class[component]:
-            return False
-        return True
+        return bool(self.__entities.get(entity.id, 0) >> type_id & 1)
 
     def getComponent(self, entity, component):
         """
@@ -161,68 +383,82 @@ class EntityManager:
         if the entity has it.
         Returns None if not found.
         @entity: must be a entity instance, not an id.
-        @component: can be either a string or a component (which will be traduced
-                    to a string internally).
+        @component: can be either a class, a string or a component (which will
+                    be traduced to its component type id internally).
         """
         assert isinstance(entity, Entity)
-        if not isinstance(component, str):
-            component = self.getComponentName(component)
+        if isinstance(component, str):
+            component = ComponentMeta.typeIdOf(component)
+        else:
+            component = component.component_type_id
 
-        if component not in self.components_by_class:
+        second_dict = self.components_by_class.get(component, None)
+        if second_dict is None:
             return None
-        if entity.id not in self.components_by_class[component]:
+        return second_dict.get(entity.id, None)
+
+    def getComponentById(self, id_, component):
+        """
+        Id version of getComponent, for hot loops working with entity id's:
+        doesn't check its arguments.
+        @id_: entity id (int).
+        @component: component class.
+        """
+        second_dict = self.components_by_class.get(component.component_type_id, None)
+        if second_dict is None:
             return None
-        return self.components_by_class[component][entity.id]
+        return second_dict.get(id_, None)
 
     def getEntitiesHavingComponent(self, component):
         """
         Returns a list of all the entities (not their id) that have the given 
         component.
-        @component: class name or instance of the component.
+        @component: class, class name or instance of the component.
         """
-        # If component isn't a string, we transform it to a string
-        if not isinstance(component, str):
-            component = self.getComponentName(component)
-        if component not in self.components_by_class:
-            raise KeyError('Error: \'{0}\' not found (component)'.format(component))
-        # Then we iterate over the components dictionary and fill the return list
-        entites_list = []
-        comp_dict = self.components_by_class[component]
-        for key in comp_dict:
-            entites_list.append(Entity(key))
-        return entites_list
+        handles = self.__handles
+        return list(handles[id_] for id_ in self.getEntityIdsHavingComponent(component))
 
     def getEntitiesHavingComponents(self, *args):
         """
         Returns a list of all the entities that have all the args (which will be
         components).
         @args: indefinite tuple of arguments. They should all be components
-               instances or components names.
+               classes, instances or names.
         """
-        ### THIS MAY BE VERY LOW PERFORMANCE!
-        # Transform all components to their name if they weren't in string form.
-        list_args = []
-        for component in args:
-            if not isinstance(component, str):
-                component = self.getComponentName(component)
-            list_args.append(component)
-
-        # Get a set for every argument containing the id of those entities that 
-        # have that argument.
-        list_sets = []
-        for component in list_args:
-            new_set = set()
-            for entity in self.getEntitiesHavingComponent(component):
-                new_set.add(entity.id)
-            list_sets.append(new_set)
-
-        # Get the intersection of all the sets in order to get those entities that
-        # have all the given components.
-        final_set = list_sets[0]
-        for set_ in list_sets[1:]:
-            final_set = final_set.intersection(set_)
-
-        return list(Entity(id_) for id_ in final_set)
+        handles = self.__handles
+        return list(handles[id_] for id_ in self.getEntityIdsHavingComponents(*args))
+
+    def getEntityIdsHavingComponent(self, component):
+        """
+        Id version of getEntitiesHavingComponent, returns a list with the id of
+        every entity having the given component.
+        @component: class, class name or instance of the component.
+        """
+        return list(self.__getStore(component).keys())
+
+    def getEntityIdsHavingComponents(self, *args):
+        """
+        Id version of getEntitiesHavingComponents, returns a set with the id of
+        every entity having all the args.
+        When the query is registered (see registerQuery) the returned set is the
+        one kept by the view: read it, but don't modify it or add/remove
+        components of the queried types while iterating it.
+        @args: indefinite tuple of arguments. They should all be components
+               classes, instances or names.
+        """
+        # If the query was registered, its view is already up to date.
+        view = self.__query_views.get(self.getSignature(*args), None)
+        if view is not None:
+            return view.ids
+
+        ### THIS MAY BE VERY LOW PERFORMANCE! (use registerQuery when possible)
+        # Walk the smallest component dictionary and keep the entities that are
+        # in all the other ones.
+        dicts = sorted((self.__getStore(component) for component in args), key = len)
+        final_set = set(dicts[0].keys())
+        for second_dict in dicts[1:]:
+            final_set = set(id_ for id_ in final_set if id_ in second_dict)
+        return final_set
 
     def getComponentsOfEntity(self, entity):
         """
@@ -231,30 +467,431 @@ class EntityManager:
         """
         assert isinstance(entity, Entity)
         return_list = []
-        for key, value in self.components_by_class.items():
-            component = value.get(entity.id, None)
-            if component:
-                return_list.append(component)
+        for type_id in self.__typeIds(self.__entities.get(entity.id, 0)):
+            return_list.append(self.components_by_class[type_id][entity.id])
         return return_list
 
     def getComponentsOfType(self, component):
         """
         Returns a list of every component of the given type.
-        @component: component class name or component instance.
+        @component: component class, class name or component instance.
         """
-        if not isinstance(component, str):
-            component = self.getComponentName(component)
-        if component not in self.components_by_class:
-            raise KeyError('Error: \'{0}\' not found (component)'.format(component))
-        return_list = []
-        for value in self.components_by_class[component].values():
-            return_list.append(value)
-        return return_list
+        return self.__getStore(component).values()
+
+    def query(self, *args, without = ()):
+        """
+        Joins the given components: yields a tuple (entity, component_1, ...,
+        component_n) with the components in the order of args for every entity
+        having all of them and none of the without ones. Iterates the smallest
+        component type and probes the others, checking the entity signature
+        first, so it's the fastest way for a system to walk its entities:
+            for entity, position, render in self.entity_manager.query(
+                    PositionComponent, RenderComponent):
+                ...
+        Entities removed (or losing a component) while iterating are skipped.
+        @args: components classes, instances or names.
+        @without: tuple of components classes, instances or names the yielded
+                  entities must not have.
+        """
+        stores = []
+        mask = 0
+        for component in args:
+            type_id = self.getComponentType(component)
+            store = self.components_by_class.get(type_id, None)
+            if store is None:
+                return
+            stores.append(store)
+            mask |= 1 << type_id
+        without_mask = 0
+        for component in without:
+            type_id = self.getComponentType(component)
+            if type_id is not None:
+                without_mask |= 1 << type_id
+
+        signatures = self.__entities
+        handles = self.__handles
+        # keys() is a copy, so the stores can change while iterating
+        for id_ in min(stores, key = len).keys():
+            signature = signatures.get(id_, 0)
+            if signature & mask != mask or signature & without_mask:
+                continue
+            yield (handles[id_],) + tuple(store[id_] for store in stores)
 
     def getComponentName(self, component):
         """Given a component, returns it's name."""
         return component.__class__.__name__
 
+    def getComponentType(self, component):
+        """
+        Returns the component type id (see larv.Component.ComponentMeta) of the
+        given component, None if it's a name no component class has.
+        @component: class, class name or instance of the component.
+        """
+        if isinstance(component, str):
+            return ComponentMeta.typeIdOf(component)
+        return component.component_type_id
+
+    def getSignature(self, *args):
+        """
+        Returns the bitmask with the bit of every given component type set.
+        @args: components classes, instances or names.
+        """
+        signature = 0
+        for component in args:
+            type_id = self.getComponentType(component)
+            if type_id is None:
+                raise KeyError('Error: \'{0}\' not found (component)'.format(component))
+            signature |= 1 << type_id
+        return signature
+
+    def registerQuery(self, *args):
+        """
+        Registers a persistent query over the given components and returns its
+        larv.QueryView.QueryView, which will be kept up to date on every
+        addComponent, removeComponent and removeEntity call.
+        Once registered, getEntitiesHavingComponents with the same components
+        (in any order) reads from the view instead of rebuilding the result.
+        Registering the same components twice returns the same view, so it's
+        safe to call it from a System.update.
+        @args: indefinite tuple of arguments. They should all be components
+               classes, instances or names.
+        """
+        mask = self.getSignature(*args)
+        assert mask != 0
+        view = self.__query_views.get(mask, None)
+        if view is not None:
+            return view
+
+        type_ids = tuple(self.__typeIds(mask))
+        view = QueryView(tuple(ComponentMeta.types[type_id] for type_id in type_ids),
+                         mask, self.__handles)
+        # Fill the view walking the smallest component dictionary
+        dicts = list(self.components_by_class.get(type_id, ()) for type_id in type_ids)
+        signatures = self.__entities
+        for id_ in min(dicts, key = len):
+            if signatures[id_] & mask == mask:
+                view.ids.add(id_)
+
+        self.__query_views[mask] = view
+        for type_id in type_ids:
+            self.__views_by_component.setdefault(type_id, []).append(view)
+        return view
+
+    def unregisterQuery(self, query_view):
+        """
+        Stops keeping the given view up to date and forgets about it.
+        @query_view: larv.QueryView.QueryView returned by registerQuery.
+        """
+        assert isinstance(query_view, QueryView)
+        if self.__query_views.get(query_view.mask, None) is not query_view:
+            return None
+        del self.__query_views[query_view.mask]
+        for type_id in self.__typeIds(query_view.mask):
+            self.__views_by_component[type_id].remove(query_view)
+            if not self.__views_by_component[type_id]:
+                del self.__views_by_component[type_id]
+
+    def registerColumnarComponent(self, component_class, capacity = 64):
+        """
+        Opts the given component type in to struct-of-arrays storage: its
+        fields (declared in the 'columns' class attribute) will be stored in
+        contiguous numpy arrays so systems can update all of them at once
+        (see getColumns). Components of that type already added are moved to
+        the new storage. Returns the larv.ColumnStore.ColumnStore.
+        @component_class: larv.Component subclass (the class, not an instance).
+        @capacity: initial number of rows of the arrays.
+        """
+        assert issubclass(component_class, Component)
+        type_id = component_class.component_type_id
+        store = self.components_by_class.get(type_id, None)
+        if isinstance(store, ColumnStore):
+            return store
+
+        new_store = ColumnStore(component_class, capacity)
+        if store is not None:
+            for id_, component in store.items():
+                new_store[id_] = component
+        if self.change_tracker is not None and type_id in self.change_tracker:
+            new_store.setChangeTracker(self.change_tracker)
+        self.components_by_class[type_id] = new_store
+        return new_store
+
+    def getColumns(self, component):
+        """
+        Returns the larv.ColumnStore.ColumnStore of the given columnar component
+        type, whose arrays hold the fields of every entity having it.
+        @component: component class, class name or instance.
+        """
+        store = self.components_by_class.get(self.getComponentType(component), None)
+        if not isinstance(store, ColumnStore):
+            raise KeyError('Error: \'{0}\' is not a columnar component'.format(component))
+        return store
+
+    def enablePool(self, component_class, capacity = 1024, reset = None):
+        """
+        Opts the given component type in to pooling: from now on the
+        components of that type removed by removeEntity and removeComponent
+        (or replaced by addComponent and addComponents) go back to a
+        larv.ComponentPool.ComponentPool, and acquire takes them
+        from it instead of creating new ones. Returns the pool (the existing
+        one if the type was already pooled).
+        Removed components of a pooled type must not be used any more.
+        Columnar component types (see registerColumnarComponent) copy the
+        components added into their columns, so there is nothing to give
+        back to their pool: acquire just creates new ones for them.
+        @component_class: larv.Component subclass (the class, not an instance).
+        @capacity: most free components kept by the pool.
+        @reset: callable called as reset(component) on every component given
+                back, None to use the reset method of the class (if any).
+        """
+        assert issubclass(component_class, Component)
+        type_id = component_class.component_type_id
+        pool = self.__pools.get(type_id, None)
+        if pool is None:
+            pool = self.__pools[type_id] = ComponentPool(component_class, capacity, reset)
+        return pool
+
+    def disablePool(self, component):
+        """
+        Stops pooling the given component type, dropping its free components.
+        @component: class, class name or instance of the component.
+        """
+        self.__pools.pop(self.getComponentType(component), None)
+
+    def getPool(self, component):
+        """
+        Returns the larv.ComponentPool.ComponentPool of the given component
+        type, None if it isn't pooled.
+        @component: class, class name or instance of the component.
+        """
+        return self.__pools.get(self.getComponentType(component), None)
+
+    def acquire(self, component_class, *args, **kwargs):
+        """
+        Returns a new component of the given class, initialized with the given
+        arguments: taken from its pool if the type is pooled (see enablePool),
+        else just created, so factories can always use it:
+            bullet = self.entity_manager.acquire(BulletComponent, x, y, speed)
+        @component_class: larv.Component subclass.
+        """
+        pool = self.__pools.get(component_class.component_type_id, None)
+        if pool is None:
+            return component_class(*args, **kwargs)
+        return pool.acquire(*args, **kwargs)
+
+    def trackChanges(self, *args):
+        """
+        Opts the given component types in to change tracking: from now on,
+        adding, removing and changing their components is recorded, so systems
+        can process only what changed (see getChanged and larv.System.System.changed).
+        Setting a field of a columnar component through its ColumnRow counts
+        as a change; any other modification (in place changes of regular
+        components, vectorized writes to columns) must be reported with
+        markChanged or markChangedIds.
+        Returns the larv.ChangeTracker.ChangeTracker.
+        @args: component classes, class names or instances.
+        """
+        if self.change_tracker is None:
+            self.change_tracker = ChangeTracker()
+        for component in args:
+            type_id = self.getComponentType(component)
+            self.change_tracker.track(type_id)
+            store = self.components_by_class.get(type_id, None)
+            if isinstance(store, ColumnStore):
+                store.setChangeTracker(self.change_tracker)
+        return self.change_tracker
+
+    def markChanged(self, entity, component):
+        """
+        Records that the given component of the given entity changed. Does
+        nothing if the component type isn't tracked.
+        @entity: entity instance.
+        @component: class, class name or instance of the component.
+        """
+        assert isinstance(entity, Entity)
+        if self.change_tracker is not None:
+            self.change_tracker.recordChanged((entity.id,), self.getComponentType(component))
+
+    def markChangedIds(self, ids, component):
+        """
+        Bulk version of markChanged, for vectorized systems:
+            entity_manager.markChangedIds(positions.ids[moving], PositionComponent)
+        @ids: iterable (or numpy array) of entity id's.
+        @component: class, class name or instance of the component.
+        """
+        if self.change_tracker is not None:
+            if hasattr(ids, 'tolist'):
+                ids = ids.tolist()
+            self.change_tracker.recordChanged(ids, self.getComponentType(component))
+
+    @property
+    def change_version(self):
+        """
+        Version of the latest tracked change, to be given as the since argument
+        of getAdded, getChanged and getRemoved later on.
+        """
+        if self.change_tracker is None:
+            return 0
+        return self.change_tracker.version
+
+    def getAdded(self, component, since = 0):
+        """
+        Returns a list with the entities that got the given component after the
+        given version (see change_version), oldest change first.
+        @component: class, class name or instance of a tracked component.
+        @since: version, 0 for every entity having the component.
+        """
+        return self.__getChanges(ChangeTracker.ADDED, component, since)
+
+    def getChanged(self, component, since = 0):
+        """
+        Returns a list with the entities whose given component was added or
+        changed after the given version (see change_version).
+        @component: class, class name or instance of a tracked component.
+        @since: version, 0 for everything.
+        """
+        return self.__getChanges(ChangeTracker.CHANGED, component, since)
+
+    def getRemoved(self, component, since = 0):
+        """
+        Returns a list with the entities that lost the given component (or were
+        removed) after the given version. They may not be alive any more.
+        @component: class, class name or instance of a tracked component.
+        @since: version, 0 for everything.
+        """
+        return self.__getChanges(ChangeTracker.REMOVED, component, since)
+
+    def __getChanges(self, kind, component, since):
+        """Returns the entities with a change of the given kind after since."""
+        type_id = self.getComponentType(component)
+        if self.change_tracker is None or type_id not in self.change_tracker:
+            raise KeyError('Error: \'{0}\' changes are not tracked'.format(component))
+        ids = self.change_tracker.since(kind, type_id, since)
+        handles = self.__handles
+        if kind == ChangeTracker.REMOVED:
+            return list(handles.get(id_, None) or Entity(id_) for id_ in ids)
+        return list(handles[id_] for id_ in ids)
+
+    def exportState(self):
+        """
+        Returns the state needed to rebuild the entity manager (used by
+        larv.Snapshot.Snapshot): a dict with the list of the live entity id's
+        ('ids'), the 'generations' and 'free_indices' lists and the
+        'lowest_assigned_id'. The components are in self.components_by_class.
+        """
+        return {'ids': list(self.__entities),
+                'generations': list(self.__generations),
+                'free_indices': list(self.__free_indices),
+                'lowest_assigned_id': self.__lowest_assigned_id}
+
+    def importState(self, ids, generations, free_indices, lowest_assigned_id,
+                    components_by_class):
+        """
+        Replaces every entity and component with the given ones (see
+        exportState). Signatures and registered query views are rebuilt, and
+        the replacement is recorded in the change log of the tracked types
+        (the old components removed, the imported ones added), so the
+        consumers of the changes (systems, spatial indexes, replication
+        servers) catch up instead of keeping the old state.
+        @ids: list of the entity id's.
+        @generations, @free_indices, @lowest_assigned_id: id allocation state.
+        @components_by_class: dict, key = component type id, value = store
+                              (larv.SparseSet.SparseSet or larv.ColumnStore.ColumnStore).
+        """
+        tracker = self.change_tracker
+        if tracker is not None:
+            for type_id, store in self.components_by_class.items():
+                if type_id in tracker:
+                    tracker.recordRemoved(list(store.keys()), type_id)
+
+        self.__generations = list(generations)
+        self.__free_indices = deque(free_indices)
+        self.__lowest_assigned_id = lowest_assigned_id
+        # Refilled in place: the registered query views share this dict
+        self.__handles.clear()
+        self.__handles.update(zip(ids, map(Entity, ids)))
+        self.__entities = dict.fromkeys(self.__handles.values(), 0)
+        self.components_by_class = components_by_class
+
+        signatures = self.__entities
+        for type_id, store in components_by_class.items():
+            # signatures[id_] |= bit for every id_, looping in C
+            ids = list(store.keys())
+            bit_or = (1 << type_id).__or__
+            signatures.update(zip(ids, map(bit_or, map(signatures.__getitem__, ids))))
+        for mask, view in self.__query_views.items():
+            view.ids = set(id_ for id_, signature in signatures.items()
+                           if signature & mask == mask)
+
+        if tracker is not None:
+            for type_id, store in components_by_class.items():
+                if type_id in tracker:
+                    if isinstance(store, ColumnStore):
+                        store.setChangeTracker(tracker)
+                    tracker.recordAdded(list(store.keys()), type_id)
+
+    def memoryReport(self, deep = False, sample = 256):
+        """
+        Returns a larv.MemoryReport.MemoryReport with the estimated memory used
+        by the entity registry ('entities' section), by every component type
+        ('components' section, by class name) and by the free components of
+        every pool ('pools' section), compared with the previous call (see
+        its growth).
+        @deep: also take a tracemalloc snapshot, see larv.MemoryReport.MemoryReport.
+        @sample: most components of a type measured, the rest is extrapolated
+                 (None to measure every component, slow for big types).
+        """
+        report = MemoryReport(deep)
+        signatures = self.__entities
+        handles = self.__handles
+        handle_bytes = sys.getsizeof(next(iter(handles.values()), 0)) * len(handles)
+        report.add('entities', 'entities', len(signatures),
+                   sys.getsizeof(signatures) + sys.getsizeof(handles),
+                   handle_bytes + sum(map(sys.getsizeof, signatures.values())))
+        report.add('entities', 'generations', len(self.__generations) - 1,
+                   sys.getsizeof(self.__generations))
+        report.add('entities', 'free_indices', len(self.__free_indices),
+                   sys.getsizeof(self.__free_indices))
+        if self.__query_views:
+            report.add('entities', 'query_views', len(self.__query_views),
+                       sys.getsizeof(self.__query_views) + sys.getsizeof(self.__views_by_component) +
+                       sum(sys.getsizeof(view.ids) for view in self.__query_views.values()))
+        if self.change_tracker is not None:
+            report.add('entities', 'change_tracker', *self.change_tracker.memoryUsage())
+        for type_id, store in self.components_by_class.items():
+            overhead, payload = store.memoryUsage(sample)
+            report.add('components', ComponentMeta.types[type_id].__name__,
+                       len(store), overhead, payload)
+        for type_id, pool in self.__pools.items():
+            overhead, payload = pool.memoryUsage(sample)
+            report.add('pools', ComponentMeta.types[type_id].__name__,
+                       len(pool), overhead, payload)
+        report.compareTo(self.__memory_report)
+        self.__memory_report = report
+        return report
+
+    def __getStore(self, component):
+        """
+        Returns the 2nd dictionary of the given component.
+        Raises KeyError if no entity ever had that component.
+        """
+        store = self.components_by_class.get(self.getComponentType(component), None)
+        if store is None:
+            raise KeyError('Error: \'{0}\' not found (component)'.format(component))
+        return store
+
+    def __typeIds(self, signature):
+        """Yields the component type id of every bit set in the given signature."""
+        while signature:
+            lowest_bit = signature & -signature
+            yield lowest_bit.bit_length() - 1
+            signature ^= lowest_bit
+
+    def __discardFromViews(self, id_, type_id):
+        """Removes the given entity id from every view using the given component."""
+        for view in self.__views_by_component.get(type_id, ()):
+            view.ids.discard(id_)
+
 
     ##### PYTHONIC METHODS FOR EASIER PROGRAMMING
     def __getitem__(self, entity):
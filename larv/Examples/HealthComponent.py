@@ -1,10 +1,19 @@
 
+
+
 """
 Component which holds data about health.
 """
+import larv
+
+class HealthComponent(larv.Component):
+    """
+    Health of an entity.
+    Declares its fields as columns so the entity manager can store it in numpy
+    arrays (see larv.EntityManager.EntityManager.registerColumnarComponent).
+    """
+    columns = (('current_hp', 'f8'), ('max_hp', 'f8'), ('alive', '?'))
 
-class HealthComponent:
-    """docstring for HealthComponent"""
     def __init__(self, current_hp, max_hp):
         """
         Constructor.
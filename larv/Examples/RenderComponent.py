@@ -2,8 +2,9 @@
 """
 Component which holds data about a sprite.
 """
+import larv
 
-class RenderComponent:
+class RenderComponent(larv.Component):
     def __init__(self, sprite):
         """Sprite needs to be a pygame.image object."""
         self.sprite = sprite
@@ -1,6 +1,8 @@
 import larv
 
 class PositionComponent(larv.Component):
+    columns = (('x', 'f8'), ('y', 'f8'))
+
     def __init__(self, x, y):
         self.x = x
         self.y = y
@@ -14,14 +14,9 @@ class RenderSystem(larv.System):
         self.surface = surface
 
     def update(self):
-        list_entities = self.entity_manager.getEntitiesHavingComponents(
-                            PositionComponent.__name__,
-                            RenderComponent.__name__)
-
-        for entity in list_entities:
-            position_comp = self.entity_manager.getComponent(entity, PositionComponent.__name__)
-            render_comp = self.entity_manager.getComponent(entity, RenderComponent.__name__)
-
+        # Joins both components in one pass, walking the smallest table
+        for entity, position_comp, render_comp in self.entity_manager.query(
+                PositionComponent, RenderComponent):
             x = position_comp.x
             y = position_comp.y
             self.surface.blit(render_comp.sprite, (x, y))
@@ -1,3 +1,4 @@
+import asyncio
 import pygame
 import sys
 from pygame.locals import *
@@ -15,17 +16,15 @@ WIN_HEIGHT = 680
 
 
 def main():
-    global FPSCLOCK, DISPLAYSURF
+    global DISPLAYSURF
     pygame.init()
-    # Create clock to manage frames
-    FPSCLOCK = pygame.time.Clock()
     # Create main surface
     DISPLAYSURF = pygame.display.set_mode((WIN_WIDTH, WIN_HEIGHT))
 
     while True:
-        runGame()
+        asyncio.run(runGame())
 
-def runGame():
+async def runGame():
     # Initialize the framework
     entity_factory = Pieces.EntityFactory()
     engine = larv.Engine(entity_factory)
@@ -39,8 +38,7 @@ def runGame():
     # Add systems to the engine
     engine.addSystem(render_system, 0) # priority, less is before
 
-    game_over = False
-    while not game_over:
+    def beforeUpdate():
         DISPLAYSURF.fill(WHITE)
 
         # Handle events
@@ -48,12 +46,15 @@ def runGame():
             if event.type == QUIT:
                 terminate()
 
-        # Update the game (engine updates every single system in priority order)
-        engine.update()
-        # Update the window (paint everything)
-        pygame.display.update()
-        # Wait so FPS get accomplished
-        FPSCLOCK.tick(FPS)
+    # The world updates the engine (which updates every single system in
+    # priority order, awaiting the ones that wait on I/O) FPS times per second,
+    # passing the seconds elapsed since the previous frame, and updates the
+    # window (paints everything) after every update. Popping the engine from
+    # the world ends the game.
+    world = larv.World()
+    world.push(engine)
+    await world.runAsync(FPS, before_update = beforeUpdate,
+                         after_update = pygame.display.update)
 
 def terminate():
     """Ends the game and closes everything."""
@@ -1,6 +1,9 @@
 # -*- coding: UTF-8 -*-
 import larv
 import pprint
+import sys
+
+from larv.MemoryReport import MemoryReport
 
 class GroupManager:
     """
@@ -19,16 +22,38 @@ class GroupManager:
         - In some systems, it may be convenient to ask for a certain group
           of entities. For example, a system that only acts on the Hero, may
           call for it using self.group_manager.get('hero')
+
+    Group names aren't case sensitive: every name is lowercased once, the
+    first time it's used, and remembered. Asking for several groups at once
+    intersects their sets smallest first, and the result is cached until the
+    membership of one of those groups changes, so systems asking every tick
+    for the same combination of groups don't intersect them every time.
+
+    The groups of every entity are indexed too, so getGroups and
+    removeCompletely only visit the groups of the entity. The engine calls
+    removeCompletely whenever an entity is removed from its entity manager,
+    so removed entities don't stay in their groups.
     """
+    CACHE_SIZE = 64
+
     def __init__(self, engine):
         """
         Constructor.
         @engine: larv.Engine.Engine instance.
         @entitiesByGroup: dictionary, key = group, value = set of entities
+        @journal: None, or a list where every change of membership is appended
+                  as (group, entity, True if added / False if removed), for
+                  whoever needs to follow them (see larv.Replication).
         """
         assert isinstance(engine, larv.Engine)
         self.engine = engine
         self.entitiesByGroup = {}
+        self.journal = None
+        self.__names = {}     # name as given -> normalized (lowercase) name
+        self.__versions = {}  # group -> number of membership changes
+        self.__cache = {}     # tuple of groups -> (versions, set of entities)
+        self.__groups_of = {} # entity id -> set of the groups it's in
+        self.__memory_report = None # previous memoryReport
 
     def add(self, entity, group):
         """
@@ -39,9 +64,15 @@ class GroupManager:
         """
         assert isinstance(entity, larv.Entity)
         assert isinstance(group, str)
-        group = group.lower()
+        group = self.__normalize(group)
         set_entities = self.entitiesByGroup.setdefault(group, set())
+        if entity.id in set_entities:
+            return None
         set_entities.add(entity.id)
+        self.__groups_of.setdefault(entity.id, set()).add(group)
+        self.__versions[group] = self.__versions.get(group, 0) + 1
+        if self.journal is not None:
+            self.journal.append((group, entity, True))
 
     def remove(self, entity, group):
         """
@@ -51,10 +82,17 @@ class GroupManager:
         """
         assert isinstance(entity, larv.Entity)
         assert isinstance(group, str)
-        group = group.lower()
+        group = self.__normalize(group)
         set_entities = self.entitiesByGroup.get(group, None)
         if set_entities:
             set_entities.remove(entity.id)
+            self.__versions[group] = self.__versions.get(group, 0) + 1
+            groups = self.__groups_of[entity.id]
+            groups.discard(group)
+            if not groups:
+                del self.__groups_of[entity.id]
+            if self.journal is not None:
+                self.journal.append((group, entity, False))
 
     def removeCompletely(self, entity):
         """
@@ -62,9 +100,11 @@ class GroupManager:
         @entity: larv.Entity.Entity instance.
         """
         assert isinstance(entity, larv.Entity)
-        for value in self.entitiesByGroup.values():
-            if entity.id in value:
-                value.remove(entity.id)
+        for group in self.__groups_of.pop(entity.id, ()):
+            self.entitiesByGroup[group].remove(entity.id)
+            self.__versions[group] = self.__versions.get(group, 0) + 1
+            if self.journal is not None:
+                self.journal.append((group, entity, False))
 
     def get(self, *args):
         """
@@ -74,17 +114,105 @@ class GroupManager:
         that are in that group.
         @*args: name (string) of the groups that will be fetched.
         """
-        for arg in args:
-            assert isinstance(arg, str)
+        # The groups hold the entity handles themselves (an entity is its id),
+        # so there is no need to build new ones.
+        return list(self.getIds(*args))
+
+    def getIds(self, *args):
+        """
+        Id version of get, returns a set with the id of the entities that are
+        in every arg (don't modify it, it can be the set of the group itself
+        or a cached result).
+        Raises KeyError if one of the groups never had any entity.
+        @*args: name (string) of the groups that will be fetched.
+        """
+        names = self.__names
+        groups = list(names.get(arg, None) or self.__normalize(arg) for arg in args)
+        if len(groups) == 1:
+            return self.entitiesByGroup[groups[0]]
+        if not groups:
+            return set()
+
+        key = tuple(sorted(set(groups)))
+        versions = tuple(self.__versions.get(group, 0) for group in key)
+        cached = self.__cache.pop(key, None)
+        if cached is not None and cached[0] == versions:
+            self.__cache[key] = cached # most recently used go last
+            return cached[1]
+
+        # Smallest first, stopping as soon as the intersection is empty
+        sets = sorted((self.entitiesByGroup[group] for group in key), key = len)
+        return_set = sets[0]
+        for other in sets[1:]:
+            if not return_set:
+                break
+            return_set = return_set & other
+        if return_set is sets[0]:
+            return_set = set(return_set)
+
+        if len(self.__cache) >= self.CACHE_SIZE:
+            del self.__cache[next(iter(self.__cache))] # least recently used
+        self.__cache[key] = (versions, return_set)
+        return return_set
+
+    def exportState(self):
+        """Returns the membership of every group (dict, see importState)."""
+        return self.entitiesByGroup
+
+    def importState(self, entities_by_group):
+        """
+        Replaces every group with the given ones (used by larv.Snapshot.Snapshot).
+        The differences of membership are appended to the journal, if any.
+        @entities_by_group: dict, key = group name (lowercase), value = set
+                            of entities.
+        """
+        if self.journal is not None:
+            for group in sorted(set(self.entitiesByGroup) | set(entities_by_group)):
+                old = self.entitiesByGroup.get(group, set())
+                new = entities_by_group.get(group, set())
+                self.journal.extend((group, larv.Entity(id_), False) for id_ in sorted(old - new))
+                self.journal.extend((group, larv.Entity(id_), True) for id_ in sorted(new - old))
+        for group in self.entitiesByGroup:
+            self.__versions[group] = self.__versions.get(group, 0) + 1
+        self.entitiesByGroup = entities_by_group
+        self.__groups_of = {}
+        for group, entities in entities_by_group.items():
+            self.__versions[group] = self.__versions.get(group, 0) + 1
+            for entity in entities:
+                self.__groups_of.setdefault(entity, set()).add(group)
+        self.__cache = {}
 
-        return_set = set()
-        for arg in args:
-            if return_set:
-                return_set = return_set & self.entitiesByGroup[arg.lower()] # intersection
-            else:
-                return_set = self.entitiesByGroup[arg.lower()]
+    def memoryReport(self, deep = False):
+        """
+        Returns a larv.MemoryReport.MemoryReport with the estimated memory used
+        by every group ('groups' section, by name) and by the index of the
+        groups of every entity, the cache of intersections and the journal,
+        compared with the previous call (see its growth).
+        @deep: also take a tracemalloc snapshot, see larv.MemoryReport.MemoryReport.
+        """
+        report = MemoryReport(deep)
+        for group, entities in self.entitiesByGroup.items():
+            report.add('groups', group, len(entities), sys.getsizeof(entities))
+        report.add('engine', 'group_index', len(self.__groups_of),
+                   sys.getsizeof(self.__groups_of) + sys.getsizeof(self.entitiesByGroup) +
+                   sum(map(sys.getsizeof, self.__groups_of.values())))
+        if self.__cache:
+            report.add('engine', 'group_cache', len(self.__cache), sys.getsizeof(self.__cache) +
+                       sum(sys.getsizeof(entities) for versions, entities in self.__cache.values()))
+        if self.journal is not None:
+            report.add('engine', 'group_journal', len(self.journal), sys.getsizeof(self.journal) +
+                       sum(map(sys.getsizeof, self.journal)))
+        report.compareTo(self.__memory_report)
+        self.__memory_report = report
+        return report
 
-        return list(larv.Entity(id_) for id_ in return_set)
+    def __normalize(self, group):
+        """Returns the normalized name of the given group, remembering it."""
+        assert isinstance(group, str)
+        normalized = self.__names.get(group, None)
+        if normalized is None:
+            normalized = self.__names[group] = group.lower()
+        return normalized
 
     def getGroups(self, entity):
         """
@@ -92,11 +220,7 @@ class GroupManager:
         @entity: larv.Entity.Entity instance
         """
         assert isinstance(entity, larv.Entity)
-        group_names = []
-        for key, value in self.entitiesByGroup.items():
-            if entity.id in value:
-                group_names.append(key)
-        return group_names
+        return list(self.__groups_of.get(entity.id, ()))
 
     def isInGroup(self, entity, group):
         """
@@ -107,7 +231,7 @@ class GroupManager:
         """
         assert isinstance(entity, larv.Entity)
         assert isinstance(group, str)
-        return entity.id in self.entitiesByGroup[group.lower()]
+        return entity.id in self.entitiesByGroup[self.__normalize(group)]
 
     def doesGroupExist(self, group):
         """
@@ -116,11 +240,7 @@ class GroupManager:
         @group: name of the group (str)
         """
         assert isinstance(group, str)
-        if group not in self.entitiesByGroup.keys():
-            return False
-        if len(self.entitiesByGroup[group]) == 0:
-            return False
-        return True
+        return len(self.entitiesByGroup.get(self.__normalize(group), ())) > 0
 
     ##### PYTHONIC METHODS FOR EASIER PROGRAMMING
     def __str__(self):
@@ -0,0 +1,183 @@
+# encoding: UTF-8
+import sys
+import tracemalloc
+
+class MemoryReport:
+    """
+    Estimated memory used by an entity manager, a group manager or a whole
+    engine (see their memoryReport methods), to find out what to shrink when
+    a process gets close to its memory limit:
+        report = engine.memoryReport()
+        print(report)                        # biggest entries first
+        report.get('components', 'PositionComponent')['bytes']
+
+    Every entry (a component type, a group, the entity registry...) belongs
+    to a section ('entities', 'components', 'pools', 'groups', 'engine') and
+    has:
+        - count: number of things it holds (entities, components, members).
+        - overhead: bytes of the containers holding them (dicts, sets, lists,
+          sparse arrays, unused capacity of the columns).
+        - payload: bytes of the things themselves (component instances with
+          their attributes, used rows of the columns).
+    Sizes come from sys.getsizeof, so they are estimates: objects shared
+    between entries (interned strings, small ints, entity handles) are
+    counted where they are referenced. The payload of big component types
+    is extrapolated from a sample of their components.
+
+    Every memoryReport call is compared with the previous one of the same
+    object: self.growth holds the count and bytes gained by every entry
+    since then.
+
+    Deep mode (memoryReport(deep = True)) also takes a tracemalloc snapshot,
+    starting tracemalloc if it wasn't tracing (the first deep report is then
+    just the baseline). self.allocations lists the source lines whose
+    allocated memory grew the most since the previous deep report, where
+    leaks show up. Tracing slows the whole program down, stop it with
+    tracemalloc.stop() once done.
+    """
+    def __init__(self, deep = False, limit = 10):
+        """
+        Constructor.
+        @deep: take a tracemalloc snapshot (see above).
+        @limit: number of source lines kept in self.allocations.
+        @self.entries: dict, key = (section, name), value = [count, overhead
+                       bytes, payload bytes].
+        @self.growth: dict, key = (section, name), value = (count, bytes)
+                      gained since the previous report (empty for the first).
+        @self.allocations: list of tracemalloc.StatisticDiff, None unless
+                           deep and there was a previous deep report.
+        @self.traced: tracemalloc.Snapshot taken in deep mode (else the one
+                      of the previous deep report, the baseline of the next).
+        """
+        self.entries = {}
+        self.growth = {}
+        self.allocations = None
+        self.limit = limit
+        self.traced = None
+        self.deep = deep
+        if deep:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            self.traced = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+                tracemalloc.Filter(False, __file__)))
+
+    def add(self, section, name, count, overhead, payload = 0):
+        """
+        Adds (or accumulates into) the entry of the given section and name.
+        @count: number of things held.
+        @overhead, @payload: bytes, see the class docstring.
+        """
+        entry = self.entries.setdefault((section, name), [0, 0, 0])
+        entry[0] += count
+        entry[1] += overhead
+        entry[2] += payload
+
+    def extend(self, other):
+        """Adds every entry of the given report to this one."""
+        for (section, name), (count, overhead, payload) in other.entries.items():
+            self.add(section, name, count, overhead, payload)
+
+    def compareTo(self, previous):
+        """
+        Fills self.growth (and self.allocations, if both reports are deep)
+        with the differences from the given previous report.
+        @previous: MemoryReport, or None (nothing to compare with).
+        """
+        if previous is None:
+            return None
+        for key, (count, overhead, payload) in self.entries.items():
+            old_count, old_overhead, old_payload = previous.entries.get(key, (0, 0, 0))
+            self.growth[key] = (count - old_count,
+                                overhead + payload - old_overhead - old_payload)
+        for key, (count, overhead, payload) in previous.entries.items():
+            if key not in self.entries:
+                self.growth[key] = (-count, -overhead - payload)
+        if not self.deep:
+            self.traced = previous.traced
+        elif previous.traced is not None:
+            self.allocations = self.traced.compare_to(previous.traced, 'lineno')[:self.limit]
+
+    def get(self, section, name):
+        """
+        Returns a dict with the 'count', 'overhead', 'payload', 'bytes' and
+        'growth' (bytes) of the given entry, None if there isn't one.
+        """
+        entry = self.entries.get((section, name), None)
+        if entry is None:
+            return None
+        count, overhead, payload = entry
+        return {'count': count, 'overhead': overhead, 'payload': payload,
+                'bytes': overhead + payload,
+                'growth': self.growth.get((section, name), (0, 0))[1]}
+
+    def sectionBytes(self, section):
+        """Returns the bytes of every entry of the given section."""
+        return sum(overhead + payload for (entry_section, name), (count, overhead, payload)
+                   in self.entries.items() if entry_section == section)
+
+    @property
+    def total_bytes(self):
+        """Estimated bytes of every entry."""
+        return sum(overhead + payload for count, overhead, payload in self.entries.values())
+
+    def summary(self):
+        """
+        Returns a dict, key = section, value = dict, key = entry name, value =
+        the dict returned by get.
+        """
+        summary = {}
+        for section, name in self.entries:
+            summary.setdefault(section, {})[name] = self.get(section, name)
+        return summary
+
+    ##### SIZE ESTIMATES (used by the memoryReport methods)
+    @staticmethod
+    def objectBytes(obj):
+        """
+        Returns the bytes of the given object, its __dict__ (or __slots__)
+        and the attribute values in it (not following them any further).
+        """
+        size = sys.getsizeof(obj)
+        attributes = getattr(obj, '__dict__', None)
+        if attributes is not None:
+            size += sys.getsizeof(attributes)
+            values = attributes.values()
+        else:
+            slots = getattr(type(obj), '__slots__', ())
+            values = list(getattr(obj, slot) for slot in slots if hasattr(obj, slot))
+        return size + sum(map(sys.getsizeof, values))
+
+    @staticmethod
+    def sampledBytes(objects, sample = 256):
+        """
+        Returns the estimated bytes (see objectBytes) of the objects of the
+        given list, measuring at most sample of them, evenly spread, and
+        extrapolating to the rest.
+        """
+        if not objects:
+            return 0
+        if sample is None or len(objects) <= sample:
+            return sum(map(MemoryReport.objectBytes, objects))
+        stride = len(objects) / sample
+        measured = sum(MemoryReport.objectBytes(objects[int(i * stride)]) for i in range(sample))
+        return int(measured * len(objects) / sample)
+
+    ##### PYTHONIC METHODS FOR EASIER PROGRAMMING
+    def __str__(self):
+        """Returns a string representation, one line per entry, biggest first."""
+        lines = ['MemoryReport: {0:.1f} KiB'.format(self.total_bytes / 1024.0)]
+        ordered = sorted(self.entries.items(), key = lambda item: -item[1][1] - item[1][2])
+        for (section, name), (count, overhead, payload) in ordered:
+            line = '{0}/{1}: {2} items, {3:.1f} KiB ({4:.1f} KiB overhead, {5:.1f} KiB payload)'.format(
+                section, name, count, (overhead + payload) / 1024.0,
+                overhead / 1024.0, payload / 1024.0)
+            growth = self.growth.get((section, name), None)
+            if growth is not None:
+                line += ', {0:+d} items, {1:+.1f} KiB since the previous report'.format(
+                    growth[0], growth[1] / 1024.0)
+            lines.append(line)
+        for statistic in self.allocations or ():
+            lines.append('allocated at {0}'.format(statistic))
+        return '\n'.join(lines)
@@ -1,4 +1,5 @@
 # encoding: UTF-8
+import bisect
 
 class PriorityList:
     """
@@ -7,7 +8,8 @@ class PriorityList:
         - First item will be the content we want to store
         - Second item will be the content used for ordering the list.
           This item needs to have the __lt__ method.
-    Optimized thinking that users will introduce higher priority items first.
+    Items are inserted with a binary search, before the items that have the
+    same order value.
 
     Note: Ordered from lower value to higher, that's thought out
           for easy usage using numbers, where 0 will be max priority (assuming
@@ -15,8 +17,14 @@ class PriorityList:
           less priority as they get higher.
     """
     def __init__(self):
-        """Constructor. This class only needs a list."""
+        """
+        Constructor.
+        @self.list: list of the (item, order value) tuples, ordered.
+        @self.__order_values: list of the order values, parallel to self.list
+                              (for the binary search).
+        """
         self.list = []
+        self.__order_values = []
 
     def add(self, item, order_value):
         """
@@ -24,28 +32,52 @@ class PriorityList:
         @item: stored content.
         @order_value: used for knowing in which position the content will be stored.
         """
-        for i in range(len(self.list), 0, -1):
-            if self.list[i-1][1] < order_value:
-                self.list.insert(i, (item, order_value))
-                return
-        else:
-            self.list.insert(0, (item, order_value))
+        i = bisect.bisect_left(self.__order_values, order_value)
+        self.list.insert(i, (item, order_value))
+        self.__order_values.insert(i, order_value)
 
     def change(self, item, order_value):
         """Changes the given item's order_value."""
-        assert item in self.list
+        assert item in self
         self.remove(item)
         self.add(item, order_value)
 
     def remove(self, item):
-        """Removes the given item from the priority list."""
-        return self.list.remove(item)
+        """
+        Removes the given item from the priority list.
+        Raises ValueError if it isn't in the list.
+        """
+        i = self.index(item)
+        del self.list[i]
+        del self.__order_values[i]
+
+    def index(self, item):
+        """
+        Returns the position of the given item in the list.
+        Raises ValueError if it isn't in the list.
+        """
+        for i, node in enumerate(self.list):
+            if node[0] is item:
+                return i
+        raise ValueError('{0!r} is not in the priority list'.format(item))
+
+    def orderValue(self, item):
+        """Returns the order value the given item was added with."""
+        return self.__order_values[self.index(item)]
 
     def __iter__(self):
         """Iterates over the content values of the list."""
         for item in self.list:
             yield item[0]
 
+    def __len__(self):
+        """Returns the number of items."""
+        return len(self.list)
+
+    def __contains__(self, item):
+        """Defines the usage of: item in priority_list."""
+        return any(node[0] is item for node in self.list)
+
     def __str__(self):
         """Returns a string representation."""
         return 'PriorityList: {0}'.format(str(self.list))
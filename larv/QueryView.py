@@ -0,0 +1,57 @@
+# -*- coding: UTF-8 -*-
+class QueryView:
+    """
+    Persistent result of a multi component query.
+    Created with EntityManager.registerQuery(*components), and from then on
+    kept up to date by the entity manager whenever a component is added or
+    removed or an entity is removed, so reading it costs O(matches) instead
+    of rebuilding and intersecting one set per component type.
+
+    Usage:
+        view = entity_manager.registerQuery(PositionComponent, RenderComponent)
+        for entity in view:
+            ...
+
+    NOTE: iterate view.entities (a copy) instead of the view itself if the
+          loop adds or removes components of the queried types.
+    """
+    def __init__(self, components, mask, handles):
+        """
+        Constructor.
+        @components: tuple with the queried component classes.
+        @mask: signature of the query, bitmask with the bit (1 << component
+               type id) of every queried component set.
+        @handles: dict, key = entity id, value = interned larv.Entity.Entity
+                  (owned by the entity manager).
+        @self.ids: set of the id's of the entities having every component.
+        """
+        self.components = components
+        self.mask = mask
+        self.ids = set()
+        self.__handles = handles
+
+    @property
+    def entities(self):
+        """Returns a list with an entity (not id) for every match."""
+        handles = self.__handles
+        return list(handles[id_] for id_ in self.ids)
+
+    ##### PYTHONIC METHODS FOR EASIER PROGRAMMING
+    def __iter__(self):
+        """Iterates over the matching entities (not their id)."""
+        handles = self.__handles
+        for id_ in self.ids:
+            yield handles[id_]
+
+    def __len__(self):
+        """Returns the number of matching entities."""
+        return len(self.ids)
+
+    def __contains__(self, entity):
+        """Defines the usage of: entity in view."""
+        return entity.id in self.ids
+
+    def __str__(self):
+        """Returns a string representation."""
+        return 'QueryView{0}: {1}'.format(list(component.__name__ for component in self.components),
+                                          sorted(self.ids))
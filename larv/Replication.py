@@ -0,0 +1,415 @@
+# encoding: UTF-8
+from collections import deque
+import struct
+
+from larv.Component import ComponentMeta
+from larv.ColumnStore import ColumnStore
+from larv.ChangeTracker import ChangeTracker
+
+"""
+State replication: a ReplicationServer follows the changes of an
+authoritative Engine and sends every client, each tick, only what changed
+(and only for the entities the client is interested in). A ReplicationClient
+applies those deltas to its own Engine, which ends up mirroring the server.
+
+Server side (after every engine.update()):
+    server = larv.ReplicationServer(engine, (PositionComponent, HealthComponent))
+    server.addClient(transport, interest = lambda entity: near(player, entity))
+    ...
+    engine.update()
+    server.update()
+
+Client side:
+    client = larv.ReplicationClient(engine, transport)
+    ...
+    client.update()   # applies every delta received
+    local_entity = client.entities[server_entity_id]
+
+Transports are any object with send(data) and receive() (returning the list of
+the messages, bytes, received since the previous call, without blocking).
+LoopbackTransport does that in memory, for testing and local play.
+"""
+
+class LoopbackTransport:
+    """In process transport: what is sent is received by the other end."""
+    def __init__(self):
+        self.__messages = deque()
+        self.bytes_sent = 0
+
+    def send(self, data):
+        """Queues the given message (bytes)."""
+        self.bytes_sent += len(data)
+        self.__messages.append(data)
+
+    def receive(self):
+        """Returns (and forgets) the list of the queued messages."""
+        messages = list(self.__messages)
+        self.__messages.clear()
+        return messages
+
+
+class ReplicationServer:
+    """
+    Produces the per tick deltas of the given component types (and of the
+    groups of the entities having them) and sends them to every client.
+
+    A delta holds, for one client: the entities spawned (that became visible
+    to it, with all their replicated components and groups) and destroyed
+    (removed, or not interesting any more), the components added and removed,
+    the fields that changed (compared with the previous tick, unchanged fields
+    aren't sent) and the group membership changes.
+
+    Changes are found with the change tracking of the entity manager (see
+    larv.EntityManager.EntityManager.trackChanges), enabled for the replicated
+    types by the server: in place modifications of regular components have to
+    be reported with markChanged to be replicated.
+
+    Interest: every client can have a function interest(entity) -> bool. It's
+    evaluated again for an entity whenever one of its replicated components
+    changes, so it should depend on those components (for example, distance
+    to the player of the client).
+
+    NOTE: component fields must be None, bool, int, float, str, bytes or
+          lists, tuples (sent as lists) and dicts of those.
+    """
+    def __init__(self, engine, components):
+        """
+        Constructor.
+        @engine: authoritative larv.Engine.Engine instance.
+        @components: tuple with the replicated component classes.
+        @self.__baseline: dict, key = component type id, value = dict, key =
+                          entity id, value = dict with the fields last sent.
+        """
+        self.engine = engine
+        self.entity_manager = engine.entity_manager
+        self.group_manager = engine.group_manager
+        self.components = tuple(components)
+        self.tick = 0
+        self.__clients = []
+        self.__type_ids = tuple(component.component_type_id for component in self.components)
+        self.__tracker = self.entity_manager.trackChanges(*self.components)
+        self.__cursor = self.__tracker.version
+        self.__tracker.setCursor(self, self.__cursor)
+        if self.group_manager.journal is None:
+            self.group_manager.journal = []
+
+        self.__baseline = {}
+        for type_id in self.__type_ids:
+            store = self.entity_manager.components_by_class.get(type_id, {})
+            self.__baseline[type_id] = dict((id_, self.__fields(store, id_)) for id_ in store)
+
+    def addClient(self, transport, interest = None):
+        """
+        Adds a client, which gets the whole (interesting) state on the next
+        update and deltas from then on. Returns the client, to be given to
+        removeClient.
+        @transport: object with a send(bytes) method.
+        @interest: function interest(entity) -> bool, None for every entity.
+        """
+        client = _ClientState(transport, interest)
+        self.__clients.append(client)
+        return client
+
+    def removeClient(self, client):
+        """Stops sending deltas to the given client (returned by addClient)."""
+        self.__clients.remove(client)
+
+    def update(self):
+        """
+        Computes the changes since the previous update and sends its delta to
+        every client. Call it after every engine.update().
+        """
+        self.tick += 1
+        tracker = self.__tracker
+        cursor = self.__cursor
+        self.__cursor = tracker.version
+        tracker.setCursor(self, self.__cursor)
+        group_changes = self.group_manager.journal[:]
+        del self.group_manager.journal[:]
+
+        # Changed fields of every entity, compared with the baseline
+        added = {}    # type id -> list of ids
+        removed = {}  # type id -> list of ids
+        changed = {}  # type id -> dict, key = id, value = dict of changed fields
+        touched = set()
+        for type_id in self.__type_ids:
+            store = self.entity_manager.components_by_class.get(type_id, {})
+            baseline = self.__baseline[type_id]
+            added[type_id] = tracker.since(ChangeTracker.ADDED, type_id, cursor)
+            removed[type_id] = tracker.since(ChangeTracker.REMOVED, type_id, cursor)
+            for id_ in removed[type_id]:
+                baseline.pop(id_, None)
+            changes = changed[type_id] = {}
+            for id_ in tracker.since(ChangeTracker.CHANGED, type_id, cursor):
+                fields = self.__fields(store, id_)
+                old = baseline.get(id_, {})
+                diff = dict((name, value) for name, value in fields.items()
+                            if name not in old or old[name] != value)
+                baseline[id_] = fields
+                if diff:
+                    changes[id_] = diff
+            touched.update(added[type_id], removed[type_id], changes)
+        touched.update(entity for group, entity, is_added in group_changes)
+
+        for client in self.__clients:
+            if client.synced:
+                candidates = touched
+            else:
+                candidates = set(touched)
+                for baseline in self.__baseline.values():
+                    candidates.update(baseline)
+                client.synced = True
+            delta = self.__delta(client, candidates, added, removed, changed, group_changes)
+            client.transport.send(encode(delta))
+
+    def __delta(self, client, candidates, added, removed, changed, group_changes):
+        """Returns the delta (list) of the given client."""
+        known = client.known
+        spawned, destroyed = [], []
+        for id_ in sorted(candidates):
+            entity = self.entity_manager.getHandle(id_)
+            visible = (entity is not None and
+                       any(id_ in self.__baseline[type_id] for type_id in self.__type_ids) and
+                       (client.interest is None or client.interest(entity)))
+            if visible and id_ not in known:
+                known.add(id_)
+                components = list([ComponentMeta.types[type_id].__name__, self.__baseline[type_id][id_]]
+                                  for type_id in self.__type_ids if id_ in self.__baseline[type_id])
+                spawned.append([id_, components, self.group_manager.getGroups(entity)])
+            elif not visible and id_ in known:
+                known.remove(id_)
+                destroyed.append(id_)
+        new = set(spawn[0] for spawn in spawned)
+
+        components = []
+        for type_id in self.__type_ids:
+            name = ComponentMeta.types[type_id].__name__
+            type_added = list(id_ for id_ in added[type_id] if id_ in known and id_ not in new)
+            type_removed = list(id_ for id_ in removed[type_id] if id_ in known)
+            type_added_set = set(type_added)
+            type_changed = list([id_, fields] for id_, fields in changed[type_id].items()
+                                if id_ in known and id_ not in new and id_ not in type_added_set)
+            if type_added or type_removed or type_changed:
+                baseline = self.__baseline[type_id]
+                components.append([name,
+                                   list([id_, baseline[id_]] for id_ in type_added),
+                                   type_removed,
+                                   type_changed])
+        groups = list([group, int(entity), is_added] for group, entity, is_added in group_changes
+                      if entity in known and entity not in new)
+        return [self.tick, spawned, destroyed, components, groups]
+
+    def __fields(self, store, id_):
+        """Returns a dict with the fields of the component of the given entity."""
+        if isinstance(store, ColumnStore):
+            row = store.rowOf(id_)
+            return dict((name, store.column(name)[row].item()) for name in store.fields)
+        return dict(vars(store[id_]))
+
+
+class _ClientState:
+    """What the server knows about a client."""
+    def __init__(self, transport, interest):
+        self.transport = transport
+        self.interest = interest
+        self.known = set()   # server id's of the entities the client has
+        self.synced = False  # False until the whole state has been sent
+
+
+class ReplicationClient:
+    """
+    Applies the deltas sent by a ReplicationServer to a local engine.
+    Local entities have their own id's: self.entities maps the id of every
+    entity on the server to its local entity.
+    Components are rebuilt from their class name (the component classes must
+    exist on the client too) without calling their __init__.
+    """
+    def __init__(self, engine, transport):
+        """
+        Constructor.
+        @engine: larv.Engine.Engine instance mirroring the server.
+        @transport: object with a receive() method.
+        @self.entities: dict, key = server entity id, value = local entity.
+        """
+        self.engine = engine
+        self.transport = transport
+        self.entities = {}
+        self.tick = 0
+
+    def update(self):
+        """Applies every delta received. Returns how many were applied."""
+        messages = self.transport.receive()
+        for data in messages:
+            self.apply(decode(data))
+        return len(messages)
+
+    def apply(self, delta):
+        """Applies a single (decoded) delta."""
+        entity_manager = self.engine.entity_manager
+        group_manager = self.engine.group_manager
+        entities = self.entities
+        tick, spawned, destroyed, components, groups = delta
+
+        for id_ in destroyed:
+            entity_manager.removeEntity(entities.pop(id_))
+
+        for id_, entity_components, entity_groups in spawned:
+            entity = entities[id_] = entity_manager.createEntity()
+            for name, fields in entity_components:
+                entity_manager.addComponent(entity, self.__build(name, fields))
+            for group in entity_groups:
+                group_manager.add(entity, group)
+
+        for name, type_added, type_removed, type_changed in components:
+            for id_ in type_removed:
+                entity_manager.removeComponent(entities[id_], name)
+            for id_, fields in type_added:
+                entity_manager.addComponent(entities[id_], self.__build(name, fields))
+            for id_, fields in type_changed:
+                component = entity_manager.getComponent(entities[id_], name)
+                for field, value in fields.items():
+                    setattr(component, field, value)
+                entity_manager.markChanged(entities[id_], name)
+
+        for group, id_, is_added in groups:
+            if is_added:
+                group_manager.add(entities[id_], group)
+            elif entities[id_].id in group_manager.entitiesByGroup.get(group, ()):
+                group_manager.remove(entities[id_], group)
+        self.tick = tick
+
+    def __build(self, name, fields):
+        """Returns a new component of the class with the given name."""
+        component_class = ComponentMeta.types[ComponentMeta.typeIdOf(name)]
+        component = component_class.__new__(component_class)
+        for field, value in fields.items():
+            setattr(component, field, value)
+        return component
+
+
+##### WIRE FORMAT
+# Tagged values; integers are zigzag varints and lists of integers (entity
+# id's, mostly sorted) are delta encoded, so they usually take a byte or two
+# per entity.
+_NONE, _FALSE, _TRUE, _INT, _FLOAT, _STR, _BYTES, _LIST, _DICT, _INTS = range(10)
+_double = struct.Struct('<d')
+
+def encode(value):
+    """Returns the bytes encoding the given value."""
+    out = bytearray()
+    _encode(value, out)
+    return bytes(out)
+
+def decode(data):
+    """Returns the value encoded in the given bytes."""
+    value, position = _decode(memoryview(data), 0)
+    return value
+
+def _varint(number, out):
+    while number > 0x7f:
+        out.append((number & 0x7f) | 0x80)
+        number >>= 7
+    out.append(number)
+
+def _zigzag(number):
+    return number << 1 if number >= 0 else (-number << 1) - 1
+
+def _encode(value, out):
+    if value is None:
+        out.append(_NONE)
+    elif value is True:
+        out.append(_TRUE)
+    elif value is False:
+        out.append(_FALSE)
+    elif isinstance(value, int):
+        out.append(_INT)
+        _varint(_zigzag(value), out)
+    elif isinstance(value, float):
+        out.append(_FLOAT)
+        out += _double.pack(value)
+    elif isinstance(value, str):
+        encoded = value.encode('utf-8')
+        out.append(_STR)
+        _varint(len(encoded), out)
+        out += encoded
+    elif isinstance(value, (bytes, bytearray)):
+        out.append(_BYTES)
+        _varint(len(value), out)
+        out += value
+    elif isinstance(value, (list, tuple)):
+        if value and all(isinstance(item, int) and not isinstance(item, bool) for item in value):
+            out.append(_INTS)
+            _varint(len(value), out)
+            previous = 0
+            for item in value:
+                _varint(_zigzag(item - previous), out)
+                previous = item
+        else:
+            out.append(_LIST)
+            _varint(len(value), out)
+            for item in value:
+                _encode(item, out)
+    elif isinstance(value, dict):
+        out.append(_DICT)
+        _varint(len(value), out)
+        for key, item in value.items():
+            _encode(key, out)
+            _encode(item, out)
+    else:
+        raise TypeError('Error: can\'t replicate {0!r}'.format(value))
+
+def _readVarint(data, position):
+    number = shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        number |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return number, position
+        shift += 7
+
+def _unzigzag(number):
+    return number >> 1 if not number & 1 else -((number + 1) >> 1)
+
+def _decode(data, position):
+    tag = data[position]
+    position += 1
+    if tag == _NONE:
+        return None, position
+    if tag == _TRUE:
+        return True, position
+    if tag == _FALSE:
+        return False, position
+    if tag == _INT:
+        number, position = _readVarint(data, position)
+        return _unzigzag(number), position
+    if tag == _FLOAT:
+        return _double.unpack_from(data, position)[0], position + 8
+    if tag in (_STR, _BYTES):
+        length, position = _readVarint(data, position)
+        raw = bytes(data[position:position + length])
+        return (raw.decode('utf-8') if tag == _STR else raw), position + length
+    if tag == _INTS:
+        length, position = _readVarint(data, position)
+        items = []
+        previous = 0
+        for _ in range(length):
+            number, position = _readVarint(data, position)
+            previous += _unzigzag(number)
+            items.append(previous)
+        return items, position
+    if tag == _LIST:
+        length, position = _readVarint(data, position)
+        items = []
+        for _ in range(length):
+            item, position = _decode(data, position)
+            items.append(item)
+        return items, position
+    if tag == _DICT:
+        length, position = _readVarint(data, position)
+        items = {}
+        for _ in range(length):
+            key, position = _decode(data, position)
+            items[key], position = _decode(data, position)
+        return items, position
+    raise ValueError('Error: corrupted replication data (tag {0})'.format(tag))
@@ -0,0 +1,334 @@
+# encoding: UTF-8
+import abc
+import multiprocessing
+from multiprocessing import resource_tracker, shared_memory
+
+from larv.Engine import Engine
+from larv.ColumnStore import numpy
+
+class ShardSystem(metaclass = abc.ABCMeta):
+    """
+    Abstract base class of the systems run by a ShardedEngine inside its worker
+    processes. Every worker gets its own copy of the shard systems (so they
+    must be picklable) and calls update with the Shard it's responsible of:
+    a contiguous slice of the rows of the sharded components.
+
+    Example:
+        class MovementSystem(larv.ShardSystem):
+            def update(self, shard):
+                position = shard.get(PositionComponent)
+                velocity = shard.get(VelocityComponent)
+                for i in range(len(shard)):   # pure Python, but in parallel
+                    position.x[i] += velocity.x[i]
+    """
+    @abc.abstractmethod
+    def update(self, shard):
+        """
+        Called every tick with the shard of the worker.
+        Needs to be override.
+        @shard: larv.ShardedEngine.Shard instance.
+        """
+        raise NotImplementedError()
+
+
+class Shard:
+    """
+    Slice of the entity manager state seen by a worker process on a tick:
+    the rows [start, stop) of the sharded components, as numpy arrays living
+    in shared memory (writing them writes the entity manager columns).
+    Structural changes can't be done directly, they're queued with destroy
+    and spawn and merged by the ShardedEngine at the end of the tick.
+    """
+    def __init__(self, index, ids, columns_by_class):
+        """
+        Constructor.
+        @index: number of the shard.
+        @ids: array with the entity id of every row of the shard.
+        @columns_by_class: dict, key = component class, value = ShardColumns.
+        @self.commands: list of the queued structural changes.
+        """
+        self.index = index
+        self.ids = ids
+        self.__columns_by_class = columns_by_class
+        self.commands = []
+
+    def get(self, component_class):
+        """Returns the ShardColumns of the given sharded component class."""
+        return self.__columns_by_class[component_class]
+
+    def destroy(self, id_):
+        """Queues the removal of the entity with the given id."""
+        self.commands.append(('destroy', int(id_)))
+
+    def spawn(self, *components):
+        """Queues the creation of a new entity with the given components."""
+        self.commands.append(('spawn', components))
+
+    def __len__(self):
+        """Returns the number of rows of the shard."""
+        return len(self.ids)
+
+
+class ShardColumns:
+    """
+    Fields of one component type in a Shard, each one a numpy array:
+        position.x += 1
+        position.y[:] = 0
+    """
+    def __init__(self, arrays):
+        object.__setattr__(self, '_ShardColumns__arrays', arrays)
+
+    def __getattr__(self, name):
+        try:
+            return self.__arrays[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        if name not in self.__arrays:
+            raise AttributeError('\'{0}\' is not a column'.format(name))
+        self.__arrays[name][:] = value
+
+
+class ShardedEngine(Engine):
+    """
+    Engine that splits the simulation of some columnar components (see
+    larv.EntityManager.EntityManager.registerColumnarComponent) across worker
+    processes, so CPU bound pure Python systems can use several cores.
+
+    Every tick, the entities having all the sharded components are partitioned
+    in contiguous ranges, one per worker. Their columns are copied to shared
+    memory, every worker runs its ShardSystems over its own range in parallel,
+    the columns of the components the shard systems write are copied back and
+    the structural changes the workers queued are recorded (in shard order) in
+    the command buffer. Then the regular systems (added with addSystem) are
+    updated as usual and the command buffer is applied.
+
+    Usage:
+        engine = larv.ShardedEngine(entity_factory,
+                                    components = (PositionComponent, VelocityComponent),
+                                    shard_systems = [MovementSystem()],
+                                    shards = 8,
+                                    writes = (PositionComponent,))
+        ...
+        engine.update()
+        ...
+        engine.delete() # stops the workers and frees the shared memory
+
+    NOTE: shard systems, components and queued components are sent to other
+          processes, so they need to be picklable (defined at module level).
+    """
+    def __init__(self, entity_factory, components, shard_systems, shards,
+                 writes = None, workers = 0):
+        """
+        Constructor.
+        @entity_factory: larv.EntityFactory.EntityFactory instance.
+        @components: tuple of the columnar component classes being sharded.
+        @shard_systems: list of larv.ShardedEngine.ShardSystem instances, run
+                        in the given order by every worker.
+        @shards: number of worker processes.
+        @writes: tuple of the component classes the shard systems write, only
+                 those are copied back every tick (all of them if None).
+        @workers: see larv.Engine.Engine.
+        """
+        if numpy is None:
+            raise ImportError('numpy is needed for the sharded engine')
+        super().__init__(entity_factory, workers)
+        for system in shard_systems:
+            assert isinstance(system, ShardSystem)
+        self.components = tuple(components)
+        self.writes = self.components if writes is None else tuple(writes)
+        for component_class in self.components:
+            self.entity_manager.registerColumnarComponent(component_class)
+
+        self.__blocks = {}     # (component index, field) -> SharedMemory
+        self.__capacity = 0
+        self.__rows = None     # cached alignment, see __alignRows
+        self.__connections = []
+        self.__processes = []
+        # The workers need to share the resource tracker of this process, else
+        # each one would start its own and unlink the blocks when exiting.
+        resource_tracker.ensure_running()
+        for index in range(shards):
+            parent_connection, child_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(target = _shardWorker,
+                args = (index, child_connection, self.components, shard_systems),
+                daemon = True)
+            process.start()
+            self.__connections.append(parent_connection)
+            self.__processes.append(process)
+
+    def step(self, dt):
+        """Runs the shard systems in the workers, then every regular System."""
+        self.updateShards()
+        super().step(dt)
+
+    async def stepAsync(self, dt):
+        """Coroutine version of step."""
+        self.updateShards()
+        await super().stepAsync(dt)
+
+    def updateShards(self):
+        """Runs a tick of the shard systems in the worker processes."""
+        ids, rows = self.__alignRows()
+        count = len(ids)
+        self.__ensureCapacity(count)
+
+        # Gather the aligned rows of every sharded component in shared memory
+        self.__sharedArray('ids', None, numpy.int64)[:count] = ids
+        for index, component_class in enumerate(self.components):
+            store = self.entity_manager.getColumns(component_class)
+            for field, column in store.columns.items():
+                self.__sharedArray(index, field, column.dtype)[:count] = column[rows[index]]
+
+        # Every worker runs over its own contiguous range
+        layout = dict((key, (block.name, dtype))
+                      for key, (block, dtype) in self.__blocks.items())
+        shards = len(self.__connections)
+        for index, connection in enumerate(self.__connections):
+            start = count * index // shards
+            stop = count * (index + 1) // shards
+            connection.send(('tick', layout, start, stop))
+        results = list(connection.recv() for connection in self.__connections)
+
+        # Scatter the written components back to the entity manager
+        for index, component_class in enumerate(self.components):
+            if component_class not in self.writes:
+                continue
+            store = self.entity_manager.getColumns(component_class)
+            for field, column in store.columns.items():
+                column[rows[index]] = self.__sharedArray(index, field, column.dtype)[:count]
+
+        # Record the structural changes, in shard order, applied with the
+        # command buffer at the end of the tick
+        for status, value in results:
+            if status == 'error':
+                raise RuntimeError('Error in shard worker:\n' + value)
+            self.__applyCommands(value)
+
+    def __alignRows(self):
+        """
+        Returns (ids, rows): the id of every entity having all the sharded
+        components, in the order of the first component store, and for every
+        component the array of the rows of those entities in its store.
+        Cached until the id's of a store change.
+        """
+        stores = list(self.entity_manager.getColumns(component_class)
+                      for component_class in self.components)
+        if self.__rows is not None:
+            cached_ids, cached_store_ids, cached_rows = self.__rows
+            if all(numpy.array_equal(store.ids, store_ids)
+                   for store, store_ids in zip(stores, cached_store_ids)):
+                return cached_ids, cached_rows
+
+        ids = stores[0].ids
+        keep = numpy.ones(len(ids), bool)
+        positions = []
+        for store in stores[1:]:
+            order = numpy.argsort(store.ids, kind = 'stable')
+            sorted_ids = store.ids[order]
+            position = numpy.searchsorted(sorted_ids, ids)
+            position[position >= len(sorted_ids)] = 0
+            keep &= sorted_ids[position] == ids if len(sorted_ids) else False
+            positions.append(order[position] if len(sorted_ids) else position)
+        rows = [numpy.nonzero(keep)[0]] + list(position[keep] for position in positions)
+        ids = ids[keep].copy()
+        self.__rows = (ids, list(store.ids.copy() for store in stores), rows)
+        return ids, rows
+
+    def __ensureCapacity(self, count):
+        """(Re)creates the shared memory blocks if they can't hold count rows."""
+        if count <= self.__capacity and self.__blocks:
+            return None
+        capacity = max(64, self.__capacity)
+        while capacity < count:
+            capacity *= 2
+        self.__freeBlocks()
+        self.__capacity = capacity
+        self.__createBlock('ids', None, numpy.dtype(numpy.int64))
+        for index, component_class in enumerate(self.components):
+            for field, dtype in component_class.columns:
+                self.__createBlock(index, field, numpy.dtype(dtype))
+
+    def __createBlock(self, index, field, dtype):
+        size = max(1, self.__capacity * dtype.itemsize)
+        block = shared_memory.SharedMemory(create = True, size = size)
+        self.__blocks[(index, field)] = (block, dtype.str)
+
+    def __sharedArray(self, index, field, dtype):
+        block, dtype_str = self.__blocks[(index, field)]
+        return numpy.ndarray((self.__capacity,), dtype_str, buffer = block.buf)
+
+    def __freeBlocks(self):
+        for block, dtype in self.__blocks.values():
+            block.close()
+            block.unlink()
+        self.__blocks = {}
+
+    def __applyCommands(self, commands):
+        for command, value in commands:
+            if command == 'destroy':
+                entity = self.entity_manager.getHandle(value)
+                if entity is not None:
+                    self.commands.removeEntity(entity)
+            elif command == 'spawn':
+                self.commands.createEntity(*value)
+
+    def delete(self):
+        """Stops the workers, frees the shared memory and empties the Engine."""
+        for connection in self.__connections:
+            connection.send(('stop',))
+        for process in self.__processes:
+            process.join()
+        self.__connections = []
+        self.__processes = []
+        self.__freeBlocks()
+        super().delete()
+
+
+def _attachBlock(name):
+    """Attaches to an existing shared memory block without owning it."""
+    try:
+        return shared_memory.SharedMemory(name = name, track = False)
+    except TypeError: # Python < 3.13: the workers share the resource tracker
+        return shared_memory.SharedMemory(name = name) # of the engine process
+
+def _shardWorker(index, connection, components, shard_systems):
+    """Main loop of a worker process of a ShardedEngine."""
+    import traceback
+    blocks = {}
+    while True:
+        message = connection.recv()
+        if message[0] == 'stop':
+            break
+        layout, start, stop = message[1:]
+        try:
+            # Attach the blocks created (or recreated) since the last tick
+            names = set(name for name, dtype in layout.values())
+            for name in list(blocks):
+                if name not in names:
+                    blocks.pop(name).close()
+            arrays = {}
+            for key, (name, dtype) in layout.items():
+                if name not in blocks:
+                    blocks[name] = _attachBlock(name)
+                buffer = blocks[name].buf
+                capacity = len(buffer) // numpy.dtype(dtype).itemsize
+                arrays[key] = numpy.ndarray((capacity,), dtype, buffer = buffer)[start:stop]
+
+            columns_by_class = {}
+            for component_index, component_class in enumerate(components):
+                columns_by_class[component_class] = ShardColumns(dict(
+                    (field, arrays[(component_index, field)])
+                    for field, dtype in component_class.columns))
+            shard = Shard(index, arrays[('ids', None)], columns_by_class)
+            for system in shard_systems:
+                system.update(shard)
+            commands = shard.commands
+            # Drop the views of the blocks so they can be closed when recreated
+            del arrays, columns_by_class, shard
+            connection.send(('ok', commands))
+        except Exception:
+            connection.send(('error', traceback.format_exc()))
+    for block in blocks.values():
+        block.close()
@@ -0,0 +1,195 @@
+# encoding: UTF-8
+from array import array
+import importlib
+import json
+import mmap
+import pickle
+import struct
+import sys
+
+from larv.Component import ComponentMeta
+from larv.Entity import Entity
+from larv.ColumnStore import ColumnStore, numpy
+from larv.SparseSet import SparseSet
+
+MAGIC = b'LARVSNAP'
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+
+class Snapshot:
+    """
+    Saves and loads the whole state of an Engine (entities, components and
+    groups) to and from a compact binary file:
+        engine.saveSnapshot('level1.snap')
+        ...
+        engine.loadSnapshot('level1.snap')  # replaces the current state
+
+    File layout:
+        - 8 bytes: b'LARVSNAP'
+        - 4 bytes: format version, 8 bytes: length of the header (little endian)
+        - header: JSON describing every block (offset from the first block,
+          size and format: 'q' for int64, a numpy dtype string or 'pickle')
+        - blocks, each one aligned to 64 bytes:
+            - entity id's, generations and free indices (int64 arrays).
+            - for every component type, the entity id's having it and:
+                - columnar types (see registerColumnarComponent): one raw
+                  block per field, the bytes of its numpy column.
+                - other types: a single pickle of the list of components.
+            - for every group, the id's of its entities.
+    Loading memory maps the file: the raw blocks are copied straight into the
+    entity manager arrays, so the cost grows with the size of the data and
+    not with per entity Python calls (except for the pickled components).
+
+    Component classes are found by module and name, so they must be
+    importable by the program loading the snapshot. Systems, the entity
+    factory and the engine settings are not part of the snapshot.
+    """
+    @staticmethod
+    def save(engine, path):
+        """
+        Writes the state of the given engine in the given file.
+        @engine: larv.Engine.Engine instance.
+        @path: path of the file, overwritten if it exists.
+        """
+        entity_manager = engine.entity_manager
+        state = entity_manager.exportState()
+        blocks = []
+        size = [0]
+        def addBlock(data, format_):
+            # Offsets are relative to the (aligned) start of the blocks
+            offset = size[0]
+            blocks.append((offset, data))
+            size[0] = Snapshot.__align(offset + len(data))
+            return [offset, len(data), format_]
+        def addInts(values):
+            return addBlock(array('q', values).tobytes(), 'q')
+
+        header = {'version': FORMAT_VERSION,
+                  'byteorder': sys.byteorder,
+                  'entity_manager': {'lowest_assigned_id': state['lowest_assigned_id'],
+                                     'ids': addInts(state['ids']),
+                                     'generations': addInts(state['generations']),
+                                     'free_indices': addInts(state['free_indices'])},
+                  'components': [],
+                  'groups': {}}
+        for type_id, store in sorted(entity_manager.components_by_class.items()):
+            component_class = ComponentMeta.types[type_id]
+            entry = {'class': [component_class.__module__, component_class.__qualname__]}
+            if isinstance(store, ColumnStore):
+                entry['storage'] = 'columns'
+                entry['ids'] = addBlock(store.ids.tobytes(), 'q')
+                entry['columns'] = dict((name, addBlock(column.tobytes(), column.dtype.str))
+                                        for name, column in store.columns.items())
+            else:
+                entry['storage'] = 'pickle'
+                entry['ids'] = addInts(store.keys())
+                entry['data'] = addBlock(pickle.dumps(store.values(),
+                                         pickle.HIGHEST_PROTOCOL), 'pickle')
+            header['components'].append(entry)
+        for group, ids in engine.group_manager.exportState().items():
+            header['groups'][group] = addInts(ids)
+
+        encoded = json.dumps(header, separators = (',', ':')).encode('utf-8')
+        start = Snapshot.__align(20 + len(encoded))
+        with open(path, 'wb') as snapshot_file:
+            snapshot_file.write(MAGIC)
+            snapshot_file.write(struct.pack('<IQ', FORMAT_VERSION, len(encoded)))
+            snapshot_file.write(encoded)
+            for offset, data in blocks:
+                snapshot_file.write(b'\0' * (start + offset - snapshot_file.tell()))
+                snapshot_file.write(data)
+
+    @staticmethod
+    def load(engine, path):
+        """
+        Replaces the state of the given engine (entities, components and
+        groups) with the one saved in the given file.
+        Registered query views are rebuilt, pending commands are dropped and
+        the swap is recorded as changes of the tracked component types (the
+        old components removed, the loaded ones added) and in the group
+        journal, so the consumers of those changes catch up.
+        @engine: larv.Engine.Engine instance.
+        @path: path of a file written by Snapshot.save.
+        """
+        with open(path, 'rb') as snapshot_file:
+            if snapshot_file.read(8) != MAGIC:
+                raise ValueError('Error: \'{0}\' is not a larv snapshot'.format(path))
+            version, header_length = struct.unpack('<IQ', snapshot_file.read(12))
+            if version != FORMAT_VERSION:
+                raise ValueError('Error: unsupported snapshot version {0}'.format(version))
+            header = json.loads(snapshot_file.read(header_length).decode('utf-8'))
+            mapped = mmap.mmap(snapshot_file.fileno(), 0, access = mmap.ACCESS_READ)
+        try:
+            Snapshot.__restore(engine, header, mapped, Snapshot.__align(20 + header_length))
+        finally:
+            mapped.close()
+
+    @staticmethod
+    def __restore(engine, header, mapped, start):
+        """
+        Rebuilds the engine state from the header and the mapped file.
+        @start: position of the first block in the file.
+        """
+        swap = header['byteorder'] != sys.byteorder
+        def readInts(block):
+            offset, length, format_ = block
+            offset += start
+            values = array('q')
+            values.frombytes(mapped[offset:offset + length])
+            if swap:
+                values.byteswap()
+            return values
+
+        entity_manager_header = header['entity_manager']
+        components_by_class = {}
+        for entry in header['components']:
+            component_class = Snapshot.__findClass(*entry['class'])
+            type_id = component_class.component_type_id
+            ids = readInts(entry['ids']).tolist()
+            if entry['storage'] == 'columns':
+                store = ColumnStore(component_class, max(1, len(ids)))
+                columns = {}
+                for name, (offset, length, dtype) in entry['columns'].items():
+                    # Views of the mapped file, copied into the store by extend
+                    columns[name] = numpy.frombuffer(mapped, dtype,
+                        length // numpy.dtype(dtype).itemsize, start + offset)
+                if ids:
+                    store.extend(ids, columns)
+                del columns
+            else:
+                offset, length, format_ = entry['data']
+                store = SparseSet()
+                store.extend(ids, pickle.loads(mapped[start + offset:start + offset + length]))
+            components_by_class[type_id] = store
+
+        entity_manager = engine.entity_manager
+        entity_manager.importState(readInts(entity_manager_header['ids']).tolist(),
+                                   readInts(entity_manager_header['generations']).tolist(),
+                                   readInts(entity_manager_header['free_indices']).tolist(),
+                                   entity_manager_header['lowest_assigned_id'],
+                                   components_by_class)
+        entities_by_group = {}
+        for group, block in header['groups'].items():
+            entities_by_group[group] = set(entity_manager.getHandle(id_) or Entity(id_)
+                                           for id_ in readInts(block).tolist())
+        engine.group_manager.importState(entities_by_group)
+        engine.commands.clear()
+
+    @staticmethod
+    def __findClass(module_name, qualname):
+        """Returns the component class saved with the given module and name."""
+        try:
+            found = importlib.import_module(module_name)
+            for name in qualname.split('.'):
+                found = getattr(found, name)
+            return found
+        except (ImportError, AttributeError):
+            # The module may have been imported under another name (scripts)
+            type_id = ComponentMeta.typeIdOf(qualname.rsplit('.', 1)[-1])
+            if type_id is None:
+                raise KeyError('Error: component class \'{0}.{1}\' not found'.format(module_name, qualname))
+            return ComponentMeta.types[type_id]
+
+    @staticmethod
+    def __align(position):
+        return (position + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
@@ -0,0 +1,126 @@
+# -*- coding: UTF-8 -*-
+import sys
+
+from larv.Entity import INDEX_MASK
+from larv.MemoryReport import MemoryReport
+
+class SparseSet:
+    """
+    Storage of the components of one type, used as the 2nd dictionary of
+    larv.EntityManager.EntityManager.components_by_class.
+
+    Components are kept packed in a dense list (and their entity id's in a
+    parallel dense list), so iterating a component type walks a contiguous
+    array, while the sparse list maps the index part of an entity id to its
+    position in the dense lists. Removing moves the last component into the
+    hole, so the dense lists never fragment.
+
+    It behaves like the dictionary {entity id: component} it replaces.
+    """
+    def __init__(self):
+        """
+        Constructor.
+        @self.ids: dense list with the entity id of every component.
+        @self.components: dense list with the components.
+        @self.__sparse: list, index = entity index, value = dense position.
+                        Entries aren't cleared on removal, a position is only
+                        valid if self.ids holds the same id at that position.
+        """
+        self.ids = []
+        self.components = []
+        self.__sparse = []
+
+    def position(self, id_):
+        """Returns the dense position of the given entity id, -1 if not found."""
+        index = id_ & INDEX_MASK
+        if index < len(self.__sparse):
+            position = self.__sparse[index]
+            if position < len(self.ids) and self.ids[position] == id_:
+                return position
+        return -1
+
+    def extend(self, ids, components):
+        """
+        Bulk version of __setitem__.
+        @ids: list of entity id's.
+        @components: list of components, one per id.
+        """
+        assert len(ids) == len(components)
+        for id_, component in zip(ids, components):
+            self[id_] = component
+
+    def memoryUsage(self, sample = 256):
+        """
+        Returns the estimated (overhead, payload) bytes of the store: the dense
+        and sparse lists, and the components (see larv.MemoryReport.MemoryReport).
+        @sample: most components measured, None to measure every one.
+        """
+        overhead = (sys.getsizeof(self.ids) + sys.getsizeof(self.components) +
+                    sys.getsizeof(self.__sparse))
+        return overhead, MemoryReport.sampledBytes(self.components, sample)
+
+    ##### DICTIONARY INTERFACE (used by larv.EntityManager.EntityManager)
+    def __setitem__(self, id_, component):
+        position = self.position(id_)
+        if position >= 0:
+            self.components[position] = component
+            return None
+        index = id_ & INDEX_MASK
+        sparse = self.__sparse
+        if index >= len(sparse):
+            sparse.extend([0] * (index + 1 - len(sparse)))
+        sparse[index] = len(self.ids)
+        self.ids.append(id_)
+        self.components.append(component)
+
+    def __getitem__(self, id_):
+        position = self.position(id_)
+        if position < 0:
+            raise KeyError(id_)
+        return self.components[position]
+
+    def get(self, id_, default = None):
+        position = self.position(id_)
+        if position < 0:
+            return default
+        return self.components[position]
+
+    def pop(self, id_):
+        """Removes the component of the given entity id and returns it."""
+        position = self.position(id_)
+        if position < 0:
+            raise KeyError(id_)
+        component = self.components[position]
+        last_id = self.ids.pop()
+        last_component = self.components.pop()
+        if position < len(self.ids):
+            self.ids[position] = last_id
+            self.components[position] = last_component
+            self.__sparse[last_id & INDEX_MASK] = position
+        return component
+
+    def __delitem__(self, id_):
+        """Removes the component of the given entity id."""
+        self.pop(id_)
+
+    def __contains__(self, id_):
+        return self.position(id_) >= 0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def keys(self):
+        return list(self.ids)
+
+    def values(self):
+        return list(self.components)
+
+    def items(self):
+        return list(zip(self.ids, self.components))
+
+    def __str__(self):
+        """Returns a string representation."""
+        return 'SparseSet: {0}'.format(dict(self.items()))
@@ -0,0 +1,255 @@
+# encoding: UTF-8
+import heapq
+import math
+
+from larv.ChangeTracker import ChangeTracker
+
+class SpatialIndex:
+    """
+    Uniform grid over the positions of the entities having a position
+    component, for neighborhood queries ("entities near (x, y)") that don't
+    scan every entity:
+        index = larv.SpatialIndex(entity_manager, PositionComponent, cell_size = 64)
+        for entity in index.queryRadius(x, y, 100):
+            ...
+        for first, second in index.pairs(16):   # collision broad phase
+            ...
+
+    The index follows the position components by itself: it enables change
+    tracking of the component type (see
+    larv.EntityManager.EntityManager.trackChanges) and, before answering a
+    query, applies the components added, changed and removed since the
+    previous one, so keeping it up to date costs O(changes).
+    Position changes the entity manager can't see (in place changes of
+    regular components, vectorized writes to columns) have to be reported
+    with markChanged / markChangedIds, or followed by a rebuild().
+
+    The cell size should be around the usual query radius: too small and
+    queries visit many cells, too big and cells hold many entities.
+    """
+    def __init__(self, entity_manager, component, cell_size, x = 'x', y = 'y'):
+        """
+        Constructor.
+        @entity_manager: larv.EntityManager.EntityManager instance.
+        @component: position component class.
+        @cell_size: side of the grid cells, in world units.
+        @x, @y: names of the coordinate fields of the component.
+        @self.__cells: dict, key = (column, row) of the cell, value = set of
+                       the entity id's in that cell.
+        @self.__positions: dict, key = entity id, value = (x, y, cell).
+        """
+        assert cell_size > 0
+        self.entity_manager = entity_manager
+        self.component = component
+        self.cell_size = float(cell_size)
+        self.x_field = x
+        self.y_field = y
+        self.__type_id = entity_manager.getComponentType(component)
+        self.__tracker = entity_manager.trackChanges(component)
+        self.__cursor = 0
+        self.__cells = {}
+        self.__positions = {}
+        self.rebuild()
+
+    def rebuild(self):
+        """Indexes again every entity having the position component."""
+        self.__cells = {}
+        self.__positions = {}
+        self.__cursor = self.__tracker.version
+        self.__tracker.setCursor(self, self.__cursor)
+        store = self.entity_manager.components_by_class.get(self.__type_id, None)
+        if store is not None:
+            for id_, component in store.items():
+                self.__move(id_, component)
+
+    def sync(self):
+        """
+        Applies the position changes made since the previous sync (done
+        automatically by every query).
+        """
+        tracker = self.__tracker
+        if tracker.version == self.__cursor:
+            return None
+        cursor = self.__cursor
+        self.__cursor = tracker.version
+        tracker.setCursor(self, self.__cursor)
+        type_id = self.__type_id
+        for id_ in tracker.since(ChangeTracker.REMOVED, type_id, cursor):
+            self.__remove(id_)
+        store = self.entity_manager.components_by_class.get(type_id, {})
+        for id_ in tracker.since(ChangeTracker.CHANGED, type_id, cursor):
+            self.__move(id_, store[id_])
+
+    def queryRadius(self, x, y, radius):
+        """
+        Returns a list with the entities whose position is at a distance of
+        (x, y) lower or equal than radius.
+        """
+        self.sync()
+        radius_squared = radius * radius
+        positions = self.__positions
+        found = []
+        for id_ in self.__idsInRect(x - radius, y - radius, x + radius, y + radius):
+            other_x, other_y, cell = positions[id_]
+            if (other_x - x) ** 2 + (other_y - y) ** 2 <= radius_squared:
+                found.append(id_)
+        return self.__handles(found)
+
+    def queryRect(self, min_x, min_y, max_x, max_y):
+        """Returns a list with the entities inside the given axis aligned box."""
+        self.sync()
+        positions = self.__positions
+        found = []
+        for id_ in self.__idsInRect(min_x, min_y, max_x, max_y):
+            other_x, other_y, cell = positions[id_]
+            if min_x <= other_x <= max_x and min_y <= other_y <= max_y:
+                found.append(id_)
+        return self.__handles(found)
+
+    def nearest(self, x, y, k = 1, max_radius = None):
+        """
+        Returns a list with the k entities closest to (x, y), closest first.
+        @k: number of entities wanted (less are returned if there aren't enough).
+        @max_radius: if given, entities farther than it are ignored.
+        """
+        self.sync()
+        positions = self.__positions
+        limit = math.inf if max_radius is None else max_radius * max_radius
+        column, row = self.__cellOf(x, y)
+        best = [] # heap of (-distance squared, id), the k best found
+        seen = 0
+        ring = 0
+        while seen < len(positions):
+            # Far away entities: scanning rings of empty cells would cost more
+            if (2 * ring + 1) ** 2 > 4 * len(positions) + 16:
+                distances = (((other_x - x) ** 2 + (other_y - y) ** 2, id_)
+                             for id_, (other_x, other_y, cell) in positions.items())
+                best = list((-distance, id_) for distance, id_ in heapq.nsmallest(k, distances))
+                break
+            for cell in self.__ring(column, row, ring):
+                for id_ in self.__cells.get(cell, ()):
+                    seen += 1
+                    other_x, other_y, other_cell = positions[id_]
+                    distance = (other_x - x) ** 2 + (other_y - y) ** 2
+                    if distance > limit:
+                        continue
+                    if len(best) < k:
+                        heapq.heappush(best, (-distance, id_))
+                    elif distance < -best[0][0]:
+                        heapq.heapreplace(best, (-distance, id_))
+            # Cells beyond this ring are at least ring * cell_size away
+            reach = (ring * self.cell_size) ** 2
+            if (len(best) == k and -best[0][0] <= reach) or reach > limit:
+                break
+            ring += 1
+        best = sorted((-distance, id_) for distance, id_ in best if -distance <= limit)
+        return self.__handles(list(id_ for distance, id_ in best))
+
+    def pairs(self, radius):
+        """
+        Returns a list of (entity, entity) tuples with every pair of entities
+        closer than radius (each pair once), visiting only neighbor cells.
+        """
+        self.sync()
+        radius_squared = radius * radius
+        positions = self.__positions
+        cells = self.__cells
+        reach = max(1, int(math.ceil(radius / self.cell_size)))
+        # Half of the neighborhood, so every pair of cells is visited once
+        offsets = list((dx, dy) for dx in range(-reach, reach + 1)
+                       for dy in range(-reach, reach + 1) if (dx, dy) > (0, 0))
+        found = []
+        for (column, row), ids in cells.items():
+            ids = list(ids)
+            for i, id_ in enumerate(ids):
+                x, y, cell = positions[id_]
+                for other in ids[i + 1:]:
+                    other_x, other_y, other_cell = positions[other]
+                    if (other_x - x) ** 2 + (other_y - y) ** 2 <= radius_squared:
+                        found.append((id_, other))
+            for dx, dy in offsets:
+                neighbors = cells.get((column + dx, row + dy), None)
+                if not neighbors:
+                    continue
+                for id_ in ids:
+                    x, y, cell = positions[id_]
+                    for other in neighbors:
+                        other_x, other_y, other_cell = positions[other]
+                        if (other_x - x) ** 2 + (other_y - y) ** 2 <= radius_squared:
+                            found.append((id_, other))
+        handles = self.entity_manager.getHandle
+        return list((handles(first), handles(second)) for first, second in found)
+
+    def __move(self, id_, component):
+        """(Re)indexes the given entity id at the position of the given component."""
+        x = getattr(component, self.x_field)
+        y = getattr(component, self.y_field)
+        cell = self.__cellOf(x, y)
+        old = self.__positions.get(id_, None)
+        if old is not None and old[2] != cell:
+            self.__discard(id_, old[2])
+        if old is None or old[2] != cell:
+            self.__cells.setdefault(cell, set()).add(id_)
+        self.__positions[id_] = (x, y, cell)
+
+    def __remove(self, id_):
+        """Removes the given entity id from the index."""
+        old = self.__positions.pop(id_, None)
+        if old is not None:
+            self.__discard(id_, old[2])
+
+    def __discard(self, id_, cell):
+        ids = self.__cells[cell]
+        ids.discard(id_)
+        if not ids:
+            del self.__cells[cell]
+
+    def __cellOf(self, x, y):
+        return (int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size)))
+
+    def __idsInRect(self, min_x, min_y, max_x, max_y):
+        """Yields the id's in the cells overlapping the given box."""
+        min_column, min_row = self.__cellOf(min_x, min_y)
+        max_column, max_row = self.__cellOf(max_x, max_y)
+        cells = self.__cells
+        if (max_column - min_column + 1) * (max_row - min_row + 1) > len(cells):
+            # Box bigger than the occupied area: walk the occupied cells instead
+            for (column, row), ids in cells.items():
+                if min_column <= column <= max_column and min_row <= row <= max_row:
+                    yield from ids
+            return None
+        for column in range(min_column, max_column + 1):
+            for row in range(min_row, max_row + 1):
+                yield from cells.get((column, row), ())
+
+    def __ring(self, column, row, ring):
+        """Yields the cells at the given (Chebyshev) distance of the given cell."""
+        if ring == 0:
+            yield (column, row)
+            return None
+        for dx in range(-ring, ring + 1):
+            yield (column + dx, row - ring)
+            yield (column + dx, row + ring)
+        for dy in range(-ring + 1, ring):
+            yield (column - ring, row + dy)
+            yield (column + ring, row + dy)
+
+    def __handles(self, ids):
+        handles = self.entity_manager.getHandle
+        return list(handles(id_) for id_ in ids)
+
+    ##### PYTHONIC METHODS FOR EASIER PROGRAMMING
+    def __len__(self):
+        """Returns the number of indexed entities."""
+        self.sync()
+        return len(self.__positions)
+
+    def __contains__(self, entity):
+        """Defines the usage of: entity in index."""
+        self.sync()
+        return entity.id in self.__positions
+
+    def __str__(self):
+        """Returns a string representation."""
+        return 'SpatialIndex({0}): {1} entities in {2} cells'.format(
+            self.component.__name__, len(self.__positions), len(self.__cells))
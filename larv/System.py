@@ -2,6 +2,7 @@
 from larv.EntityManager import EntityManager
 from larv.GroupManager import GroupManager
 from larv.EntityFactory import EntityFactory
+from larv.CommandBuffer import CommandBuffer
 import abc
 
 class System(metaclass = abc.ABCMeta):
@@ -13,9 +14,41 @@ class System(metaclass = abc.ABCMeta):
     Update method will be called every game loop and must implement the logic 
     of the system (aka, where the magic happens).
 
-    When wanting to get components from entity manager, remember to call for those
-    using component_class.__name__, else they will not be recognized.
+    When wanting to get components from entity manager, call for those using
+    the component class itself (component_class.__name__ works too, as long as
+    no other component class has the same name).
+
+    Systems can declare which component classes they read and which they write
+    (as class attributes), letting an Engine with workers run systems that
+    don't conflict at the same time:
+        class MovementSystem(larv.System):
+            reads = (VelocityComponent,)
+            writes = (PositionComponent,)
+    A system declaring them must only touch those components and must not
+    create or remove entities nor add or remove components in its update
+    (other than through self.commands: systems running at the same time
+    record their commands apart and they are applied in priority order).
+    Systems that don't declare them (the default) always run alone.
+
+    Entities and components shouldn't be created or removed while iterating
+    over the entity manager: record those changes in self.commands instead
+    (see larv.CommandBuffer.CommandBuffer), the engine applies them at the end
+    of the tick.
+
+    Systems can work incrementally on component types whose changes are
+    tracked (see larv.EntityManager.EntityManager.trackChanges): changed,
+    added and removed return the entities changed since the previous call
+    made by the same system (every entity on the first call):
+        def update(self):
+            for entity in self.changed(PositionComponent):
+                self.spatial_index.move(entity)
     """
+    reads = None
+    writes = None
+    # Seconds of game time since the previous update of this system, set by
+    # the engine before every update.
+    delta_time = 0.0
+
     def __init__(self):
         """
         Systems may not have to implement a __init__ because they may not need
@@ -38,6 +71,11 @@ class System(metaclass = abc.ABCMeta):
         """Returns the entity factory assigned to the system."""
         return self.__entity_factory
 
+    @property
+    def commands(self):
+        """Returns the command buffer of the engine the system was added to."""
+        return self.__commands
+
     def bindToEntityManager(self, entity_manager):
         """
         Method used by the engine when the system is added to it.
@@ -65,12 +103,66 @@ class System(metaclass = abc.ABCMeta):
         assert isinstance(entity_factory, EntityFactory)
         self.__entity_factory = entity_factory
 
+    def bindToCommandBuffer(self, commands):
+        """
+        Method used by the engine when the system is added to it.
+        Can't be override.
+        @commands: instance of larv.CommandBuffer.CommandBuffer
+        """
+        assert isinstance(commands, CommandBuffer)
+        self.__commands = commands
+
+    def added(self, component):
+        """
+        Returns the entities that got the given tracked component since the
+        previous call of this method (with that component) by this system.
+        @component: class, class name or instance of the component.
+        """
+        return self.__changesSince('added', component)
+
+    def changed(self, component):
+        """
+        Returns the entities whose given tracked component was added or changed
+        since the previous call of this method (with that component).
+        @component: class, class name or instance of the component.
+        """
+        return self.__changesSince('changed', component)
+
+    def removed(self, component):
+        """
+        Returns the entities that lost the given tracked component since the
+        previous call of this method (with that component).
+        @component: class, class name or instance of the component.
+        """
+        return self.__changesSince('removed', component)
+
+    def __changesSince(self, kind, component):
+        """Returns the changes of the given kind after the cursor of the system."""
+        # Systems don't have to call System.__init__, so create the cursors lazily
+        cursors = self.__dict__.setdefault('_System__cursors', {})
+        entity_manager = self.entity_manager
+        key = (kind, entity_manager.getComponentType(component))
+        since = cursors.get(key, 0)
+        cursors[key] = entity_manager.change_version
+        if entity_manager.change_tracker is not None:
+            # Lets the tracker drop the removals every consumer has read
+            entity_manager.change_tracker.setCursor(self, cursors[key], key)
+        if kind == 'added':
+            return entity_manager.getAdded(component, since)
+        if kind == 'changed':
+            return entity_manager.getChanged(component, since)
+        return entity_manager.getRemoved(component, since)
+
     @abc.abstractmethod
     def update(self):
         """
         This abstract method will be called every tick of the game loop and
         will iterate over every component the system is intended to work with,
         implementing game logic.
+        It may return the number of entities processed, which the engine
+        statistics count (see larv.Engine.Engine.enableStats).
+        It can be a coroutine (async def update(self)) for systems waiting on
+        I/O, then the engine has to be updated with updateAsync.
         Needs to be override.
         """
         raise NotImplementedError()
\ No newline at end of file
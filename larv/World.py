@@ -1,5 +1,10 @@
 import larv
-
+import asyncio
+import inspect
+import os
+import tempfile
+import time
+import weakref
 
 
 """
@@ -15,48 +20,298 @@ class World:
 
     It's not a bad idea to define a global World instance on your games, as
     using many different worlds will rarely be needed.
+
+    What happens to an engine while other engines are on top of it depends on
+    its policy (given to push or setPolicy):
+        - World.SUSPENDED (default): it isn't updated.
+        - World.BACKGROUND: it's updated every N world updates (with the time
+          elapsed since its previous update), for example a paused level
+          whose music or network keep going.
+        - World.PAGED: it isn't updated and its entities, components and
+          groups are saved to a snapshot file (see larv.Snapshot.Snapshot)
+          and dropped from memory, being loaded back when it's on top again.
+          Keeps memory bounded when many engines are stacked. Loading it back
+          is recorded as changes of its tracked components and groups, so
+          spatial indexes, systems reading changes and replication servers
+          of the engine catch up. The snapshot files left (engines still
+          paged out) are deleted by close, or when the world is garbage
+          collected or the program ends.
     """
+    SUSPENDED = 'suspended'
+    BACKGROUND = 'background'
+    PAGED = 'paged'
+
     def __init__(self):
+        """
+        Constructor.
+        @self.ticks: number of world updates done.
+        @self.__policies: dict, key = engine, value = [policy, every, seconds
+                          elapsed since its last update] (suspended if missing).
+        @self.__paged: dict, key = paged out engine, value = snapshot path.
+        @self.__paths: set of the snapshot paths not deleted yet, deleted by
+                       self.__finalizer if the world goes away first.
+        """
         self.engine_stack = []
         self.postupdate_functions = []
+        self.stats = None
+        self.ticks = 0
+        self.__policies = {}
+        self.__paged = {}
+        self.__paths = set()
+        self.__finalizer = weakref.finalize(self, World.__removeFiles, self.__paths)
 
-    def push(self, engine):
+    def enableStats(self, window = 600, reporter = None, report_every = 60):
+        """
+        Starts measuring the wall time of every world update, of the update of
+        the engine on top of the stack and of the postupdate functions, in
+        self.stats (a larv.EngineStats.EngineStats), which is returned.
+        To measure the systems of an engine, use larv.Engine.Engine.enableStats.
+        @window, @reporter, @report_every: see larv.EngineStats.EngineStats.
+        """
+        self.stats = larv.EngineStats(window, reporter, report_every)
+        return self.stats
+
+    def disableStats(self):
+        """Stops measuring, returns the stats gathered until now."""
+        stats = self.stats
+        self.stats = None
+        return stats
+
+    def push(self, engine, policy = None, every = 10):
         """
         Adds the given engine to the engine stack, giving it instant priority.
+        The engine that was on top gets covered (its policy is applied).
         @engine: larv.Engine instance.
+        @policy, @every: policy of the engine once covered, see setPolicy
+                         (None keeps the one it had, suspended by default).
         """
         assert isinstance(engine, larv.Engine)
+        if policy is not None:
+            self.setPolicy(engine, policy, every)
+        if self.engine_stack:
+            self.__cover(self.engine_stack[-1])
         self.engine_stack.append(engine)
 
     def pop(self):
         """
         Removes the current engine from the stack and returns it.
+        The engine below it (if paged out) is loaded back.
         Raises EndProgramException if the stack is empty.
         """
         if len(self.engine_stack) == 0:
             raise larv.EndProgramException()
-        return self.engine_stack.pop()
+        popped = self.engine_stack.pop()
+        self.__policies.pop(popped, None)
+        if self.engine_stack:
+            self.__pageIn(self.engine_stack[-1])
+        return popped
 
     def change(self, engine):
         """
         Exchanges the actual engine for the given engine.
         The exchanged engine is removed from the stack and returned.
         """
-        popped = self.pop()
-        self.push(engine)
+        if len(self.engine_stack) == 0:
+            raise larv.EndProgramException()
+        assert isinstance(engine, larv.Engine)
+        popped = self.engine_stack.pop()
+        self.__policies.pop(popped, None)
+        self.engine_stack.append(engine)
+        self.__pageIn(engine)
         return popped
 
-    def update(self):
+    def setPolicy(self, engine, policy, every = 10):
+        """
+        Sets what happens to the given engine while it's covered by others.
+        @engine: larv.Engine instance.
+        @policy: World.SUSPENDED, World.BACKGROUND or World.PAGED.
+        @every: for World.BACKGROUND, number of world updates between updates
+                of the engine.
+        """
+        assert policy in (self.SUSPENDED, self.BACKGROUND, self.PAGED)
+        assert every >= 1
+        self.__policies[engine] = [policy, every, 0.0]
+        if engine in self.engine_stack and engine is not self.engine_stack[-1]:
+            if policy == self.PAGED:
+                self.__cover(engine)
+            else:
+                self.__pageIn(engine)
+
+    def getPolicy(self, engine):
+        """Returns the policy of the given engine."""
+        return self.__policies.get(engine, [self.SUSPENDED])[0]
+
+    def isPagedOut(self, engine):
+        """Returns True if the state of the given engine is saved out of memory."""
+        return engine in self.__paged
+
+    def __cover(self, engine):
+        """Applies the policy of the given engine, which stops being on top."""
+        policy = self.__policies.get(engine, None)
+        if policy is None:
+            return None
+        policy[2] = 0.0
+        if policy[0] == self.PAGED and engine not in self.__paged:
+            handle, path = tempfile.mkstemp(prefix = 'larv-', suffix = '.snap')
+            os.close(handle)
+            engine.saveSnapshot(path)
+            engine.entity_manager.importState([], [0], [], 1, {})
+            engine.group_manager.importState({})
+            engine.commands.clear()
+            self.__paged[engine] = path
+            self.__paths.add(path)
+
+    def __pageIn(self, engine):
+        """Loads back the state of the given engine if it was paged out."""
+        path = self.__paged.pop(engine, None)
+        if path is not None:
+            engine.loadSnapshot(path)
+            os.remove(path)
+            self.__paths.discard(path)
+
+    def close(self):
         """
-        Activates (updates) the engine on top of the stack.
+        Deletes the snapshot files of the engines still paged out, which stay
+        empty (their state is lost). Pop them first to keep it.
+        """
+        self.__paged.clear()
+        World.__removeFiles(self.__paths)
+
+    @staticmethod
+    def __removeFiles(paths):
+        """Deletes the given snapshot files (set of paths) and empties the set."""
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        paths.clear()
+
+    def update(self, dt = None):
+        """
+        Activates (updates) the engine on top of the stack, and the background
+        engines whose turn it is.
+        @dt: seconds elapsed since the previous call, given to the engines
+             (see larv.Engine.Engine.update), None if unknown.
+        """
+        if len(self.engine_stack) == 0:
+            raise larv.EndProgramException()
+
+        self.ticks += 1
+        engine = self.engine_stack[-1]
+        stats = self.stats
+        if stats is None:
+            engine.update(dt)
+            if self.__policies:
+                self.__updateBackground(dt)
+            self.__callPostUpdateFunctions()
+            return None
+
+        start = time.perf_counter()
+        engine.update(dt)
+        engine_end = time.perf_counter()
+        if self.__policies:
+            self.__updateBackground(dt)
+        background_end = time.perf_counter()
+        self.__callPostUpdateFunctions()
+        end = time.perf_counter()
+        stats.get(engine).record(engine_end - start)
+        stats.get('background').record(background_end - engine_end)
+        stats.get('postupdate').record(end - background_end)
+        stats.endTick(end - start)
+
+    async def updateAsync(self, dt = None):
+        """
+        Coroutine version of update, for engines having coroutine systems
+        (see larv.Engine.Engine.updateAsync). Postupdate functions returning
+        an awaitable are awaited.
+        @dt: seconds elapsed since the previous call, None if unknown.
         """
         if len(self.engine_stack) == 0:
             raise larv.EndProgramException()
 
+        self.ticks += 1
         engine = self.engine_stack[-1]
-        engine.update()
+        stats = self.stats
+        start = time.perf_counter()
+        await engine.updateAsync(dt)
+        engine_end = time.perf_counter()
+        for background in self.__backgroundDue(dt):
+            await background.updateAsync(self.__policies[background][2] if dt is not None else None)
+            self.__policies[background][2] = 0.0
+        background_end = time.perf_counter()
+        for dic in self.postupdate_functions:
+            result = dic['function'](*dic['args'])
+            if inspect.isawaitable(result):
+                await result
+        self.postupdate_functions = []
+        if stats is not None:
+            end = time.perf_counter()
+            stats.get(engine).record(engine_end - start)
+            stats.get('background').record(background_end - engine_end)
+            stats.get('postupdate').record(end - background_end)
+            stats.endTick(end - start)
+
+    async def runAsync(self, fps = 60, before_update = None, after_update = None):
+        """
+        Async game loop: updates the world (with updateAsync) fps times per
+        second, giving every update the real time elapsed since the previous
+        one, until the engine stack is empty. While waiting for the next frame
+        (and while systems await), the event loop runs other tasks.
+        @fps: updates per second.
+        @before_update, @after_update: functions called every frame before and
+                                       after the update (input handling,
+                                       drawing...), awaited if they return
+                                       an awaitable.
+        """
+        loop = asyncio.get_running_loop()
+        frame = 1.0 / fps
+        dt = 0.0
+        previous = loop.time()
+        while True:
+            start = loop.time()
+            try:
+                await self.__callHook(before_update)
+                await self.updateAsync(dt)
+                await self.__callHook(after_update)
+            except larv.EndProgramException:
+                return None
+            await asyncio.sleep(max(0.0, start + frame - loop.time()))
+            now = loop.time()
+            dt = now - previous
+            previous = now
+
+    async def __callHook(self, function):
+        """Calls the given function (if any), awaiting what it returns if needed."""
+        if function is not None:
+            result = function()
+            if inspect.isawaitable(result):
+                await result
+
+    def __backgroundDue(self, dt):
+        """
+        Returns the list of the covered background engines whose turn it is,
+        adding dt to the time elapsed since the update of every one.
+        """
+        due = []
+        for engine in self.engine_stack[:-1]:
+            policy = self.__policies.get(engine, None)
+            if policy is None or policy[0] != self.BACKGROUND:
+                continue
+            if dt is not None:
+                policy[2] += dt
+            if self.ticks % policy[1] == 0:
+                due.append(engine)
+        return due
+
+    def __updateBackground(self, dt):
+        """Updates the covered background engines whose turn it is."""
+        for engine in self.__backgroundDue(dt):
+            engine.update(self.__policies[engine][2] if dt is not None else None)
+            self.__policies[engine][2] = 0.0
 
-        # Call the postupdate functions
+    def __callPostUpdateFunctions(self):
+        """Calls (and forgets) the postupdate functions."""
         for dic in self.postupdate_functions:
             function = dic['function']
             args = dic['args']
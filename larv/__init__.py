@@ -8,6 +8,18 @@ from larv.System import System
 from larv.GroupManager import GroupManager
 from larv.Entity import Entity
 from larv.World import World
+from larv.CommandBuffer import CommandBuffer
+from larv.ChangeTracker import ChangeTracker
+from larv.Snapshot import Snapshot
+from larv.Replication import ReplicationServer, ReplicationClient, LoopbackTransport
+from larv.SpatialIndex import SpatialIndex
+from larv.QueryView import QueryView
+from larv.ColumnStore import ColumnStore, ColumnRow
+from larv.SparseSet import SparseSet
+from larv.ComponentPool import ComponentPool
+from larv.EngineStats import EngineStats, TimingStats
+from larv.MemoryReport import MemoryReport
+from larv.ShardedEngine import ShardedEngine, ShardSystem, Shard
 
 ## Define custom exceptions
 # General larv exception
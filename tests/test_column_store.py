@@ -0,0 +1,101 @@
+# encoding: UTF-8
+import os
+import sys
+import unittest
+
+import larv
+from larv.ColumnStore import ColumnStore, ColumnRow, numpy
+
+# The examples import their modules as top level ones
+sys.path.insert(0, os.path.join(os.path.dirname(larv.__file__), 'Examples'))
+import HealthComponent
+import HealthSystem
+import RenderComponent
+
+class Velocity(larv.Component):
+    columns = (('x', 'f8'), ('y', 'f8'))
+    def __init__(self, x = 0.0, y = 0.0):
+        self.x = x
+        self.y = y
+
+class Factory(larv.EntityFactory):
+    pass
+
+
+@unittest.skipIf(numpy is None, 'numpy is not installed')
+class ColumnStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.entity_manager = larv.EntityManager()
+        self.entities = self.entity_manager.createEntities(10)
+
+    def testRegisterMovesExistingComponents(self):
+        entity_manager = self.entity_manager
+        for i, entity in enumerate(self.entities[:5]):
+            entity_manager.addComponent(entity, Velocity(i, -i))
+        store = entity_manager.registerColumnarComponent(Velocity)
+        self.assertIsInstance(store, ColumnStore)
+        self.assertIs(entity_manager.registerColumnarComponent(Velocity), store)
+        self.assertIs(entity_manager.getColumns(Velocity), store)
+        self.assertEqual(len(store), 5)
+        self.assertEqual(sorted(store.ids.tolist()), sorted(self.entities[:5]))
+        velocity = entity_manager.getComponent(self.entities[3], Velocity)
+        self.assertIsInstance(velocity, ColumnRow)
+        self.assertEqual((velocity.x, velocity.y), (3.0, -3.0))
+        with self.assertRaises(KeyError):
+            entity_manager.getColumns(HealthComponent.HealthComponent)
+
+    def testVectorizedWrites(self):
+        entity_manager = self.entity_manager
+        entity_manager.registerColumnarComponent(Velocity)
+        entity_manager.addComponents(self.entities, Velocity,
+            {'x': numpy.arange(10.0), 'y': numpy.ones(10)})
+        velocities = entity_manager.getColumns(Velocity)
+        velocities.x += velocities.y * 2
+        velocities.y = 0
+        for i, entity in enumerate(self.entities):
+            velocity = entity_manager.getComponent(entity, Velocity)
+            self.assertEqual((velocity.x, velocity.y), (i + 2.0, 0.0))
+
+        # Writes through a row land in the arrays
+        entity_manager.getComponent(self.entities[4], Velocity).y = 7
+        self.assertEqual(velocities.column('y')[velocities.rowOf(self.entities[4])], 7)
+
+    def testRemovalKeepsRowsPacked(self):
+        entity_manager = self.entity_manager
+        entity_manager.registerColumnarComponent(Velocity)
+        entity_manager.addComponents(self.entities, Velocity,
+            list(Velocity(i, i) for i in range(10)))
+        entity_manager.removeComponent(self.entities[0], Velocity)
+        entity_manager.removeEntity(self.entities[5])
+        velocities = entity_manager.getColumns(Velocity)
+        self.assertEqual(len(velocities.x), 8)
+        self.assertEqual(sorted(zip(velocities.ids.tolist(), velocities.x.tolist())),
+                         list((entity, float(i)) for i, entity in enumerate(self.entities)
+                              if i not in (0, 5)))
+
+
+@unittest.skipIf(numpy is None, 'numpy is not installed')
+class HealthSystemTest(unittest.TestCase):
+    def testDeathMask(self):
+        engine = larv.Engine(Factory())
+        entity_manager = engine.entity_manager
+        Health = HealthComponent.HealthComponent
+        entity_manager.registerColumnarComponent(Health)
+        engine.addSystem(HealthSystem.HealthSystem(), 0)
+        # hp, max hp: alive, dead, dead with a render component, no max hp
+        values = ((5, 10), (0, 10), (-3, 10), (0, 0))
+        entities = entity_manager.createEntities(len(values))
+        entity_manager.addComponents(entities, Health,
+            list(Health(current_hp, max_hp) for current_hp, max_hp in values))
+        entity_manager.addComponent(entities[2], RenderComponent.RenderComponent(None))
+        engine.update()
+
+        self.assertEqual(list(entity_manager.isAlive(entity) for entity in entities),
+                         [True, False, True, True])
+        self.assertEqual(list(entity_manager.getComponent(entity, Health).alive
+                              for entity in (entities[0], entities[2], entities[3])),
+                         [True, False, True])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+# encoding: UTF-8
+import unittest
+
+import larv
+
+class Sprite(larv.Component):
+    def __init__(self, name = ''):
+        self.name = name
+
+class Factory(larv.EntityFactory):
+    pass
+
+
+class CommandBufferTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = larv.Engine(Factory())
+        self.entity_manager = self.engine.entity_manager
+        self.commands = self.engine.commands
+        self.entity = self.entity_manager.createEntity()
+        self.entity_manager.addComponent(self.entity, Sprite('old'))
+
+    def sprite(self):
+        return getattr(self.entity_manager.getComponent(self.entity, Sprite), 'name', None)
+
+    def testChangesWaitForApply(self):
+        self.commands.createEntity(Sprite('new'), group = 'sprites')
+        self.commands.removeEntity(self.entity)
+        self.assertEqual(len(self.commands), 2)
+        self.assertTrue(self.entity_manager.isAlive(self.entity))
+        created = self.commands.apply()
+        self.assertFalse(self.commands)
+        self.assertFalse(self.entity_manager.isAlive(self.entity))
+        self.assertEqual(self.entity_manager.getComponent(created[0], Sprite).name, 'new')
+        self.assertEqual(self.engine.group_manager.get('sprites'), created)
+
+    def testChangesToRemovedEntitiesAreIgnored(self):
+        self.commands.removeEntity(self.entity)
+        self.commands.removeEntity(self.entity)
+        self.commands.addComponent(self.entity, Sprite('late'))
+        self.commands.apply()
+        self.assertFalse(self.entity_manager.isAlive(self.entity))
+
+    def testRemoveThenAddSwapsComponent(self):
+        self.commands.removeComponent(self.entity, Sprite)
+        self.commands.addComponent(self.entity, Sprite('new'))
+        self.commands.apply()
+        self.assertEqual(self.sprite(), 'new')
+
+    def testAddThenRemoveRemovesComponent(self):
+        self.commands.addComponent(self.entity, Sprite('new'))
+        self.commands.removeComponent(self.entity, Sprite)
+        self.commands.apply()
+        self.assertIsNone(self.sprite())
+
+    def testMergeKeepsRecordingOrder(self):
+        # Parent then child, as if recorded one after the other
+        for first, second, expected in ((self.remove, self.add, 'new'),
+                                        (self.add, self.remove, None)):
+            self.setUp()
+            child = self.commands.fork()
+            first(self.commands)
+            second(child)
+            self.commands.merge(child)
+            self.assertFalse(child)
+            self.commands.apply()
+            self.assertEqual(self.sprite(), expected)
+
+    def testRedirect(self):
+        child = self.commands.fork()
+        token = self.commands.redirect(child)
+        try:
+            self.commands.removeComponent(self.entity, Sprite)
+        finally:
+            self.commands.endRedirect(token)
+        self.assertFalse(self.commands)
+        self.assertEqual(len(child), 1)
+        self.commands.merge(child)
+        self.commands.apply()
+        self.assertIsNone(self.sprite())
+
+    def add(self, commands):
+        commands.addComponent(self.entity, Sprite('new'))
+
+    def remove(self, commands):
+        commands.removeComponent(self.entity, Sprite)
+
+
+if __name__ == '__main__':
+    unittest.main()
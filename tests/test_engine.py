@@ -0,0 +1,133 @@
+# encoding: UTF-8
+import asyncio
+import unittest
+
+import larv
+
+class EngineTag(larv.Component):
+    def __init__(self, name = ''):
+        self.name = name
+
+class Factory(larv.EntityFactory):
+    pass
+
+class Recorder(larv.System):
+    def __init__(self, log, name):
+        self.log = log
+        self.name = name
+
+    def update(self):
+        self.log.append(self.name)
+
+    def __repr__(self):
+        return 'Recorder({0})'.format(self.name)
+
+class Input(Recorder):
+    pass
+
+class Render(Recorder):
+    pass
+
+
+class PlanTest(unittest.TestCase):
+    def setUp(self):
+        self.log = []
+        self.engine = larv.Engine(Factory())
+
+    def add(self, system_class, name, priority, **constraints):
+        system = system_class(self.log, name)
+        self.engine.addSystem(system, priority, **constraints)
+        return system
+
+    def names(self):
+        return list(system.name for system in self.engine.plan)
+
+    def testPriorityOrder(self):
+        self.add(Recorder, 'c', 2)
+        self.add(Recorder, 'a', 0)
+        self.add(Recorder, 'b', 1)
+        self.assertEqual(self.names(), ['a', 'b', 'c'])
+        self.engine.update()
+        self.assertEqual(self.log, ['a', 'b', 'c'])
+
+    def testConstrainedSystemMovesInFrontOfTarget(self):
+        a = self.add(Recorder, 'a', 0)
+        self.add(Recorder, 'b', 1)
+        self.add(Recorder, 'c', 2, before = (a,))
+        self.assertEqual(self.names(), ['c', 'a', 'b'])
+        self.add(Recorder, 'd', 3)
+        self.assertEqual(self.names(), ['c', 'a', 'b', 'd'])
+
+    def testClassConstraints(self):
+        self.add(Render, 'render', 0)
+        self.add(Recorder, 'physics', 1, after = (Input,))
+        self.add(Input, 'input', 2, before = (Render,))
+        self.assertEqual(self.names(), ['input', 'render', 'physics'])
+        self.engine.update()
+        self.assertEqual(self.log, ['input', 'render', 'physics'])
+
+    def testCycleIsRejected(self):
+        a = self.add(Recorder, 'a', 0)
+        b = self.add(Recorder, 'b', 1, after = (a,))
+        with self.assertRaises(larv.LarvException) as caught:
+            self.add(Recorder, 'c', 2, before = (a,), after = (b,))
+        self.assertIn('Recorder(a) (priority 0)', str(caught.exception))
+        self.assertIn('Recorder(c) (priority 2)', str(caught.exception))
+        self.assertEqual(self.names(), ['a', 'b'])
+        with self.assertRaises(larv.LarvException):
+            self.engine.setSystemConstraints(a, after = (b,))
+        self.assertEqual(self.names(), ['a', 'b'])
+
+
+class Waiter(larv.System):
+    """Coroutine system waiting on I/O, that doesn't touch any component."""
+    reads = ()
+    writes = ()
+
+    def __init__(self, name, wait_for, signal):
+        self.name = name
+        self.wait_for = wait_for
+        self.signal = signal
+
+    async def update(self):
+        self.signal.set()
+        await asyncio.wait_for(self.wait_for.wait(), 1.0)
+        self.commands.createEntity(EngineTag(self.name))
+
+
+class AsyncTest(unittest.TestCase):
+    def testCoroutineSystemsOverlap(self):
+        async def run():
+            engine = larv.Engine(Factory())
+            first, second = asyncio.Event(), asyncio.Event()
+            # Each one waits for the other: only done if awaited concurrently
+            engine.addSystem(Waiter('first', second, first), 0)
+            engine.addSystem(Waiter('second', first, second), 1)
+            await engine.updateAsync()
+            return engine
+        engine = asyncio.run(run())
+        entity_manager = engine.entity_manager
+        names = list(entity_manager.getComponent(entity, EngineTag).name
+                     for entity in sorted(entity_manager.entities))
+        # Commands recorded concurrently are applied in plan order
+        self.assertEqual(names, ['first', 'second'])
+
+    def testRunAsyncStopsWhenStackIsEmpty(self):
+        log = []
+        engine = larv.Engine(Factory())
+        engine.addSystem(Recorder(log, 'tick'), 0)
+        world = larv.World()
+        world.push(engine)
+        frames = []
+        def afterUpdate():
+            frames.append(engine.ticks)
+            if len(frames) == 3:
+                world.pop()
+        asyncio.run(world.runAsync(fps = 1000, after_update = afterUpdate))
+        self.assertEqual(frames, [1, 2, 3])
+        self.assertEqual(log, ['tick'] * 3)
+        self.assertEqual(world.engine_stack, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+# encoding: UTF-8
+import unittest
+
+import larv
+from larv.ColumnStore import numpy
+
+class Position(larv.Component):
+    columns = (('x', 'f8'), ('y', 'f8'))
+    def __init__(self, x = 0.0, y = 0.0):
+        self.x = x
+        self.y = y
+
+class Health(larv.Component):
+    def __init__(self, hp = 10):
+        self.hp = hp
+
+
+class QueryTest(unittest.TestCase):
+    def setUp(self):
+        self.entity_manager = larv.EntityManager()
+        self.entities = self.entity_manager.createEntities(20)
+        self.entity_manager.addComponents(self.entities, Position,
+            list(Position(i, i) for i in range(20)))
+        self.entity_manager.addComponents(self.entities, Health,
+            list(Health(i) for i in range(20)))
+
+    def removeWhileIterating(self, *components):
+        entity_manager = self.entity_manager
+        seen = []
+        for row in entity_manager.query(*components):
+            entity = row[0]
+            seen.append(entity)
+            # Remove the entity being visited and one not visited yet
+            entity_manager.removeEntity(entity)
+            others = list(other for other in self.entities
+                          if other not in seen and entity_manager.isAlive(other))
+            if others:
+                entity_manager.removeEntity(others[-1])
+                seen.append(others[-1])
+        self.assertEqual(len(seen), 20)
+        self.assertEqual(len(entity_manager.entities), 0)
+        self.assertEqual(list(entity_manager.query(*components)), [])
+
+    def testRemoveDuringQuerySparseSet(self):
+        self.removeWhileIterating(Health)
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def testRemoveDuringQueryColumnStore(self):
+        self.entity_manager.registerColumnarComponent(Position)
+        self.removeWhileIterating(Position)
+        self.setUp()
+        self.entity_manager.registerColumnarComponent(Position)
+        self.removeWhileIterating(Position, Health)
+
+    def testQuerySkipsRemovedComponents(self):
+        entity_manager = self.entity_manager
+        visited = 0
+        for entity, health, position in entity_manager.query(Health, Position):
+            visited += 1
+            for other in reversed(self.entities):
+                if entity_manager.hasComponent(other, Position):
+                    entity_manager.removeComponent(other, Position)
+                    break
+        self.assertEqual(visited, 10)
+
+
+class IdTest(unittest.TestCase):
+    def setUp(self):
+        self.entity_manager = larv.EntityManager()
+
+    def testRemovedIndexIsReusedWithNewGeneration(self):
+        entity_manager = self.entity_manager
+        entity = entity_manager.createEntity()
+        entity_manager.addComponent(entity, Health())
+        entity_manager.removeEntity(entity)
+        reused = entity_manager.createEntity()
+        self.assertEqual(reused.index, entity.index)
+        self.assertEqual(reused.generation, entity.generation + 1)
+        self.assertNotEqual(reused, entity)
+        self.assertFalse(entity_manager.isAlive(entity))
+        self.assertTrue(entity_manager.isAlive(reused))
+        self.assertFalse(entity_manager.hasComponent(reused, Health))
+
+    def testCreateEntitiesReusesFreeIndicesFirst(self):
+        entity_manager = self.entity_manager
+        entities = entity_manager.createEntities(4)
+        entity_manager.removeEntity(entities[1])
+        entity_manager.removeEntity(entities[3])
+        created = entity_manager.createEntities(3)
+        self.assertEqual(list(entity.index for entity in created),
+                         [entities[1].index, entities[3].index, entities[3].index + 1])
+        self.assertEqual(list(entity.generation for entity in created), [1, 1, 0])
+        self.assertEqual(len(set(created) | set(entities)), 7)
+        self.assertEqual(entity_manager.getHandle(created[0].id), created[0])
+        self.assertIsNone(entity_manager.getHandle(entities[1].id))
+
+
+class PoolTest(unittest.TestCase):
+    def setUp(self):
+        self.entity_manager = larv.EntityManager()
+        self.entities = self.entity_manager.createEntities(3)
+
+    def testRemovedAndReplacedComponentsGoBack(self):
+        entity_manager = self.entity_manager
+        pool = entity_manager.enablePool(Health)
+        entity = self.entities[0]
+        first = entity_manager.acquire(Health, 1)
+        entity_manager.addComponent(entity, first)
+        entity_manager.addComponent(entity, first)
+        self.assertEqual(pool.released, 0)
+        entity_manager.addComponent(entity, entity_manager.acquire(Health, 2))
+        self.assertEqual(pool.released, 1)
+        self.assertIs(entity_manager.acquire(Health, 3), first)
+        entity_manager.removeComponent(entity, Health)
+        entity_manager.addComponent(self.entities[1], Health())
+        entity_manager.removeEntity(self.entities[1])
+        self.assertEqual(pool.released, 3)
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def testColumnarComponentsAreNotReleased(self):
+        entity_manager = self.entity_manager
+        entity_manager.registerColumnarComponent(Position)
+        pool = entity_manager.enablePool(Position)
+        entity_manager.addComponents(self.entities, Position,
+            list(entity_manager.acquire(Position, i, i) for i in range(3)))
+        entity_manager.removeComponent(self.entities[0], Position)
+        entity_manager.removeEntity(self.entities[1])
+        self.assertEqual((pool.released, len(pool)), (0, 0))
+        self.assertEqual(entity_manager.getColumns(Position).x.tolist(), [2.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
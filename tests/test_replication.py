@@ -0,0 +1,94 @@
+# encoding: UTF-8
+import unittest
+
+import larv
+
+class ReplicatedPosition(larv.Component):
+    def __init__(self, x = 0, y = 0):
+        self.x = x
+        self.y = y
+
+class ReplicatedHealth(larv.Component):
+    def __init__(self, hp = 10):
+        self.hp = hp
+
+class Factory(larv.EntityFactory):
+    pass
+
+
+class ReplicationTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = larv.Engine(Factory())
+        entity_manager = self.entity_manager = self.engine.entity_manager
+        self.entities = entity_manager.createEntities(20)
+        for i, entity in enumerate(self.entities):
+            entity_manager.addComponent(entity, ReplicatedPosition(i, 0))
+            if i % 2 == 0:
+                entity_manager.addComponent(entity, ReplicatedHealth(i))
+        self.engine.group_manager.add(self.entities[0], 'hero')
+
+        self.server = larv.ReplicationServer(self.engine, (ReplicatedPosition, ReplicatedHealth))
+        self.all_transport = larv.LoopbackTransport()
+        self.near_transport = larv.LoopbackTransport()
+        self.server.addClient(self.all_transport)
+        self.server.addClient(self.near_transport, interest = self.isNear)
+        self.all_client = larv.ReplicationClient(larv.Engine(Factory()), self.all_transport)
+        self.near_client = larv.ReplicationClient(larv.Engine(Factory()), self.near_transport)
+
+    def isNear(self, entity):
+        return self.entity_manager.getComponent(entity, ReplicatedPosition).x < 5
+
+    def sync(self):
+        self.server.update()
+        self.all_client.update()
+        self.near_client.update()
+
+    def assertMirrors(self, client, interest = None):
+        entity_manager = self.entity_manager
+        expected = {}
+        for entity in entity_manager.getEntitiesHavingComponent(ReplicatedPosition):
+            if interest is None or interest(entity):
+                expected[entity.id] = self.describe(self.engine, entity)
+        mirrored = dict((id_, self.describe(client.engine, entity))
+                        for id_, entity in client.entities.items())
+        self.assertEqual(mirrored, expected)
+
+    def describe(self, engine, entity):
+        entity_manager = engine.entity_manager
+        position = entity_manager.getComponent(entity, ReplicatedPosition)
+        health = entity_manager.getComponent(entity, ReplicatedHealth)
+        return ((position.x, position.y), getattr(health, 'hp', None),
+                sorted(engine.group_manager.getGroups(entity)))
+
+    def testInitialStateAndInterest(self):
+        self.sync()
+        self.assertMirrors(self.all_client)
+        self.assertMirrors(self.near_client, self.isNear)
+        self.assertEqual(len(self.near_client.entities), 5)
+
+    def testDeltas(self):
+        self.sync()
+        idle_bytes = self.all_transport.bytes_sent
+        self.sync()
+        self.assertLess(self.all_transport.bytes_sent - idle_bytes, 16)
+
+        entity_manager = self.entity_manager
+        entities = self.entities
+        entity_manager.getComponent(entities[1], ReplicatedPosition).x = 50  # leaves the interest
+        entity_manager.markChanged(entities[1], ReplicatedPosition)
+        entity_manager.getComponent(entities[10], ReplicatedPosition).x = 2  # enters it
+        entity_manager.markChanged(entities[10], ReplicatedPosition)
+        entity_manager.removeComponent(entities[2], ReplicatedHealth)
+        entity_manager.addComponent(entities[3], ReplicatedHealth(99))
+        entity_manager.removeEntity(entities[4])
+        self.engine.group_manager.add(entities[3], 'enemies')
+        self.engine.group_manager.remove(entities[0], 'hero')
+        self.sync()
+        self.assertMirrors(self.all_client)
+        self.assertMirrors(self.near_client, self.isNear)
+        self.assertNotIn(entities[1].id, self.near_client.entities)
+        self.assertIn(entities[10].id, self.near_client.entities)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+# encoding: UTF-8
+import os
+import tempfile
+import unittest
+
+import larv
+from larv.ColumnStore import numpy
+
+class SnapshotPosition(larv.Component):
+    columns = (('x', 'f8'), ('y', 'f8'))
+    def __init__(self, x = 0.0, y = 0.0):
+        self.x = x
+        self.y = y
+
+class SnapshotName(larv.Component):
+    def __init__(self, name = ''):
+        self.name = name
+
+class Factory(larv.EntityFactory):
+    pass
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix = '.snap')
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def fill(self, engine):
+        entity_manager = engine.entity_manager
+        entities = entity_manager.createEntities(10)
+        entity_manager.addComponents(entities, SnapshotPosition,
+            list(SnapshotPosition(i, -i) for i in range(10)))
+        for entity in entities[:5]:
+            entity_manager.addComponent(entity, SnapshotName('n{0}'.format(entity.index)))
+        entity_manager.removeEntity(entities[7])
+        engine.group_manager.add(entities[0], 'hero')
+        engine.group_manager.add(entities[1], 'enemies')
+        engine.group_manager.add(entities[2], 'enemies')
+        return entities
+
+    def state(self, engine):
+        entity_manager = engine.entity_manager
+        components = sorted(
+            (entity, (position.x, position.y),
+             getattr(entity_manager.getComponent(entity, SnapshotName), 'name', None))
+            for entity, position in entity_manager.query(SnapshotPosition))
+        groups = dict((group, sorted(engine.group_manager.get(group)))
+                      for group in ('hero', 'enemies'))
+        return sorted(entity_manager.entities), components, groups
+
+    def roundTrip(self, columnar):
+        engine = larv.Engine(Factory())
+        if columnar:
+            engine.entity_manager.registerColumnarComponent(SnapshotPosition)
+        entities = self.fill(engine)
+        expected = self.state(engine)
+        engine.saveSnapshot(self.path)
+
+        loaded = larv.Engine(Factory())
+        loaded.entity_manager.createEntities(3)
+        loaded.loadSnapshot(self.path)
+        self.assertEqual(self.state(loaded), expected)
+
+        # The id allocation state comes back too: the removed index is reused
+        entity_manager = loaded.entity_manager
+        self.assertFalse(entity_manager.isAlive(entities[7]))
+        reused = entity_manager.createEntity()
+        self.assertEqual(reused.index, entities[7].index)
+        self.assertEqual(reused.generation, entities[7].generation + 1)
+
+    def testRoundTrip(self):
+        self.roundTrip(columnar = False)
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def testRoundTripColumnar(self):
+        self.roundTrip(columnar = True)
+
+    def testQueryViewsAfterLoad(self):
+        engine = larv.Engine(Factory())
+        entities = self.fill(engine)
+        entity_manager = engine.entity_manager
+        view = entity_manager.registerQuery(SnapshotPosition, SnapshotName)
+        expected = sorted(view)
+        engine.saveSnapshot(self.path)
+        entity_manager.removeEntity(entities[1])
+        engine.loadSnapshot(self.path)
+        self.assertEqual(sorted(view), expected)
+        self.assertEqual(sorted(view.entities), expected)
+        entity_manager.removeComponent(entities[0], SnapshotName)
+        self.assertEqual(sorted(view), expected[1:])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+# encoding: UTF-8
+import glob
+import os
+import tempfile
+import unittest
+
+import larv
+
+class WorldPosition(larv.Component):
+    def __init__(self, x = 0, y = 0):
+        self.x = x
+        self.y = y
+
+class Factory(larv.EntityFactory):
+    pass
+
+class Counter(larv.System):
+    def __init__(self):
+        self.ticks = 0
+        self.delta_times = []
+
+    def update(self):
+        self.ticks += 1
+        self.delta_times.append(self.delta_time)
+
+
+class WorldTest(unittest.TestCase):
+    def setUp(self):
+        self.world = larv.World()
+        self.engines = list(larv.Engine(Factory()) for i in range(2))
+        self.counters = list(Counter() for engine in self.engines)
+        for engine, counter in zip(self.engines, self.counters):
+            engine.addSystem(counter, 0)
+        self.snapshots = self.snapshotFiles()
+
+    def tearDown(self):
+        self.world.close()
+
+    def snapshotFiles(self):
+        return set(glob.glob(os.path.join(tempfile.gettempdir(), 'larv-*.snap')))
+
+    def newSnapshotFiles(self):
+        return self.snapshotFiles() - self.snapshots
+
+    def testSuspended(self):
+        below, top = self.engines
+        self.world.push(below)
+        self.world.push(top)
+        for i in range(5):
+            self.world.update(0.1)
+        self.assertEqual(self.counters[0].ticks, 0)
+        self.assertEqual(self.counters[1].ticks, 5)
+        self.assertIs(self.world.pop(), top)
+        self.world.update(0.1)
+        self.assertEqual(self.counters[0].ticks, 1)
+
+    def testBackgroundCadenceAndElapsedTime(self):
+        below, top = self.engines
+        self.world.push(below, policy = larv.World.BACKGROUND, every = 3)
+        self.world.push(top)
+        for i in range(9):
+            self.world.update(0.1)
+        self.assertEqual(self.counters[1].ticks, 9)
+        self.assertEqual(self.counters[0].ticks, 3)
+        # Every background update gets the time elapsed since the previous one
+        for delta_time in self.counters[0].delta_times[1:]:
+            self.assertAlmostEqual(delta_time, 0.3)
+
+    def testPagedRoundTrip(self):
+        below, top = self.engines
+        entity_manager = below.entity_manager
+        entities = entity_manager.createEntities(5)
+        for i, entity in enumerate(entities):
+            entity_manager.addComponent(entity, WorldPosition(i, -i))
+        below.group_manager.add(entities[0], 'hero')
+        view = entity_manager.registerQuery(WorldPosition)
+        index = larv.SpatialIndex(entity_manager, WorldPosition, 4)
+        self.assertEqual(len(index.queryRadius(0, 0, 100)), 5)
+
+        self.world.push(below, policy = larv.World.PAGED)
+        self.world.push(top)
+        self.assertTrue(self.world.isPagedOut(below))
+        self.assertEqual(len(self.newSnapshotFiles()), 1)
+        self.assertEqual(len(entity_manager.entities), 0)
+        self.assertEqual(list(view), [])
+        self.assertEqual(index.queryRadius(0, 0, 100), [])
+        self.world.update(0.1)
+        self.assertEqual(self.counters[0].ticks, 0)
+
+        self.world.pop()
+        self.assertFalse(self.world.isPagedOut(below))
+        self.assertEqual(self.newSnapshotFiles(), set())
+        self.assertEqual(sorted(entity_manager.entities), entities)
+        self.assertEqual(entity_manager.getComponent(entities[3], WorldPosition).x, 3)
+        self.assertEqual(below.group_manager.get('hero'), [entities[0]])
+        self.assertEqual(sorted(view), entities)
+        self.assertEqual(sorted(index.queryRadius(0, 0, 100)), entities)
+
+    def testCloseDeletesSnapshotFiles(self):
+        below, top = self.engines
+        below.entity_manager.createEntities(3)
+        self.world.push(below, policy = larv.World.PAGED)
+        self.world.push(top)
+        self.assertEqual(len(self.newSnapshotFiles()), 1)
+        self.world.close()
+        self.assertEqual(self.newSnapshotFiles(), set())
+        self.assertFalse(self.world.isPagedOut(below))
+
+
+if __name__ == '__main__':
+    unittest.main()